@@ -115,10 +115,10 @@ Child AI 提交的分析：
             sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
             from master_vault_engine import list_vault_entries
             
-            entries = list_vault_entries(role="Superintendent Admin")
+            entries = list_vault_entries(role="Superintendent Admin", limit=limit)
             
             history = []
-            for entry in entries[:limit]:
+            for entry in entries:
                 history.append({
                     "id": entry[0] if len(entry) > 0 else None,
                     "title": entry[1] if len(entry) > 1 else "未知标题",
@@ -102,7 +102,7 @@ class LynkerEngine:
             
             from master_vault_engine import list_vault_entries
             
-            entries = list_vault_entries(role="Superintendent Admin")
+            entries = list_vault_entries(role="Superintendent Admin", limit=3)
             
             if not entries:
                 print("INFO: Master Vault has no knowledge entries", flush=True)
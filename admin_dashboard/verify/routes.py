@@ -5,7 +5,7 @@
 import os
 import json
 import re
-from flask import Blueprint, request, jsonify, render_template, session
+from flask import Blueprint, request, jsonify, render_template, session, Response, stream_with_context
 from flask_login import login_required, current_user
 from supabase import create_client
 import pytesseract
@@ -23,9 +23,9 @@ from verify.ai_prompts import get_primary_ai_prompt, get_ai_names_from_db
 from verify.ai_verifier import verify_chart_with_ai, verify_chart_without_ai, get_current_uploaded_charts
 from verify.child_ai_hints import generate_child_ai_hint
 from verify.wizard_loader import load_latest_wizard
-from verify.ziwei_vision_agent import ZiweiVisionAgent
-from verify.ziwei_normalizer import normalize_ziwei, validate_ziwei_structure
+from verify.ziwei_normalizer import normalize_ziwei
 from verify.ziwei_analysis_agent import ZiweiAnalysisAgent
+from verify.ziwei_pipeline_jobs import run_ziwei_pipeline, get_pipeline_jobs
 
 # ✅ 热加载 ziwei_normalizer 和 ziwei_analysis_agent 模块，确保使用最新版本
 import importlib
@@ -1148,120 +1148,20 @@ def ziwei_full_pipeline():
             "toast": "❌ 请上传紫微命盘图片"
         }), 400
     
-    progress_messages = []
-    
-    def progress_callback(msg):
-        """收集进度消息"""
-        progress_messages.append(msg)
-        print(msg)
-    
     try:
-        # Layer 1: OCR 识别
         mode_label = "🔍 严格OCR" if ocr_mode == "strict" else "🧠 智能分析"
         print("=" * 50)
-        print(f"🔮 第1层：GPT-4-Turbo-Vision OCR 识别 ({mode_label})")
-        print("=" * 50)
-        
-        vision_agent = ZiweiVisionAgent()
-        raw_result = vision_agent.process_image(image_base64, progress_callback, ocr_mode)
-        
-        if not raw_result.get("success"):
-            return jsonify({
-                "ok": False,
-                "error": raw_result.get("error", "OCR 识别失败"),
-                "toast": f"❌ OCR 识别失败: {raw_result.get('error', '未知错误')}",
-                "progress": progress_messages
-            }), 500
-        
-        # Layer 2: 标准化
-        print("=" * 50)
-        print("📋 第2层：JSON 标准化为 ZiweiAI_v1.0")
-        print("=" * 50)
-        
-        # 获取用户资料用于自动补全
-        user_profile = None
-        try:
-            from flask_login import current_user
-            if current_user and current_user.is_authenticated:
-                user_profile = {
-                    "gender": getattr(current_user, 'gender', None),
-                    "birth_time": getattr(current_user, 'birth_time', None)
-                }
-                print(f"[Pipeline] 获取到用户资料: {user_profile}")
-        except Exception as e:
-            print(f"[Pipeline] 无法获取用户资料: {e}")
-        
-        normalized = normalize_ziwei(raw_result, user_profile=user_profile)
-        
-        if not normalized.get("success"):
-            return jsonify({
-                "ok": False,
-                "error": normalized.get("error", "标准化失败"),
-                "raw": raw_result,
-                "toast": f"❌ 数据标准化失败: {normalized.get('error', '未知错误')}",
-                "progress": progress_messages
-            }), 500
-        
-        # 验证数据结构
-        validation = validate_ziwei_structure(normalized)
-        if validation["warnings"]:
-            print(f"⚠️ 数据验证警告: {validation['warnings']}")
-        
-        # Layer 3: AI 分析
-        print("=" * 50)
-        print("🧠 第3层：AI 命理分析")
+        print(f"🔮 紫微命盘三层流程 ({mode_label})")
         print("=" * 50)
         
-        analysis_agent = ZiweiAnalysisAgent()
-        analysis_result = analysis_agent.analyze_ziwei(normalized)
-        
-        if not analysis_result.get("success"):
-            # 即使分析失败，也返回前两层的结果
-            return jsonify({
-                "ok": True,
-                "raw": raw_result,
-                "standardized": normalized,
-                "analysis": None,
-                "analysis_error": analysis_result.get("error", "分析失败"),
-                "validation": validation,
-                "toast": "⚠️ 命盘识别和标准化完成，但 AI 分析失败",
-                "progress": progress_messages
-            })
-        
-        # 生成简短摘要
-        brief_summary = analysis_agent.generate_brief_summary(normalized)
-        
-        # 全部成功
-        print("=" * 50)
-        print("✅ 三层流程全部完成")
-        print("=" * 50)
-        
-        result = {
-            "ok": True,
-            "raw": raw_result,
-            "standardized": normalized,
-            "analysis": analysis_result.get("analysis"),
-            "brief_summary": brief_summary,
-            "validation": validation,
-            "ocr_mode": ocr_mode,
-            "toast": "✅ 紫微命盘识别与分析完成",
-            "progress": progress_messages
-        }
+        result, status_code = run_ziwei_pipeline(image_base64, ocr_mode, _current_user_profile())
         
         # 调试日志：打印返回数据的结构
         print(f"[ZiweiPipeline] 返回数据的顶层键: {list(result.keys())}")
-        if result.get("raw"):
-            print(f"[ZiweiPipeline] raw 数据的键: {list(result['raw'].keys())}")
-        if result.get("standardized"):
-            print(f"[ZiweiPipeline] standardized 数据的键: {list(result['standardized'].keys())}")
-            if result['standardized'].get('basic_info'):
-                print(f"[ZiweiPipeline] basic_info: {result['standardized']['basic_info']}")
-            if result['standardized'].get('star_map'):
-                print(f"[ZiweiPipeline] star_map 宫位数: {len(result['standardized']['star_map'])}")
-        if result.get("analysis"):
-            print(f"[ZiweiPipeline] analysis 数据的键: {list(result['analysis'].keys())}")
-        
-        return jsonify(result)
+        if result.get("standardized") and result['standardized'].get('star_map'):
+            print(f"[ZiweiPipeline] star_map 宫位数: {len(result['standardized']['star_map'])}")
+        
+        return jsonify(result), status_code
         
     except Exception as e:
         print(f"❌ 紫微命盘处理失败: {e}")
@@ -1272,10 +1172,131 @@ def ziwei_full_pipeline():
             "ok": False,
             "error": str(e),
             "toast": f"❌ 处理失败: {str(e)}",
-            "progress": progress_messages
+            "progress": []
         }), 500
 
 
+def _current_user_profile():
+    """获取用户资料用于标准化时自动补全（须在请求上下文中调用）"""
+    try:
+        if current_user and current_user.is_authenticated:
+            user_profile = {
+                "gender": getattr(current_user, 'gender', None),
+                "birth_time": getattr(current_user, 'birth_time', None)
+            }
+            print(f"[Pipeline] 获取到用户资料: {user_profile}")
+            return user_profile
+    except Exception as e:
+        print(f"[Pipeline] 无法获取用户资料: {e}")
+    return None
+
+
+def _get_own_job(job_id):
+    job = get_pipeline_jobs().get(job_id)
+    if job is None or job.owner_id != str(current_user.id):
+        return None
+    return job
+
+
+@bp.post("/api/ziwei/jobs")
+@login_required
+def submit_ziwei_job():
+    """
+    异步提交紫微命盘识别任务（参数同 /api/ziwei/full_pipeline）
+    
+    返回 202:
+        {"ok": true, "job_id": str, "status_url": str, "events_url": str}
+    
+    之后通过 GET /api/ziwei/jobs/<job_id> 查询结果，
+    或 GET /api/ziwei/jobs/<job_id>/events 以 SSE 订阅进度
+    任务状态保存在共享的 SQLite（ZIWEI_PIPELINE_JOBS_DB），多 worker 部署时查询可落到任意进程
+    """
+    data = request.get_json() or {}
+    image_base64 = data.get("image_base64")
+    ocr_mode = data.get("ocr_mode") or request.args.get("ocr_mode", "intelligent")
+    
+    if not image_base64:
+        return jsonify({
+            "ok": False,
+            "error": "缺少命盘图片",
+            "toast": "❌ 请上传紫微命盘图片"
+        }), 400
+    
+    job = get_pipeline_jobs().submit(
+        image_base64,
+        ocr_mode=ocr_mode,
+        user_profile=_current_user_profile(),
+        owner_id=str(current_user.id)
+    )
+    if job is None:
+        return jsonify({
+            "ok": False,
+            "error": "任务队列已满",
+            "toast": "⏳ 当前识别任务较多，请稍后再试"
+        }), 429
+    
+    return jsonify({
+        "ok": True,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"{bp.url_prefix}/api/ziwei/jobs/{job.id}",
+        "events_url": f"{bp.url_prefix}/api/ziwei/jobs/{job.id}/events"
+    }), 202
+
+
+@bp.get("/api/ziwei/jobs/<job_id>")
+@login_required
+def get_ziwei_job(job_id):
+    """查询任务状态；完成后 result 与 /api/ziwei/full_pipeline 的响应一致"""
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "任务不存在或已过期"}), 404
+    return jsonify({"ok": True, **job.snapshot()})
+
+
+@bp.get("/api/ziwei/jobs/<job_id>/events")
+@login_required
+def stream_ziwei_job(job_id):
+    """
+    SSE 订阅任务进度：
+        data: {"stage": "vision"}
+        data: {"progress": "🔮 启动 ..."}
+        data: {"done": true, "status": "done", "result": {...}}
+    """
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "任务不存在或已过期"}), 404
+    jobs = get_pipeline_jobs()
+    
+    def generate():
+        cursor = 0
+        while True:
+            events, cursor, finished = jobs.wait_events(job.id, cursor)
+            for event in events:
+                if event["type"] == "stage":
+                    payload = {"stage": event["stage"]}
+                else:
+                    payload = {"progress": event["message"]}
+                yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            if finished:
+                done_job = jobs.get(job.id) or job
+                final = {"done": True, "status": done_job.status, "result": done_job.result}
+                yield f"data: {json.dumps(final, ensure_ascii=False, default=str)}\n\n"
+                return
+            if not events:
+                # 保持连接
+                yield ": keep-alive\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
 @bp.post("/api/ziwei/upload_json")
 @login_required
 def upload_ziwei_json():
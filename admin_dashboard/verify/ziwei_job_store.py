@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+🔧 LynkerAI 紫微斗数验证系统 - 命盘识别任务存储（SQLite，WAL 模式）
+
+多个 worker / 进程共用同一个数据库文件：
+- 任务在提交它的进程中执行，状态、阶段、进度消息与最终结果逐条写入
+- 任意进程都能按 job_id 查询状态、读取进度事件（SSE 跨进程时按游标轮询）
+- 已结束的任务在 TTL 到期后清理；执行进程异常退出留下的未完成任务超时后标记为失败
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+FINISHED_STATUSES = ("done", "failed")
+PURGE_INTERVAL = 300
+
+
+class ZiweiJobStore:
+    def __init__(self, path, ttl: float = 3600):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+        if self.path.parent != Path(""):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ziwei_jobs (
+                job_id TEXT PRIMARY KEY,
+                owner_id TEXT,
+                ocr_mode TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                status_code INTEGER,
+                result TEXT,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ziwei_job_events (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                event TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ziwei_jobs_finished ON ziwei_jobs(finished_at)")
+        self.conn.commit()
+
+    # ---------- 写入 ----------
+    def create(self, job_id, owner_id, ocr_mode, created_at):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO ziwei_jobs (job_id, owner_id, ocr_mode, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, owner_id, ocr_mode, created_at)
+            )
+            self.conn.commit()
+        if time.time() - self._purged_at > PURGE_INTERVAL:
+            self.purge_expired()
+
+    def set_status(self, job_id, status):
+        with self._lock:
+            self.conn.execute("UPDATE ziwei_jobs SET status = ? WHERE job_id = ?", (status, job_id))
+            self.conn.commit()
+
+    def append_event(self, job_id, seq, event):
+        """追加一条进度事件；阶段事件同时更新任务的当前阶段"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO ziwei_job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                (job_id, seq, json.dumps(event, ensure_ascii=False))
+            )
+            if event.get("type") == "stage":
+                self.conn.execute("UPDATE ziwei_jobs SET stage = ? WHERE job_id = ?", (event["stage"], job_id))
+            self.conn.commit()
+
+    def finish(self, job_id, status, status_code, result, finished_at):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE ziwei_jobs SET status = ?, status_code = ?, result = ?, finished_at = ? WHERE job_id = ?",
+                (status, status_code, json.dumps(result, ensure_ascii=False, default=str), finished_at, job_id)
+            )
+            self.conn.commit()
+
+    def purge_expired(self) -> int:
+        """删除过期的已结束任务；超时仍未结束的任务（执行进程已退出）标记为失败"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                """
+                UPDATE ziwei_jobs SET status = 'failed', status_code = 500, finished_at = ?,
+                    result = '{"ok": false, "error": "任务执行中断", "toast": "❌ 识别任务中断，请重新提交"}'
+                WHERE finished_at IS NULL AND created_at <= ?
+                """,
+                (now, now - self.ttl)
+            )
+            expired = [r[0] for r in self.conn.execute(
+                "SELECT job_id FROM ziwei_jobs WHERE finished_at IS NOT NULL AND finished_at <= ?", (now - self.ttl,)
+            ).fetchall()]
+            self.conn.executemany("DELETE FROM ziwei_job_events WHERE job_id = ?", [(j,) for j in expired])
+            self.conn.executemany("DELETE FROM ziwei_jobs WHERE job_id = ?", [(j,) for j in expired])
+            self.conn.commit()
+            self._purged_at = now
+            return len(expired)
+
+    # ---------- 读取 ----------
+    def get(self, job_id):
+        """返回任务行 dict（不含事件），不存在时返回 None"""
+        with self._lock:
+            row = self.conn.execute(
+                """
+                SELECT job_id, owner_id, ocr_mode, status, stage, status_code, result, created_at, finished_at
+                FROM ziwei_jobs WHERE job_id = ?
+                """,
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "owner_id": row[1],
+            "ocr_mode": row[2],
+            "status": row[3],
+            "stage": row[4],
+            "status_code": row[5],
+            "result": json.loads(row[6]) if row[6] else None,
+            "created_at": row[7],
+            "finished_at": row[8]
+        }
+
+    def events(self, job_id, start=0):
+        """按顺序返回 seq >= start 的事件"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT event FROM ziwei_job_events WHERE job_id = ? AND seq >= ? ORDER BY seq",
+                (job_id, start)
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+🔧 LynkerAI 紫微斗数验证系统 - 命盘识别任务队列
+将 /api/ziwei/full_pipeline 的三层流程移出 HTTP 请求线程
+
+- submit() 立即返回 job_id，后台线程池依次执行 vision → parse → normalize → analysis
+- 进度消息与结果实时写入共享的 SQLite（ziwei_job_store），多 worker / 多进程部署时
+  任意进程都能查询任务或经 SSE 订阅进度（wait_events）
+- 按图片内容哈希缓存：
+    Vision 模型原始输出   (图片哈希, ocr_mode)              → 内存 LRU + 磁盘 JSON，同一截图重复上传不再调用 Vision 模型
+    完整流程结果          (图片哈希, ocr_mode, 用户资料)      → 内存 LRU，同一用户重复上传直接返回
+- 完成的任务保留 JOB_TTL 秒后清理
+"""
+
+import os
+import json
+import base64
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from verify.ziwei_job_store import ZiweiJobStore
+from verify.ziwei_vision_agent import ZiweiVisionAgent
+from verify.ziwei_normalizer import normalize_ziwei, validate_ziwei_structure
+from verify.ziwei_analysis_agent import ZiweiAnalysisAgent
+
+PIPELINE_WORKERS = int(os.getenv("ZIWEI_PIPELINE_WORKERS", "4"))
+MAX_PENDING_JOBS = int(os.getenv("ZIWEI_PIPELINE_MAX_PENDING", "50"))
+JOB_TTL = 3600
+EVENT_POLL_INTERVAL = 0.5
+RESULT_CACHE_SIZE = 256
+VISION_CACHE_DIR = os.getenv(
+    "ZIWEI_VISION_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "ziwei_vision_cache")
+)
+JOBS_DB = os.getenv(
+    "ZIWEI_PIPELINE_JOBS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "ziwei_pipeline_jobs.sqlite")
+)
+
+STAGES = ("vision", "parse", "normalize", "analysis")
+
+
+def image_hash(image_base64: str) -> str:
+    """图片内容哈希（去掉 data: 前缀后按解码字节计算，编码差异不影响命中）"""
+    if image_base64.startswith('data:'):
+        image_base64 = image_base64.split(',', 1)[1] if ',' in image_base64 else image_base64
+    try:
+        payload = base64.b64decode(image_base64, validate=False)
+    except Exception:
+        payload = image_base64.encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+class _LRU:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class VisionCache:
+    """Vision 模型原始输出缓存（内存 + 磁盘，多进程共享磁盘部分）"""
+
+    def __init__(self, cache_dir=VISION_CACHE_DIR, maxsize=RESULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self._memory = _LRU(maxsize)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, digest, ocr_mode):
+        key = f"{digest}-{ocr_mode}"
+        text = self._memory.get(key)
+        if text is not None:
+            return text
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                text = json.load(f)["response"]
+        except (OSError, ValueError, KeyError):
+            return None
+        self._memory.put(key, text)
+        return text
+
+    def put(self, digest, ocr_mode, response_text):
+        key = f"{digest}-{ocr_mode}"
+        self._memory.put(key, response_text)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{self._path(key)}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"response": response_text, "cached_at": time.time()}, f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            print(f"[ZiweiPipeline] ⚠️ Vision 缓存写入失败: {e}")
+
+
+_vision_cache = VisionCache()
+_result_cache = _LRU(RESULT_CACHE_SIZE)
+_inflight_locks = {}
+_inflight_guard = threading.Lock()
+
+
+def _vision_lock(digest, ocr_mode):
+    """同一图片的并发任务串行执行 Vision 阶段，后到者直接命中前者写入的缓存"""
+    with _inflight_guard:
+        return _inflight_locks.setdefault((digest, ocr_mode), threading.Lock())
+
+
+def _profile_key(user_profile):
+    return json.dumps(user_profile or {}, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def run_ziwei_pipeline(image_base64, ocr_mode="intelligent", user_profile=None, progress=None, on_stage=None):
+    """
+    紫微命盘三层流程（同步执行，供任务线程与 full_pipeline 端点共用）
+
+    参数:
+        progress: 进度消息回调 progress(msg)
+        on_stage: 阶段切换回调 on_stage(stage)
+
+    返回:
+        (result, status_code)，result 与 /api/ziwei/full_pipeline 的响应结构一致
+    """
+    progress_messages = []
+
+    def say(msg):
+        progress_messages.append(msg)
+        print(msg)
+        if progress:
+            progress(msg)
+
+    def stage(name):
+        if on_stage:
+            on_stage(name)
+
+    digest = image_hash(image_base64)
+    result_key = (digest, ocr_mode, _profile_key(user_profile))
+    cached = _result_cache.get(result_key)
+    if cached is not None:
+        say("♻️ 相同命盘图片已识别过，直接返回缓存结果")
+        return {**cached, "progress": progress_messages, "cached": True}, 200
+
+    # Layer 1: Vision 识别（按图片哈希缓存模型输出）
+    stage("vision")
+    mode_label = "🔍 严格OCR" if ocr_mode == "strict" else "🧠 智能分析"
+    vision_agent = ZiweiVisionAgent()
+    lock = _vision_lock(digest, ocr_mode)
+    with lock:
+        response_text = _vision_cache.get(digest, ocr_mode)
+        try:
+            if response_text is not None:
+                say(f"♻️ 命中图片缓存，跳过 GPT-4-Turbo-Vision 识别 ({mode_label})")
+            else:
+                say(f"🔮 启动 GPT-4-Turbo-Vision 识别紫微命盘 ({mode_label})...")
+                response_text = vision_agent._call_gpt4_turbo_vision(image_base64, ocr_mode)
+                say("✅ 模型响应成功，返回原始识别结果...")
+
+            stage("parse")
+            raw_result = vision_agent._parse_vision_output(response_text, ocr_mode)
+        except Exception as e:
+            raw_result = {"success": False, "error": str(e)}
+
+        # 只缓存能解析成功的模型输出
+        if raw_result.get("success"):
+            _vision_cache.put(digest, ocr_mode, response_text)
+    with _inflight_guard:
+        if not lock.locked():
+            _inflight_locks.pop((digest, ocr_mode), None)
+
+    if not raw_result.get("success"):
+        return {
+            "ok": False,
+            "error": raw_result.get("error", "OCR 识别失败"),
+            "toast": f"❌ OCR 识别失败: {raw_result.get('error', '未知错误')}",
+            "progress": progress_messages
+        }, 500
+    say("✅ 紫微命盘 OCR 识别完成！")
+
+    # Layer 2: 标准化
+    stage("normalize")
+    say("📋 JSON 标准化为 ZiweiAI_v1.0...")
+    normalized = normalize_ziwei(raw_result, user_profile=user_profile)
+
+    if not normalized.get("success"):
+        return {
+            "ok": False,
+            "error": normalized.get("error", "标准化失败"),
+            "raw": raw_result,
+            "toast": f"❌ 数据标准化失败: {normalized.get('error', '未知错误')}",
+            "progress": progress_messages
+        }, 500
+
+    validation = validate_ziwei_structure(normalized)
+    if validation["warnings"]:
+        print(f"⚠️ 数据验证警告: {validation['warnings']}")
+
+    # Layer 3: AI 分析
+    stage("analysis")
+    say("🧠 AI 命理分析中...")
+    analysis_agent = ZiweiAnalysisAgent()
+    analysis_result = analysis_agent.analyze_ziwei(normalized)
+
+    if not analysis_result.get("success"):
+        # 即使分析失败，也返回前两层的结果（不缓存，便于重试）
+        return {
+            "ok": True,
+            "raw": raw_result,
+            "standardized": normalized,
+            "analysis": None,
+            "analysis_error": analysis_result.get("error", "分析失败"),
+            "validation": validation,
+            "toast": "⚠️ 命盘识别和标准化完成，但 AI 分析失败",
+            "progress": progress_messages
+        }, 200
+
+    brief_summary = analysis_agent.generate_brief_summary(normalized)
+    say("✅ 三层流程全部完成")
+
+    result = {
+        "ok": True,
+        "raw": raw_result,
+        "standardized": normalized,
+        "analysis": analysis_result.get("analysis"),
+        "brief_summary": brief_summary,
+        "validation": validation,
+        "ocr_mode": ocr_mode,
+        "toast": "✅ 紫微命盘识别与分析完成"
+    }
+    _result_cache.put(result_key, result)
+    return {**result, "progress": progress_messages}, 200
+
+
+class PipelineJob:
+    def __init__(self, owner_id, ocr_mode, job_id=None, created_at=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.ocr_mode = ocr_mode
+        self.status = "queued"          # queued / running / done / failed
+        self.stage = None
+        self.events = []                # [{"type": "progress"|"stage", ...}]
+        self.result = None
+        self.status_code = None
+        self.created_at = created_at or time.time()
+        self.finished_at = None
+
+    @classmethod
+    def from_row(cls, row, events):
+        job = cls(row["owner_id"], row["ocr_mode"], job_id=row["job_id"], created_at=row["created_at"])
+        job.status = row["status"]
+        job.stage = row["stage"]
+        job.events = events
+        job.result = row["result"]
+        job.status_code = row["status_code"]
+        job.finished_at = row["finished_at"]
+        return job
+
+    def snapshot(self, include_result=True):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": [e["message"] for e in self.events if e["type"] == "progress"],
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+        if include_result and self.result is not None:
+            data["result"] = self.result
+        return data
+
+
+class ZiweiPipelineJobs:
+    """
+    命盘识别任务队列：任务在提交进程的线程池中执行，
+    状态、进度与结果写入共享的 SQLite（ZiweiJobStore），任意 worker 都能查询 / 订阅
+    """
+
+    def __init__(self, workers=PIPELINE_WORKERS, max_pending=MAX_PENDING_JOBS, db_path=JOBS_DB):
+        self.max_pending = max_pending
+        self.store = ZiweiJobStore(db_path, ttl=JOB_TTL)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ziwei-pipeline")
+        self._active = {}               # 本进程排队 / 执行中的任务
+        self._cond = threading.Condition()
+
+    def submit(self, image_base64, ocr_mode="intelligent", user_profile=None, owner_id=None):
+        """提交任务，本进程队列已满时返回 None"""
+        with self._cond:
+            if len(self._active) >= self.max_pending:
+                return None
+            job = PipelineJob(owner_id, ocr_mode)
+            self._active[job.id] = job
+        self.store.create(job.id, owner_id, ocr_mode, job.created_at)
+        self._executor.submit(self._run, job, image_base64, ocr_mode, user_profile)
+        return job
+
+    def _emit(self, job, event):
+        with self._cond:
+            seq = len(job.events)
+            job.events.append(event)
+            if event["type"] == "stage":
+                job.stage = event["stage"]
+        self.store.append_event(job.id, seq, event)
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self, job, image_base64, ocr_mode, user_profile):
+        job.status = "running"
+        self.store.set_status(job.id, "running")
+        try:
+            result, status_code = run_ziwei_pipeline(
+                image_base64, ocr_mode, user_profile,
+                progress=lambda msg: self._emit(job, {"type": "progress", "message": msg}),
+                on_stage=lambda name: self._emit(job, {"type": "stage", "stage": name})
+            )
+        except Exception as e:
+            print(f"❌ 紫微命盘处理失败: {e}")
+            result, status_code = {"ok": False, "error": str(e), "toast": f"❌ 处理失败: {str(e)}"}, 500
+        status = "done" if result.get("ok") else "failed"
+        finished_at = time.time()
+        try:
+            self.store.finish(job.id, status, status_code, result, finished_at)
+        except Exception as e:
+            print(f"❌ 紫微命盘任务结果保存失败: {e}")
+        with self._cond:
+            job.result = result
+            job.status_code = status_code
+            job.status = status
+            job.finished_at = finished_at
+            self._active.pop(job.id, None)
+            self._cond.notify_all()
+
+    def get(self, job_id):
+        """从共享存储读取任务（含进度事件），不存在或已过期时返回 None"""
+        row = self.store.get(job_id)
+        if row is None:
+            return None
+        return PipelineJob.from_row(row, self.store.events(job_id))
+
+    def wait_events(self, job_id, start=0, timeout=15.0):
+        """
+        阻塞直到有新进度或任务结束（最多 timeout 秒）
+        本进程执行的任务由 Condition 即时唤醒，其他进程的任务按 EVENT_POLL_INTERVAL 轮询存储
+        返回 (新事件列表, 下一个游标, 是否已结束)
+        """
+        deadline = time.time() + timeout
+        while True:
+            # 先读任务行再读事件：任务结束前追加的事件一定在本次读取中，不会在发出 done 后漏掉
+            row = self.store.get(job_id)
+            events = self.store.events(job_id, start)
+            finished = row is None or row["finished_at"] is not None
+            remaining = deadline - time.time()
+            if events or finished or remaining <= 0:
+                return events, start + len(events), finished
+            with self._cond:
+                local = self._active.get(job_id)
+                if local is not None:
+                    self._cond.wait_for(
+                        lambda: len(local.events) > start or local.finished_at is not None,
+                        timeout=remaining
+                    )
+                else:
+                    self._cond.wait(min(EVENT_POLL_INTERVAL, remaining))
+
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+
+def get_pipeline_jobs():
+    """获取进程级任务队列（首次调用时创建线程池）"""
+    global _jobs
+    if _jobs is None:
+        with _jobs_lock:
+            if _jobs is None:
+                _jobs = ZiweiPipelineJobs()
+    return _jobs
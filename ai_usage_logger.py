@@ -1,18 +1,425 @@
 """
 AI Provider 性能监控与日志记录模块
 记录每次 AI 调用的性能指标、成功率、token 使用等
+
+- 日志按大小 / 日期轮转（ai_usage_log.jsonl → ai_usage_log.jsonl.YYYYmmdd-HHMMSS）
+- 最近日志从文件末尾反向读取，不再整文件载入
+- 按 provider / 按小时的统计在写入时增量累加，定期持久化到 ai_usage_stats.json，
+  统计接口不再重新解析日志
+- 多进程共享 ai_usage_stats.json：每个进程只累加自己未保存的增量，
+  由后台线程在文件锁内读出现有统计、加上增量再写回；读取时发现文件被其他进程更新则重新载入
+- 多进程共享日志文件：轮转在同一把文件锁内进行，其他进程的写入线程发现文件被轮转后自动重新打开
 """
 
 import os
 import json
+import math
 import time
+import atexit
+import glob
 import threading
+from collections import deque
+from contextlib import contextmanager
 from typing import Dict, List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+from async_log_sink import AsyncLogSink
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 LOG_FILE = "ai_usage_log.jsonl"
+STATS_FILE = "ai_usage_stats.json"
+STATS_LOCK_FILE = STATS_FILE + ".lock"
+LOG_MAX_BYTES = int(os.getenv("AI_USAGE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("AI_USAGE_LOG_BACKUPS", "7"))
+STATS_FLUSH_INTERVAL = 30          # 统计持久化间隔（秒）
+HOURLY_RETENTION = 24 * 7          # 按小时统计保留的小时数
+RECENT_ERRORS = 10
 _lock = threading.Lock()
 
+# 日志异步写入：监控日志允许在积压时丢弃最旧记录，不阻塞 AI 调用
+_log_sink = AsyncLogSink(LOG_FILE, overflow="drop_oldest")
+
+
+class LatencySketch:
+    """
+    延迟分位数的流式草图（对数分桶，相对误差约 ±1%）
+    内存只与延迟的数量级范围有关，与记录数无关，可序列化、可合并
+    """
+
+    ALPHA = 0.01
+    GAMMA = (1 + ALPHA) / (1 - ALPHA)
+    MIN_VALUE = 1e-4
+
+    def __init__(self, buckets: Optional[Dict[int, int]] = None):
+        self.buckets: Dict[int, int] = buckets or {}
+        self.count = sum(self.buckets.values())
+
+    def add(self, value: float) -> None:
+        key = math.ceil(math.log(max(value, self.MIN_VALUE), self.GAMMA))
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.GAMMA ** key / (self.GAMMA + 1)
+        return None
+
+    def to_dict(self) -> Dict[str, int]:
+        return {str(k): v for k, v in self.buckets.items()}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, int]) -> "LatencySketch":
+        return cls({int(k): v for k, v in (data or {}).items()})
+
+
+def _total_tokens(token_usage) -> int:
+    if not isinstance(token_usage, dict):
+        return 0
+    return token_usage.get("total_tokens") or \
+        (token_usage.get("prompt_tokens", 0) + token_usage.get("completion_tokens", 0)) or \
+        (token_usage.get("input_tokens", 0) + token_usage.get("output_tokens", 0))
+
+
+class UsageAggregates:
+    """按 provider / 按小时的增量统计"""
+
+    def __init__(self):
+        self.total_calls = 0
+        self.providers: Dict[str, Dict] = {}
+        self.sketches: Dict[str, LatencySketch] = {}
+        self.hourly: Dict[str, Dict] = {}
+        self.recent_errors = deque(maxlen=RECENT_ERRORS)
+        self.dirty = False
+        self.saved_at = time.time()
+
+    def add(self, record: Dict) -> None:
+        provider = record["provider"]
+        stats = self.providers.setdefault(provider, {
+            "count": 0,
+            "success_count": 0,
+            "latency_sum": 0.0,
+            "latency_count": 0,
+            "total_tokens": 0,
+            "fallback_count": 0
+        })
+        self.total_calls += 1
+        stats["count"] += 1
+
+        if record["success"]:
+            stats["success_count"] += 1
+        else:
+            self.recent_errors.append({
+                "provider": provider,
+                "timestamp": record["timestamp"],
+                "error": record["error"],
+                "query": record["query_preview"]
+            })
+
+        if record["latency"] is not None:
+            stats["latency_sum"] += record["latency"]
+            stats["latency_count"] += 1
+            self.sketches.setdefault(provider, LatencySketch()).add(record["latency"])
+
+        if record["fallback_used"]:
+            stats["fallback_count"] += 1
+
+        stats["total_tokens"] += _total_tokens(record.get("token_usage", {}))
+
+        hour_key = record["timestamp"][:13] + ":00"
+        hour = self.hourly.get(hour_key)
+        if hour is None:
+            hour = self.hourly[hour_key] = {"hour": hour_key, "total": 0, "success": 0, "by_provider": {}}
+            if len(self.hourly) > HOURLY_RETENTION:
+                for key in sorted(self.hourly)[:len(self.hourly) - HOURLY_RETENTION]:
+                    del self.hourly[key]
+        hour["total"] += 1
+        if record["success"]:
+            hour["success"] += 1
+        hour["by_provider"][provider] = hour["by_provider"].get(provider, 0) + 1
+
+        self.dirty = True
+
+    def merge(self, other: "UsageAggregates") -> None:
+        """把另一份统计（通常是某个进程未保存的增量）累加进来"""
+        self.total_calls += other.total_calls
+        for provider, stats in other.providers.items():
+            mine = self.providers.setdefault(provider, dict.fromkeys(stats, 0))
+            for key, value in stats.items():
+                mine[key] = mine.get(key, 0) + value
+        for provider, sketch in other.sketches.items():
+            mine = self.sketches.setdefault(provider, LatencySketch())
+            for key, count in sketch.buckets.items():
+                mine.buckets[key] = mine.buckets.get(key, 0) + count
+            mine.count += sketch.count
+        for hour_key, bucket in other.hourly.items():
+            mine = self.hourly.setdefault(hour_key, {"hour": hour_key, "total": 0, "success": 0, "by_provider": {}})
+            mine["total"] += bucket["total"]
+            mine["success"] += bucket["success"]
+            for provider, count in bucket["by_provider"].items():
+                mine["by_provider"][provider] = mine["by_provider"].get(provider, 0) + count
+        for key in sorted(self.hourly)[:max(0, len(self.hourly) - HOURLY_RETENTION)]:
+            del self.hourly[key]
+        errors = sorted(list(self.recent_errors) + list(other.recent_errors), key=lambda e: e.get("timestamp") or "")
+        self.recent_errors = deque(errors, maxlen=RECENT_ERRORS)
+        self.dirty = self.dirty or other.dirty
+
+    def to_dict(self) -> Dict:
+        return {
+            "total_calls": self.total_calls,
+            "providers": self.providers,
+            "sketches": {p: s.to_dict() for p, s in self.sketches.items()},
+            "hourly": self.hourly,
+            "recent_errors": list(self.recent_errors)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "UsageAggregates":
+        agg = cls()
+        agg.total_calls = data.get("total_calls", 0)
+        agg.providers = data.get("providers", {})
+        agg.sketches = {p: LatencySketch.from_dict(s) for p, s in data.get("sketches", {}).items()}
+        agg.hourly = data.get("hourly", {})
+        agg.recent_errors.extend(data.get("recent_errors", []))
+        return agg
+
+
+_aggregates: Optional[UsageAggregates] = None    # 统计视图：文件内容 + 本进程未保存的增量
+_pending = UsageAggregates()                      # 本进程未保存的增量
+_saving: Optional[UsageAggregates] = None         # 后台线程正在写入统计文件的增量
+_save_thread: Optional[threading.Thread] = None
+_stats_mtime: Optional[int] = None                # 视图对应的统计文件版本
+_log_day: Optional[str] = None
+
+
+def _rotated_files() -> List[str]:
+    """已轮转的日志文件，按时间从旧到新"""
+    return sorted(glob.glob(LOG_FILE + ".*"))
+
+
+def _rotate_if_needed(today: str) -> None:
+    """当前日志超过 LOG_MAX_BYTES 或跨天时轮转，只保留 LOG_BACKUP_COUNT 个历史文件"""
+    global _log_day
+    try:
+        st = os.stat(LOG_FILE)
+    except FileNotFoundError:
+        _log_day = today
+        return
+    if _log_day is None:
+        _log_day = datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d")
+    if st.st_size < LOG_MAX_BYTES and _log_day == today:
+        return
+    with _stats_file_lock(), _log_sink.paused():
+        # 其他进程可能已经轮转过：当前文件未超限且从今天开始写，则无需再轮转
+        try:
+            st = os.stat(LOG_FILE)
+        except FileNotFoundError:
+            _log_day = today
+            return
+        if st.st_size < LOG_MAX_BYTES and _first_record_day() in (today, None):
+            _log_day = today
+            return
+        _rotate(today)
+
+
+def _first_record_day() -> Optional[str]:
+    """当前日志第一条记录的日期，文件为空时返回 None"""
+    try:
+        with open(LOG_FILE, "r", encoding="utf-8") as f:
+            line = f.readline()
+        return json.loads(line)["timestamp"][:10] if line.strip() else None
+    except (OSError, ValueError, KeyError, TypeError):
+        return ""
+
+
+def _rotate(today: str) -> None:
+    global _log_day
+    if not os.path.exists(LOG_FILE):
+        _log_day = today
+        return
+    suffix = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    target = f"{LOG_FILE}.{suffix}"
+    n = 1
+    while os.path.exists(target):
+        target = f"{LOG_FILE}.{suffix}-{n}"
+        n += 1
+    os.replace(LOG_FILE, target)
+    for old in _rotated_files()[:-LOG_BACKUP_COUNT or None]:
+        os.remove(old)
+    _log_day = today
+
+
+def _iter_lines_reversed(path: str, block_size: int = 8192):
+    """从文件末尾按块反向读取，逐行产出（最新的在前）"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step) + tail
+            lines = chunk.split(b"\n")
+            tail = lines[0]
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    yield line.decode("utf-8")
+        if tail.strip():
+            yield tail.decode("utf-8")
+
+
+def _load_aggregates() -> UsageAggregates:
+    """读取持久化统计；不存在时从现有日志重建一次"""
+    if os.path.exists(STATS_FILE):
+        try:
+            with open(STATS_FILE, "r", encoding="utf-8") as f:
+                return UsageAggregates.from_dict(json.load(f))
+        except Exception as e:
+            print(f"⚠️ AI 统计文件读取失败，将从日志重建: {e}")
+
+    agg = UsageAggregates()
+    for path in _rotated_files() + [LOG_FILE]:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    agg.add(json.loads(line))
+                except Exception:
+                    continue
+    return agg
+
+
+@contextmanager
+def _stats_file_lock():
+    """跨进程互斥读写统计文件、轮转日志"""
+    with open(STATS_LOCK_FILE, "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _stats_file_version() -> Optional[int]:
+    try:
+        return os.stat(STATS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _write_stats(agg: UsageAggregates) -> None:
+    tmp_path = f"{STATS_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(agg.to_dict(), f, ensure_ascii=False)
+    os.replace(tmp_path, STATS_FILE)
+
+
+def _load_saved() -> UsageAggregates:
+    """
+    （持有文件锁时调用）已保存的统计
+    统计文件不存在时从日志重建并立即写出；log_ai_usage 首次写日志前先取统计视图，
+    因此重建时日志中不会有任何进程尚未保存的增量
+    """
+    exists = os.path.exists(STATS_FILE)
+    agg = _load_aggregates()
+    if not exists:
+        _write_stats(agg)
+    return agg
+
+
+def _load_with_pending() -> UsageAggregates:
+    """（持有 _lock 与文件锁时调用）已保存的统计 + 本进程未保存的增量"""
+    agg = _load_saved()
+    if _saving is not None:
+        agg.merge(_saving)
+    agg.merge(_pending)
+    return agg
+
+
+def _get_aggregates() -> UsageAggregates:
+    """统计视图；其他进程保存过统计文件时重新载入并叠加本进程的增量"""
+    global _aggregates, _stats_mtime
+    version = _stats_file_version()
+    if _aggregates is None or version != _stats_mtime:
+        with _stats_file_lock():
+            _aggregates = _load_with_pending()
+            _stats_mtime = _stats_file_version()
+    return _aggregates
+
+
+def _save_aggregates() -> None:
+    """
+    取出本进程增量，在文件锁内读出现有统计、累加增量后写回（不持有 _lock 做文件 IO）
+    _saving 只在持有文件锁时清空：_load_with_pending 同样在文件锁内读取它，增量不会被漏算或重复计算
+    """
+    global _aggregates, _pending, _saving, _stats_mtime
+    with _lock:
+        if not _pending.dirty or _saving is not None:
+            return
+        delta = _saving = _pending
+        _pending = UsageAggregates()
+
+    try:
+        with _stats_file_lock():
+            merged = _load_saved()
+            merged.merge(delta)
+            _write_stats(merged)
+            version = _stats_file_version()
+            _saving = None
+    except Exception as e:
+        print(f"⚠️ AI 统计保存失败，增量保留到下次保存: {e}")
+        with _lock:
+            delta.merge(_pending)
+            delta.saved_at = time.time()
+            _pending = delta
+            _saving = None
+        return
+
+    with _lock:
+        merged.merge(_pending)
+        _aggregates = merged
+        _stats_mtime = version
+
+
+def _schedule_save() -> None:
+    """（持有 _lock 时调用）后台持久化统计，请求路径不等待文件锁与文件 IO"""
+    global _save_thread
+    if _save_thread is not None and _save_thread.is_alive():
+        return
+    _save_thread = threading.Thread(target=_save_aggregates, name="ai-usage-stats-save", daemon=True)
+    _save_thread.start()
+
+
+def flush_stats() -> None:
+    """写完排队中的日志并持久化统计（进程退出时自动调用）"""
+    _log_sink.flush(timeout=5.0)
+    thread = _save_thread
+    if thread is not None:
+        thread.join(timeout=5.0)
+    _save_aggregates()
+
+
+atexit.register(flush_stats)
+
 
 def log_ai_usage(
     provider: str,
@@ -48,8 +455,16 @@ def log_ai_usage(
     }
     
     with _lock:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # 首次写日志前先取统计视图（必要时从日志重建统计文件）；之后视图可能落后于其他进程，
+        # 读取统计时按文件版本重新载入
+        agg = _aggregates if _aggregates is not None else _get_aggregates()
+        _rotate_if_needed(record["timestamp"][:10])
+        _log_sink.write(record)
+
+        agg.add(record)
+        _pending.add(record)
+        if time.time() - _pending.saved_at > STATS_FLUSH_INTERVAL:
+            _schedule_save()
 
 
 def get_ai_usage_logs(limit: int = 100) -> List[Dict]:
@@ -62,14 +477,24 @@ def get_ai_usage_logs(limit: int = 100) -> List[Dict]:
     Returns:
         日志记录列表
     """
-    if not os.path.exists(LOG_FILE):
+    if limit <= 0:
         return []
-    
+
+    _log_sink.flush(timeout=1.0)
     with _lock:
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()[-limit:]
-    
-    return [json.loads(line) for line in lines if line.strip()]
+        paths = [LOG_FILE] + list(reversed(_rotated_files()))
+        lines = []
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            for line in _iter_lines_reversed(path):
+                lines.append(line)
+                if len(lines) >= limit:
+                    break
+            if len(lines) >= limit:
+                break
+
+    return [json.loads(line) for line in reversed(lines)]
 
 
 def summarize_ai_stats() -> Dict:
@@ -93,74 +518,30 @@ def summarize_ai_stats() -> Dict:
             "recent_errors": [...]
         }
     """
-    logs = get_ai_usage_logs(1000)
-    
-    if not logs:
-        return {
-            "total_calls": 0,
+    with _lock:
+        agg = _get_aggregates()
+        summary = {
+            "total_calls": agg.total_calls,
             "by_provider": {},
-            "recent_errors": []
+            "recent_errors": list(agg.recent_errors)
         }
-    
-    stats_by_provider = {}
-    recent_errors = []
-    
-    for record in logs:
-        provider = record["provider"]
-        
-        if provider not in stats_by_provider:
-            stats_by_provider[provider] = {
-                "count": 0,
-                "success_count": 0,
-                "latencies": [],
-                "total_tokens": 0,
-                "fallback_count": 0
+
+        for provider, stats in agg.providers.items():
+            sketch = agg.sketches.get(provider)
+            percentile = lambda q: round(sketch.quantile(q), 3) if sketch and sketch.count else None
+            summary["by_provider"][provider] = {
+                "count": stats["count"],
+                "success_count": stats["success_count"],
+                "success_rate": round(stats["success_count"] / stats["count"] * 100, 1) if stats["count"] > 0 else 0,
+                "avg_latency": round(stats["latency_sum"] / stats["latency_count"], 3) if stats["latency_count"] else None,
+                "p50_latency": percentile(0.5),
+                "p95_latency": percentile(0.95),
+                "p99_latency": percentile(0.99),
+                "total_tokens": stats["total_tokens"],
+                "fallback_count": stats["fallback_count"],
+                "fallback_rate": round(stats["fallback_count"] / stats["count"] * 100, 1) if stats["count"] > 0 else 0
             }
-        
-        provider_stats = stats_by_provider[provider]
-        provider_stats["count"] += 1
-        
-        if record["success"]:
-            provider_stats["success_count"] += 1
-        else:
-            if len(recent_errors) < 10:
-                recent_errors.append({
-                    "provider": provider,
-                    "timestamp": record["timestamp"],
-                    "error": record["error"],
-                    "query": record["query_preview"]
-                })
-        
-        if record["latency"] is not None:
-            provider_stats["latencies"].append(record["latency"])
-        
-        if record["fallback_used"]:
-            provider_stats["fallback_count"] += 1
-        
-        token_usage = record.get("token_usage", {})
-        if isinstance(token_usage, dict):
-            total = token_usage.get("total_tokens") or \
-                    (token_usage.get("prompt_tokens", 0) + token_usage.get("completion_tokens", 0)) or \
-                    (token_usage.get("input_tokens", 0) + token_usage.get("output_tokens", 0))
-            provider_stats["total_tokens"] += total
-    
-    summary = {
-        "total_calls": len(logs),
-        "by_provider": {},
-        "recent_errors": recent_errors
-    }
-    
-    for provider, stats in stats_by_provider.items():
-        summary["by_provider"][provider] = {
-            "count": stats["count"],
-            "success_count": stats["success_count"],
-            "success_rate": round(stats["success_count"] / stats["count"] * 100, 1) if stats["count"] > 0 else 0,
-            "avg_latency": round(sum(stats["latencies"]) / len(stats["latencies"]), 3) if stats["latencies"] else None,
-            "total_tokens": stats["total_tokens"],
-            "fallback_count": stats["fallback_count"],
-            "fallback_rate": round(stats["fallback_count"] / stats["count"] * 100, 1) if stats["count"] > 0 else 0
-        }
-    
+
     return summary
 
 
@@ -174,39 +555,16 @@ def get_hourly_stats(hours: int = 24) -> List[Dict]:
     Returns:
         按小时分组的统计列表
     """
-    logs = get_ai_usage_logs(10000)
-    
-    if not logs:
-        return []
-    
-    now = datetime.now()
-    hourly_data = {}
-    
-    for record in logs:
-        try:
-            timestamp = datetime.strptime(record["timestamp"], "%Y-%m-%d %H:%M:%S")
-            hour_key = timestamp.strftime("%Y-%m-%d %H:00")
-            
-            if hour_key not in hourly_data:
-                hourly_data[hour_key] = {
-                    "hour": hour_key,
-                    "total": 0,
-                    "success": 0,
-                    "by_provider": {}
-                }
-            
-            hourly_data[hour_key]["total"] += 1
-            if record["success"]:
-                hourly_data[hour_key]["success"] += 1
-            
-            provider = record["provider"]
-            if provider not in hourly_data[hour_key]["by_provider"]:
-                hourly_data[hour_key]["by_provider"][provider] = 0
-            hourly_data[hour_key]["by_provider"][provider] += 1
-        except:
-            continue
-    
-    return sorted(hourly_data.values(), key=lambda x: x["hour"])
+    since = (datetime.now() - timedelta(hours=hours - 1)).strftime("%Y-%m-%d %H:00")
+
+    with _lock:
+        hourly = _get_aggregates().hourly
+        result = [
+            {**bucket, "by_provider": dict(bucket["by_provider"])}
+            for key, bucket in hourly.items() if key >= since
+        ]
+
+    return sorted(result, key=lambda x: x["hour"])
 
 
 if __name__ == "__main__":
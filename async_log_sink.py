@@ -0,0 +1,199 @@
+"""
+异步 JSONL 日志写入器
+请求路径只把记录放入内存队列，由后台线程批量写盘
+
+- 后台线程常驻打开文件，队列中有多少写多少（高负载时自然合批）
+- 每批写完 flush 到操作系统，按 fsync_interval 定期 fsync
+- 队列有界，满时按 overflow 策略处理：
+    "block"        阻塞调用方直到有空位（block_timeout 为 None 时无限等待，超时后丢弃本条）
+    "drop_newest"  丢弃新记录
+    "drop_oldest"  丢弃队列中最旧的记录
+- flush() 等待已入队的记录全部落盘；paused() 期间文件句柄关闭，可安全轮转 / 删除日志
+- 每批写入前检查路径与句柄是否仍是同一文件，被其他进程轮转后重新打开
+- 进程退出时自动写完剩余记录
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Union
+
+OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+
+class AsyncLogSink:
+    def __init__(
+        self,
+        path: str,
+        max_queue: int = 10000,
+        batch_size: int = 512,
+        fsync_interval: float = 1.0,
+        overflow: str = "block",
+        block_timeout: Optional[float] = None,
+        name: Optional[str] = None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {overflow}")
+        self.path = path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.name = name or os.path.basename(path)
+
+        self.written = 0
+        self.dropped = 0
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._enqueued_seq = 0
+        self._written_seq = 0
+        self._closing = False
+        self._file = None
+        self._last_fsync = time.time()
+        self._thread = None
+        atexit.register(self.close)
+
+    # ---------------- 写入 ----------------
+
+    def write(self, record: Union[Dict[str, Any], str]) -> bool:
+        """记录入队（dict 序列化为一行 JSON），被丢弃时返回 False"""
+        line = record if isinstance(record, str) else json.dumps(record, ensure_ascii=False)
+        with self._cond:
+            if self._closing:
+                return False
+            self._ensure_thread()
+            if len(self._buffer) >= self.max_queue:
+                if self.overflow == "drop_newest":
+                    self.dropped += 1
+                    return False
+                if self.overflow == "drop_oldest":
+                    self._buffer.popleft()
+                    self._written_seq += 1
+                    self.dropped += 1
+                else:
+                    self._cond.notify_all()
+                    if not self._cond.wait_for(
+                        lambda: len(self._buffer) < self.max_queue or self._closing,
+                        timeout=self.block_timeout
+                    ) or self._closing:
+                        self.dropped += 1
+                        return False
+            self._buffer.append(line)
+            self._enqueued_seq += 1
+            self._cond.notify_all()
+        return True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"log-sink-{self.name}", daemon=True)
+            self._thread.start()
+
+    # ---------------- 后台线程 ----------------
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closing, timeout=self.fsync_interval)
+                if not self._buffer:
+                    if self._closing:
+                        break
+                    batch = None
+                else:
+                    n = min(len(self._buffer), self.batch_size)
+                    batch = [self._buffer.popleft() for _ in range(n)]
+                    # 出队即腾出空位，唤醒因队列满而阻塞的写入方
+                    self._cond.notify_all()
+
+            with self._io_lock:
+                if batch:
+                    self._write_batch(batch)
+                self._maybe_fsync()
+
+            if batch:
+                with self._cond:
+                    self._written_seq += len(batch)
+                    self.written += len(batch)
+                    self._cond.notify_all()
+
+        with self._io_lock:
+            self._close_file()
+
+    def _write_batch(self, batch) -> None:
+        try:
+            if self._file is not None and self._rotated_away():
+                self._close_file()
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write("\n".join(batch) + "\n")
+            self._file.flush()
+        except Exception as e:
+            print(f"⚠️ 日志写入失败 {self.path}（{len(batch)} 条）: {e}")
+            self._close_file()
+
+    def _rotated_away(self) -> bool:
+        """文件已被（其他进程）轮转或删除：路径不再指向当前句柄"""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except OSError:
+            return True
+
+    def _maybe_fsync(self, force: bool = False) -> None:
+        if self._file is None:
+            return
+        now = time.time()
+        if force or now - self._last_fsync >= self.fsync_interval:
+            try:
+                os.fsync(self._file.fileno())
+            except OSError:
+                pass
+            self._last_fsync = now
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+    # ---------------- 控制 ----------------
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待目前已入队的记录全部写入文件，超时返回 False"""
+        with self._cond:
+            target = self._enqueued_seq
+            if self._written_seq >= target:
+                return True
+            self._ensure_thread()
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written_seq >= target, timeout=timeout)
+
+    @contextmanager
+    def paused(self):
+        """写完已入队记录并关闭文件句柄；块内可轮转、删除日志文件，之后自动重新打开"""
+        self.flush()
+        with self._io_lock:
+            self._close_file()
+            yield
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """写完剩余记录并停止后台线程"""
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        else:
+            with self._io_lock:
+                self._close_file()
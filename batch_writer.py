@@ -0,0 +1,124 @@
+"""
+批量写入工具
+将一组行按 chunk 合并为多行 insert / upsert，替代逐行请求
+
+- write_rows():          Supabase（PostgREST）表，每个 chunk 一次 HTTP 请求
+- execute_values_rows(): 直连 PostgreSQL 的表，psycopg2.extras.execute_values 多行 VALUES
+- is_missing_function(): 判断 Supabase RPC 报错是否为函数未创建（用于退回非 RPC 写法）
+
+两者都返回写入统计（行数、请求数、耗时、rows/sec）并打印一行摘要。
+"""
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_CHUNK_SIZE = 500
+
+# PostgREST：schema cache 中找不到函数 / PostgreSQL：函数不存在
+MISSING_FUNCTION_CODES = ("PGRST202", "42883")
+
+
+def _stats(label: str, rows: int, requests: int, failed: int, elapsed: float, verbose: bool) -> Dict[str, Any]:
+    rate = rows / elapsed if elapsed > 0 else float(rows)
+    stats = {
+        "table": label,
+        "rows": rows,
+        "failed": failed,
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rate, 1),
+    }
+    if verbose:
+        print(f"📦 批量写入 {label}: {rows} 行 / {requests} 次请求，"
+              f"{elapsed:.2f}s（{rate:.1f} rows/sec）" + (f"，失败 {failed} 行" if failed else ""))
+    return stats
+
+
+def is_missing_function(error: Exception) -> bool:
+    """RPC 调用失败是否因为函数尚未创建（网络错误、超时等其他异常返回 False）"""
+    code = getattr(error, "code", None)
+    if code is not None:
+        return str(code) in MISSING_FUNCTION_CODES
+    return any(c in str(error) for c in MISSING_FUNCTION_CODES)
+
+
+def write_rows(
+    client,
+    table: str,
+    rows: List[Dict[str, Any]],
+    upsert: bool = False,
+    on_conflict: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    verbose: bool = True,
+) -> Dict[str, Any]:
+    """
+    Supabase 多行写入：每 chunk_size 行一次 insert / upsert
+
+    Args:
+        client: Supabase 客户端
+        table: 目标表
+        rows: 行字典列表（同一批次内各行的键应一致）
+        upsert: True 时使用 upsert
+        on_conflict: upsert 的冲突列，如 "user_id,matched_user_id"
+        chunk_size: 每次请求的最大行数
+
+    Returns:
+        写入统计；单个 chunk 失败只记入 failed，不影响其余 chunk
+    """
+    written = failed = requests = 0
+    t0 = time.perf_counter()
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            query = client.table(table)
+            if upsert:
+                query = query.upsert(chunk, on_conflict=on_conflict) if on_conflict else query.upsert(chunk)
+            else:
+                query = query.insert(chunk)
+            query.execute()
+            written += len(chunk)
+        except Exception as e:
+            failed += len(chunk)
+            print(f"⚠️ 批量写入 {table} 失败（{len(chunk)} 行）: {e}")
+        requests += 1
+    return _stats(table, written, requests, failed, time.perf_counter() - t0, verbose)
+
+
+def execute_values_rows(
+    conn,
+    sql: str,
+    rows: Sequence[Sequence[Any]],
+    template: Optional[str] = None,
+    page_size: int = DEFAULT_CHUNK_SIZE,
+    label: Optional[str] = None,
+    verbose: bool = True,
+    fetch: bool = False,
+) -> Dict[str, Any]:
+    """
+    直连 PostgreSQL 的多行写入（psycopg2.extras.execute_values）
+
+    Args:
+        conn: psycopg2 连接（由调用方负责关闭或归还连接池）
+        sql: 含单个 VALUES %s 占位的语句，可带 ON CONFLICT 子句
+        rows: 参数元组列表
+        template: 每行的 VALUES 模板，如 "(%s, %s, NOW())"
+        page_size: 每条 INSERT 语句包含的行数
+        fetch: 语句带 RETURNING 时取回结果，放在统计的 "returned" 中
+
+    Returns:
+        写入统计；整批在一个事务内提交，失败时回滚并抛出异常
+    """
+    from psycopg2.extras import execute_values
+
+    t0 = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            returned = execute_values(cursor, sql, rows, template=template, page_size=page_size, fetch=fetch)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    requests = (len(rows) + page_size - 1) // page_size
+    stats = _stats(label or "postgres", len(rows), requests, 0, time.perf_counter() - t0, verbose)
+    if fetch:
+        stats["returned"] = returned
+    return stats
@@ -6,6 +6,7 @@ Master–Child–User 三方协作的可靠实现：
 - /api/relay/send    -> Master 指派任务给 Child（或直接消息）
 - /api/relay/callback-> Child 执行完成回传结果
 - /api/relay/logs    -> 拉取最近 N 条对话/事件
+- /api/relay/tasks   -> 按状态列出任务（task_state.sqlite）
 - /api/relay/ack     -> （可选）对消息进行确认
 - 全部写入 conversation_log.jsonl，面向审计与回放
 """
@@ -13,12 +14,19 @@ import os, json, time, threading
 from typing import Dict, Any, List, Optional
 from flask import Blueprint, request, jsonify
 from functools import wraps
+from async_log_sink import AsyncLogSink
+from task_state_store import TaskStateStore
 
 bp = Blueprint("relay", __name__)
 LOG_FILE = "conversation_log.jsonl"
-STATE_FILE = "task_state.json"
+STATE_FILE = "task_state.json"          # 旧版整文件状态，仅用于迁移
+STATE_DB = "task_state.sqlite"
+MAX_TASK_LIST_LIMIT = 500
 _lock = threading.Lock()
 
+# 事件日志异步写入：请求路径只入队；任务事件不可丢，队列满时阻塞（背压）而非丢弃
+_log_sink = AsyncLogSink(LOG_FILE, overflow="block")
+
 RELAY_API_KEY = os.getenv("RELAY_API_KEY", "lynker_relay_secret_2025")
 
 def require_auth(f):
@@ -34,41 +42,48 @@ def require_auth(f):
 def _append_log(record: Dict[str, Any]):
     """追加事件到日志文件"""
     record.setdefault("ts", time.strftime("%Y-%m-%d %H:%M:%S"))
-    with _lock:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    _log_sink.write(record)
 
 def _read_logs(limit: int = 100) -> List[Dict[str, Any]]:
     """读取最近的日志条目"""
+    _log_sink.flush(timeout=1.0)
     if not os.path.exists(LOG_FILE): return []
     with open(LOG_FILE, "r", encoding="utf-8") as f:
         lines = f.readlines()[-limit:]
     return [json.loads(x) for x in lines]
 
-def _load_task_state() -> Dict[str, str]:
-    """加载任务状态（内部使用，需在锁内调用）"""
-    if not os.path.exists(STATE_FILE):
-        return {}
-    with open(STATE_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def _save_task_state(state: Dict[str, str]):
-    """保存任务状态（内部使用，需在锁内调用）"""
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+_task_store = None
+
+def _get_task_store() -> TaskStateStore:
+    """任务状态存储（首次使用时打开，并迁移旧版 task_state.json）"""
+    global _task_store
+    if _task_store is None:
+        with _lock:
+            if _task_store is None:
+                store = TaskStateStore(STATE_DB)
+                if os.path.exists(STATE_FILE) and store.count() == 0:
+                    # 多个 worker 可能同时迁移：导入是 INSERT OR IGNORE（幂等），
+                    # 文件已被其他进程迁移走时跳过即可
+                    try:
+                        migrated = store.import_json(STATE_FILE)
+                        os.replace(STATE_FILE, STATE_FILE + ".migrated")
+                        print(f"📦 已迁移 {migrated} 条任务状态到 {STATE_DB}")
+                    except FileNotFoundError:
+                        pass
+                _task_store = store
+    return _task_store
 
 def _update_task_status(task_id: str, status: str):
-    """更新单个任务状态（线程安全，原子操作）"""
-    with _lock:
-        state = _load_task_state()
-        state[task_id] = status
-        _save_task_state(state)
+    """更新单个任务状态（单行写入）"""
+    _get_task_store().set_status(task_id, status)
 
 def get_task_status(task_id: str) -> Optional[str]:
-    """获取任务状态：pending, processing, completed, failed（线程安全）"""
-    with _lock:
-        state = _load_task_state()
-        return state.get(task_id)
+    """获取任务状态：pending, processing, completed, failed"""
+    return _get_task_store().get_status(task_id)
+
+def list_tasks(status: str, limit: int = 100) -> List[Dict[str, Any]]:
+    """按状态列出任务（最近更新的在前）"""
+    return _get_task_store().list_by_status(status, limit)
 
 @bp.route("/api/relay/send", methods=["POST"])
 @require_auth
@@ -142,6 +157,14 @@ def get_task_status_endpoint(task_id: str):
         return jsonify({"status":"error","msg":"task not found"}), 404
     return jsonify({"status":"ok", "task_id": task_id, "task_status": status})
 
+@bp.route("/api/relay/tasks", methods=["GET"])
+def list_tasks_endpoint():
+    """按状态列出任务（只读操作，不需要认证）"""
+    status = request.args.get("status", "pending")
+    limit = request.args.get("limit", 100, type=int)
+    limit = min(max(limit, 1), MAX_TASK_LIST_LIMIT)
+    return jsonify({"status":"ok", "task_status": status, "tasks": list_tasks(status, limit)})
+
 @bp.route("/api/relay/ack", methods=["POST"])
 @require_auth
 def relay_ack():
@@ -159,11 +182,13 @@ def relay_ack():
 @require_auth
 def relay_clear():
     """清空对话日志和相关状态"""
-    with _lock:
+    task_store = _get_task_store()
+    with _lock, _log_sink.paused():
         if os.path.exists(LOG_FILE):
             os.remove(LOG_FILE)
         if os.path.exists(STATE_FILE):
             os.remove(STATE_FILE)
+        task_store.clear()
         if os.path.exists("master_responder_state.json"):
             os.remove("master_responder_state.json")
         if os.path.exists("child_worker_state.json"):
@@ -0,0 +1,115 @@
+"""
+进程级 PostgreSQL 连接池
+供 master_vault_engine / master_ai_reasoner / master_ai_evolution_engine 等直连 SQL 的模块共用
+
+- 线程安全，连接数上限 DB_POOL_MAX；池满时阻塞等待（最多 DB_POOL_TIMEOUT 秒）
+- 空闲超过 DB_POOL_HEALTH_CHECK 秒的连接在借出前先 SELECT 1，失效则丢弃重连
+- 上下文管理器 API：
+
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            ...
+        conn.commit()
+
+  异常时自动回滚；归还时未提交的事务由连接池回滚。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_HEALTH_CHECK = float(os.getenv("DB_POOL_HEALTH_CHECK", "60"))
+
+
+class PgConnectionPool:
+    """ThreadedConnectionPool + 有界等待 + 借出前健康检查"""
+
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT):
+        if not dsn:
+            raise ValueError("❌ 未设置 DATABASE_URL 环境变量！")
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        with self._lock:
+            idle = time.time() - self._last_used.get(id(conn), 0)
+        if idle < DB_POOL_HEALTH_CHECK:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pg_pool.PoolError(f"连接池已满（{self.maxconn}），等待 {self.timeout}s 超时")
+        try:
+            conn = self._pool.getconn()
+            if not self._healthy(conn):
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        try:
+            with self._lock:
+                if close or conn.closed:
+                    self._last_used.pop(id(conn), None)
+                else:
+                    self._last_used[id(conn)] = time.time()
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """获取进程级连接池（首次调用时创建）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PgConnectionPool(os.getenv("DATABASE_URL"))
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """从连接池借出一个连接，退出时归还；异常时回滚，连接级错误时丢弃该连接"""
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
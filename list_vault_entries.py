@@ -1,4 +1,4 @@
-from master_vault_engine import list_vault_entries, read_vault
+from master_vault_engine import list_vault_entries, read_vault, vault_cursor
 import os
 
 def main():
@@ -9,24 +9,36 @@ def main():
     role = os.getenv("USER_ROLE", "User")
     print(f"🔑 当前身份: {role}\n")
 
-    # 获取 Vault 条目
-    entries = list_vault_entries()
-    if not entries:
-        print("⚠️ 暂无记录。")
-        return
+    # 按页获取 Vault 条目
+    cursor = None
+    page = 1
+    while True:
+        entries = list_vault_entries(cursor=cursor, verbose=False)
+        if not entries:
+            print("⚠️ 暂无记录。" if page == 1 else "⚠️ 没有更多记录。")
+            return
+
+        print(f"📖 当前 Vault 条目（第 {page} 页）:")
+        print("-" * 50)
+        for i, e in enumerate(entries, start=1):
+            vault_id, title, access_level, created_by, created_at = e
+            print(f"{i}. {title}  |  创建者: {created_by}  |  时间: {created_at}")
+        print("-" * 50)
 
-    print("📖 当前 Vault 条目:")
-    print("-" * 50)
-    for i, e in enumerate(entries, start=1):
-        vault_id, title, access_level, created_by, created_at = e
-        print(f"{i}. {title}  |  创建者: {created_by}  |  时间: {created_at}")
-    print("-" * 50)
+        # 仅管理员可查看内容
+        if role == "Superintendent Admin":
+            prompt = "\n请输入要解密查看的条目序号（n 下一页，Enter 退出）："
+        else:
+            print("\n🚫 您没有解密权限。仅 Superintendent Admin 可查看内容。")
+            prompt = "\n输入 n 查看下一页（Enter 退出）："
 
-    # 仅管理员可查看内容
-    if role == "Superintendent Admin":
         try:
-            choice = input("\n请输入要解密查看的条目序号（或按 Enter 跳过）：")
-            if choice.strip():
+            choice = input(prompt).strip()
+            if choice.lower() == "n":
+                cursor = vault_cursor(entries[-1])
+                page += 1
+                continue
+            if choice and role == "Superintendent Admin":
                 index = int(choice) - 1
                 vault_id, title, access_level, created_by, created_at = entries[index]
                 print("\n🔓 解密中...\n")
@@ -34,8 +46,7 @@ def main():
                 print(f"📜 {title} 内容：\n{content}")
         except Exception as e:
             print(f"❌ 错误: {e}")
-    else:
-        print("\n🚫 您没有解密权限。仅 Superintendent Admin 可查看内容。")
+        return
 
 if __name__ == "__main__":
     main()
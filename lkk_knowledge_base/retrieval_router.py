@@ -1,13 +1,192 @@
 """
 检索路由器 - 关键词检索引擎
 支持从 rules/patterns/case_study 三层知识库检索相关内容
+
+每个类别维护一份内存倒排索引（中文二元词元 / 英文单词 → 倒排表），
+按 BM25 打分；文件按 mtime 增量重建，查询时不再逐个读取、解析文件。
 """
 import os
 import json
+import math
 import re
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 两次目录扫描（检查 mtime）的最短间隔（秒）
+REFRESH_INTERVAL = 5.0
+
+_TOKEN_RE = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9_]+')
+
+
+def _tokenize(text: str) -> List[str]:
+    """
+    切分词元：连续汉字取二元组（单字保留单字），英文数字取小写单词
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if '\u4e00' <= run[0] <= '\u9fff' and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class _Document:
+    """
+    已索引的知识库文件
+    - text: 原文（JSON 文件为 json.dumps 后的文本）
+    - data: 解析后的 JSON（Markdown 为 None）
+    - 行偏移与行级倒排表用于段落提取
+    """
+    
+    def __init__(self, path: Path, mtime_ns: int, size: int, text: str, data: Any = None):
+        self.path = path
+        self.name = path.name
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.text = text
+        self.data = data
+        
+        self.term_freqs = Counter(_tokenize(text))
+        self.length = sum(self.term_freqs.values())
+        
+        # 每行起始偏移（末尾附加一个哨兵，便于切片）
+        self._offsets = [0]
+        for match in re.finditer('\n', text):
+            self._offsets.append(match.end())
+        self.line_count = len(self._offsets)
+        self._offsets.append(len(text) + 1)
+        
+        # 词元 → 出现的行号
+        self._line_postings: Dict[str, List[int]] = {}
+        for i in range(self.line_count):
+            for term in set(_tokenize(self.line(i))):
+                self._line_postings.setdefault(term, []).append(i)
+    
+    def line(self, i: int) -> str:
+        return self.text[self._offsets[i]:self._offsets[i + 1] - 1]
+    
+    def lines_between(self, start: int, end: int) -> str:
+        return self.text[self._offsets[start]:self._offsets[end] - 1]
+    
+    def candidate_lines(self, keyword: str) -> List[int]:
+        """可能包含 keyword 的行：keyword 全部词元所在行的交集"""
+        terms = set(_tokenize(keyword))
+        if not terms:
+            # 无可索引词元（如纯符号），退化为逐行检查
+            return list(range(self.line_count))
+        lines = None
+        for term in terms:
+            postings = self._line_postings.get(term)
+            if not postings:
+                return []
+            lines = set(postings) if lines is None else lines & set(postings)
+        return sorted(lines)
+
+
+class _CategoryIndex:
+    """
+    单个知识库类别（一个目录 + 后缀）的 BM25 倒排索引
+    """
+    
+    def __init__(self, directory: Path, suffix: str, label: str):
+        self.directory = directory
+        self.suffix = suffix
+        self.label = label
+        self._lock = threading.RLock()
+        self._docs: Dict[str, _Document] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._checked_at = 0.0
+    
+    def __len__(self) -> int:
+        return len(self._docs)
+    
+    def _load(self, path: Path, stat: os.stat_result) -> _Document:
+        with open(path, 'r', encoding='utf-8') as f:
+            if self.suffix == ".json":
+                data = json.load(f)
+                return _Document(path, stat.st_mtime_ns, stat.st_size, json.dumps(data, ensure_ascii=False), data)
+            return _Document(path, stat.st_mtime_ns, stat.st_size, f.read())
+    
+    def _add(self, doc: _Document) -> None:
+        self._docs[doc.name] = doc
+        self._total_length += doc.length
+        for term, tf in doc.term_freqs.items():
+            self._postings.setdefault(term, {})[doc.name] = tf
+    
+    def _drop(self, name: str) -> None:
+        doc = self._docs.pop(name, None)
+        if doc is None:
+            return
+        self._total_length -= doc.length
+        for term in doc.term_freqs:
+            postings = self._postings[term]
+            postings.pop(name, None)
+            if not postings:
+                del self._postings[term]
+    
+    def refresh(self, force: bool = False) -> None:
+        """扫描目录，只重建新增 / 修改的文件，移除已删除的文件"""
+        now = time.time()
+        if not force and now - self._checked_at < REFRESH_INTERVAL:
+            return
+        with self._lock:
+            if not force and now - self._checked_at < REFRESH_INTERVAL:
+                return
+            seen = set()
+            if self.directory.exists():
+                with os.scandir(self.directory) as entries:
+                    for entry in entries:
+                        if not entry.name.endswith(self.suffix) or not entry.is_file():
+                            continue
+                        seen.add(entry.name)
+                        stat = entry.stat()
+                        doc = self._docs.get(entry.name)
+                        if doc is not None and doc.mtime_ns == stat.st_mtime_ns and doc.size == stat.st_size:
+                            continue
+                        try:
+                            new_doc = self._load(Path(entry.path), stat)
+                        except Exception as e:
+                            print(f"⚠️ 读取{self.label}文件失败 {entry.path}: {e}")
+                            continue
+                        self._drop(entry.name)
+                        self._add(new_doc)
+            for name in [n for n in self._docs if n not in seen]:
+                self._drop(name)
+            self._checked_at = time.time()
+    
+    def search(self, keywords: List[str], max_results: int) -> List[Tuple[_Document, float]]:
+        """BM25 打分，返回 [(文档, 分数)]，分数降序"""
+        self.refresh()
+        query_terms = Counter()
+        for keyword in keywords:
+            query_terms.update(set(_tokenize(keyword)))
+        
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs or not query_terms:
+                return []
+            avg_length = self._total_length / n_docs or 1.0
+            scores: Dict[str, float] = {}
+            for term, qtf in query_terms.items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for name, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._docs[name].length / avg_length)
+                    scores[name] = scores.get(name, 0.0) + qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:max_results]
+            return [(self._docs[name], round(score, 4)) for name, score in ranked]
+
 
 class RetrievalRouter:
     """
@@ -20,6 +199,12 @@ class RetrievalRouter:
         self.rules_path = self.base_path / "rules"
         self.patterns_path = self.base_path / "patterns"
         self.case_study_path = self.base_path / "case_study"
+        self._indexes = {
+            "rules": _CategoryIndex(self.rules_path, ".md", "规则"),
+            "patterns": _CategoryIndex(self.patterns_path, ".json", "模式"),
+            "case_study": _CategoryIndex(self.case_study_path, ".json", "案例"),
+        }
+        self.refresh(force=True)
         
     def find_relevant_knowledge(
         self, 
@@ -106,142 +291,76 @@ class RetrievalRouter:
         检索规则层（Markdown 文件）
         """
         results = []
-        
-        if not self.rules_path.exists():
-            return results
-        
-        for rule_file in self.rules_path.glob("*.md"):
-            try:
-                with open(rule_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                # 计算匹配分数
-                score = self._calculate_match_score(content, keywords)
-                
-                if score > 0:
-                    # 提取相关段落
-                    relevant_sections = self._extract_relevant_sections(content, keywords)
-                    
-                    results.append({
-                        "source": rule_file.name,
-                        "type": "rule",
-                        "score": score,
-                        "content": relevant_sections[:500],  # 限制长度
-                        "matched_keywords": [k for k in keywords if k in content]
-                    })
-            except Exception as e:
-                print(f"⚠️ 读取规则文件失败 {rule_file}: {e}")
-        
-        # 按分数排序
-        results.sort(key=lambda x: x["score"], reverse=True)
-        return results[:max_results]
+        for doc, score in self._indexes["rules"].search(keywords, max_results):
+            # 提取相关段落
+            relevant_sections = self._extract_relevant_sections(doc, keywords)
+            results.append({
+                "source": doc.name,
+                "type": "rule",
+                "score": score,
+                "content": relevant_sections[:500],  # 限制长度
+                "matched_keywords": [k for k in keywords if k in doc.text]
+            })
+        return results
     
     def _search_patterns(self, keywords: List[str], max_results: int) -> List[Dict]:
         """
         检索模式层（JSON 文件）
         """
-        results = []
-        
-        if not self.patterns_path.exists():
-            return results
-        
-        for pattern_file in self.patterns_path.glob("*.json"):
-            try:
-                with open(pattern_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # 将 JSON 转为文本进行匹配
-                text_content = json.dumps(data, ensure_ascii=False)
-                score = self._calculate_match_score(text_content, keywords)
-                
-                if score > 0:
-                    results.append({
-                        "source": pattern_file.name,
-                        "type": "pattern",
-                        "score": score,
-                        "content": data,
-                        "matched_keywords": [k for k in keywords if k in text_content]
-                    })
-            except Exception as e:
-                print(f"⚠️ 读取模式文件失败 {pattern_file}: {e}")
-        
-        results.sort(key=lambda x: x["score"], reverse=True)
-        return results[:max_results]
+        return self._search_json("patterns", "pattern", keywords, max_results)
     
     def _search_case_study(self, keywords: List[str], max_results: int) -> List[Dict]:
         """
         检索案例层（JSON 文件）
         """
-        results = []
-        
-        if not self.case_study_path.exists():
-            return results
-        
-        for case_file in self.case_study_path.glob("*.json"):
-            try:
-                with open(case_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                text_content = json.dumps(data, ensure_ascii=False)
-                score = self._calculate_match_score(text_content, keywords)
-                
-                if score > 0:
-                    results.append({
-                        "source": case_file.name,
-                        "type": "case_study",
-                        "score": score,
-                        "content": data,
-                        "matched_keywords": [k for k in keywords if k in text_content]
-                    })
-            except Exception as e:
-                print(f"⚠️ 读取案例文件失败 {case_file}: {e}")
-        
-        results.sort(key=lambda x: x["score"], reverse=True)
-        return results[:max_results]
+        return self._search_json("case_study", "case_study", keywords, max_results)
     
-    def _calculate_match_score(self, content: str, keywords: List[str]) -> float:
-        """
-        计算匹配分数（简单关键词频率）
-        """
-        content_lower = content.lower()
-        score = 0.0
-        
-        for keyword in keywords:
-            keyword_lower = keyword.lower()
-            # 完整匹配得分更高
-            if keyword in content:
-                score += content.count(keyword) * 2.0
-            # 部分匹配
-            elif keyword_lower in content_lower:
-                score += content_lower.count(keyword_lower) * 1.0
-        
-        return score
+    def _search_json(self, category: str, result_type: str, keywords: List[str], max_results: int) -> List[Dict]:
+        return [
+            {
+                "source": doc.name,
+                "type": result_type,
+                "score": score,
+                "content": doc.data,
+                "matched_keywords": [k for k in keywords if k in doc.text]
+            }
+            for doc, score in self._indexes[category].search(keywords, max_results)
+        ]
     
-    def _extract_relevant_sections(self, content: str, keywords: List[str], context_size: int = 200) -> str:
+    def _extract_relevant_sections(self, doc: "_Document", keywords: List[str], context_size: int = 200) -> str:
         """
         提取相关段落（包含关键词的上下文）
+        只检查倒排表中含关键词全部词元的行，按预计算的行偏移切片
         """
-        sections = []
-        lines = content.split('\n')
+        hit_lines = set()
+        for keyword in keywords:
+            for i in doc.candidate_lines(keyword):
+                if keyword in doc.line(i):
+                    hit_lines.add(i)
         
-        for i, line in enumerate(lines):
-            if any(keyword in line for keyword in keywords):
-                # 提取上下文
-                start = max(0, i - 2)
-                end = min(len(lines), i + 3)
-                section = '\n'.join(lines[start:end])
-                sections.append(section)
+        sections = []
+        for i in sorted(hit_lines)[:3]:
+            # 提取上下文
+            start = max(0, i - 2)
+            end = min(doc.line_count, i + 3)
+            sections.append(doc.lines_between(start, end))
         
-        return '\n---\n'.join(sections[:3]) if sections else content[:context_size]
+        return '\n---\n'.join(sections) if sections else doc.text[:context_size]
+    
+    def refresh(self, force: bool = False) -> None:
+        """按文件 mtime 增量刷新倒排索引"""
+        for index in self._indexes.values():
+            index.refresh(force)
     
     def get_stats(self) -> Dict[str, int]:
         """
         获取知识库统计信息
         """
+        self.refresh()
         return {
-            "rules_count": len(list(self.rules_path.glob("*.md"))) if self.rules_path.exists() else 0,
-            "patterns_count": len(list(self.patterns_path.glob("*.json"))) if self.patterns_path.exists() else 0,
-            "case_study_count": len(list(self.case_study_path.glob("*.json"))) if self.case_study_path.exists() else 0
+            "rules_count": len(self._indexes["rules"]),
+            "patterns_count": len(self._indexes["patterns"]),
+            "case_study_count": len(self._indexes["case_study"])
         }
 
 
@@ -17,12 +17,21 @@ from .db.family_columns_db import insert_family_columns, get_family_columns_by_c
 from .db.match_scores_db import insert_match_score, get_match_score, get_top_matches, upsert_match_score
 from .supabase_client import test_connection
 from .engines.weight_tuner import tune_weights
-from .engines.time_match_agent import find_time_matches, build_criteria_text
-from .engines.bazi_match_agent import run_bazi_match, build_bazi_criteria_text
+from .engines.time_match_agent import find_time_matches, count_time_matches, build_criteria_text
+from .engines.time_layer_index import warm_time_layer_index
+from .engines.bazi_bitmap_index import warm_bazi_index
+from .engines.bazi_match_agent import run_bazi_match_report, build_bazi_criteria_text
 
 bazi_bp = Blueprint('bazi', __name__, template_folder='templates', static_folder='static')
 # CORS(bazi_bp) # Optional: configure if needed specific to blueprint
 
+
+@bazi_bp.record_once
+def _warm_indexes(state):
+    """Blueprint 注册时后台加载时间层级索引与八字位图索引"""
+    warm_time_layer_index()
+    warm_bazi_index()
+
 # ✅ Session configuration for birth time storage
 # app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production') # Handled by main app
 # app.config['SESSION_TYPE'] = 'filesystem' # Handled by main app
@@ -426,6 +435,7 @@ def api_time_match():
         "mode": mode,
         "criteria_text": criteria_text,
         "count": len(matches),
+        "level_counts": count_time_matches(chart_id),
         "results": matches
     })
 
@@ -436,14 +446,15 @@ def api_bazi_match():
     chart_id = request.args.get("chart_id", type=int)
     mode = request.args.get("mode", default="same_yongshen")
     
-    matches = run_bazi_match(chart_id, mode)
+    report = run_bazi_match_report(chart_id, mode)
     criteria_text = build_bazi_criteria_text(mode)
     
     return jsonify({
         "mode": mode,
         "criteria_text": criteria_text,
-        "count": len(matches),
-        "results": matches
+        "count": report["total"],
+        "level_counts": report["level_counts"],
+        "results": report["results"]
     })
 
 
@@ -4,9 +4,54 @@ Match Scores 数据库操作模块
 适配统一评分表 match_scores
 """
 
-from typing import Dict, Any, Optional, List
+import atexit
+import os
+import threading
+import time
+from typing import Dict, Any, Optional, List, Tuple
 from lynker_bazi_engine.supabase_client import get_supabase_client
 
+# 单次多行 upsert 的行数上限（PostgREST 请求体不宜过大）
+UPSERT_CHUNK_SIZE = 500
+
+# 是否启用后台合并写入（匹配 API 不再等待数据库）
+WRITE_BEHIND_ENABLED = os.getenv("MATCH_SCORES_WRITE_BEHIND", "1") != "0"
+
+# 后台写入失败的评分最多重试次数（之后丢弃并打印）
+WRITE_BEHIND_MAX_RETRIES = 5
+
+ON_CONFLICT = "chart_id_a, chart_id_b, engine_type"
+
+# (chart_id_a, chart_id_b, engine, score_data)
+MatchScoreRow = Tuple[int, int, str, Dict[str, Any]]
+
+
+def _build_row(
+    chart_id_a: int,
+    chart_id_b: int,
+    engine: str,
+    score_data: Dict[str, Any]
+) -> Dict[str, Any]:
+    """将评分结果转换为 match_scores 表的一行"""
+    return {
+        "chart_id_a": chart_id_a,
+        "chart_id_b": chart_id_b,
+        "engine_type": engine,
+        "score": score_data.get("score", 0),
+        "matched_rules": score_data.get("matched_rules", []),
+        "verified_count": score_data.get("verified_count", 0),
+        "weight_version": score_data.get("weight_version", "v1")
+    }
+
+
+def _notify_leaderboard(rows: List[Dict[str, Any]]) -> None:
+    """写入成功后增量更新排行榜"""
+    try:
+        from lynker_bazi_engine.engines.leaderboard_engine import record_match_scores
+        record_match_scores(rows)
+    except Exception as e:
+        print(f"[DB] Leaderboard update failed: {e}")
+
 
 def save_match_score(
     chart_id_a: int,
@@ -29,23 +74,16 @@ def save_match_score(
     """
     client = get_supabase_client()
     
-    data = {
-        "chart_id_a": chart_id_a,
-        "chart_id_b": chart_id_b,
-        "engine_type": engine,
-        "score": score_data.get("score", 0),
-        "matched_rules": score_data.get("matched_rules", []),
-        "verified_count": score_data.get("verified_count", 0),
-        "weight_version": score_data.get("weight_version", "v1")
-    }
+    data = _build_row(chart_id_a, chart_id_b, engine, score_data)
     
     # Upsert based on (chart_id_a, chart_id_b, engine_type)
     # Supabase upsert requires the conflict columns to be specified if not primary key
     try:
         result = client.table("match_scores").upsert(
             data, 
-            on_conflict="chart_id_a, chart_id_b, engine_type"
+            on_conflict=ON_CONFLICT
         ).execute()
+        _notify_leaderboard([data])
         
         if result.data:
             return result.data[0]
@@ -55,6 +93,175 @@ def save_match_score(
         return None
 
 
+def save_match_scores(
+    rows: List[MatchScoreRow],
+    chunk_size: int = UPSERT_CHUNK_SIZE,
+    client=None,
+    failed: Optional[List[Tuple[int, int, str]]] = None
+) -> int:
+    """
+    批量保存统一评分：每 chunk_size 行一次多行 upsert
+    
+    Args:
+        rows: [(chart_id_a, chart_id_b, engine, score_data), ...]
+        chunk_size: 每次请求的最大行数
+        client: 可选的客户端（默认 Supabase 单例）
+        failed: 可选列表，写入失败的 (chart_id_a, chart_id_b, engine) 会追加到其中
+    
+    Returns:
+        成功写入的行数
+    """
+    if not rows:
+        return 0
+
+    # 同一请求内的重复键会触发 "ON CONFLICT ... cannot affect row a second time"，
+    # 按 (a, b, engine) 去重，后写入的覆盖先写入的
+    merged: Dict[Tuple[int, int, str], Dict[str, Any]] = {}
+    for chart_id_a, chart_id_b, engine, score_data in rows:
+        merged[(chart_id_a, chart_id_b, engine)] = _build_row(chart_id_a, chart_id_b, engine, score_data)
+    payload = list(merged.values())
+
+    if client is None:
+        client = get_supabase_client()
+
+    saved = 0
+    for start in range(0, len(payload), chunk_size):
+        chunk = payload[start:start + chunk_size]
+        try:
+            client.table("match_scores").upsert(chunk, on_conflict=ON_CONFLICT).execute()
+            _notify_leaderboard(chunk)
+            saved += len(chunk)
+        except Exception as e:
+            print(f"[DB] Bulk save match scores failed ({len(chunk)} rows): {e}")
+            if failed is not None:
+                failed.extend((r["chart_id_a"], r["chart_id_b"], r["engine_type"]) for r in chunk)
+    return saved
+
+
+class MatchScoreWriteBehind:
+    """
+    match_scores 后台写入队列
+    - 相同 (a, b, engine) 的评分在队列中合并，只写最后一次
+    - 队列达到 max_pending 行或距上次写入超过 flush_interval 秒时批量 upsert
+    - 写入失败的评分放回队列（不覆盖期间入队的更新评分），最多重试 max_retries 次
+    - 进程退出时自动 flush
+    """
+
+    def __init__(
+        self,
+        max_pending: int = UPSERT_CHUNK_SIZE,
+        flush_interval: float = 2.0,
+        chunk_size: int = UPSERT_CHUNK_SIZE,
+        client=None,
+        max_retries: int = WRITE_BEHIND_MAX_RETRIES
+    ):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        self.client = client
+        self.max_retries = max_retries
+        self._pending: Dict[Tuple[int, int, str], MatchScoreRow] = {}
+        self._attempts: Dict[Tuple[int, int, str], int] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="match-scores-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, rows: List[MatchScoreRow]) -> None:
+        with self._lock:
+            for row in rows:
+                key = (row[0], row[1], row[2])
+                self._pending[key] = row
+                self._attempts.pop(key, None)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """立即写入所有待写评分，返回写入行数"""
+        with self._lock:
+            batch = self._pending
+            attempts = self._attempts
+            self._pending = {}
+            self._attempts = {}
+        if not batch:
+            return 0
+
+        failed: List[Tuple[int, int, str]] = []
+        saved = save_match_scores(list(batch.values()), chunk_size=self.chunk_size, client=self.client, failed=failed)
+        if failed:
+            self._requeue(failed, batch, attempts)
+        return saved
+
+    def _requeue(self, keys, batch, attempts) -> None:
+        """失败的评分放回队列；期间已有同键的新评分入队时以新评分为准"""
+        dropped = 0
+        with self._lock:
+            for key in keys:
+                if key in self._pending:
+                    continue
+                tries = attempts.get(key, 0) + 1
+                if tries > self.max_retries:
+                    dropped += 1
+                    continue
+                self._pending[key] = batch[key]
+                self._attempts[key] = tries
+        if dropped:
+            print(f"[DB] Write-behind dropped {dropped} match scores after {self.max_retries} retries")
+
+    def close(self) -> None:
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+        remaining = self.pending()
+        if remaining:
+            print(f"[DB] Write-behind exiting with {remaining} unsaved match scores")
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[DB] Write-behind flush failed: {e}")
+
+
+_write_behind: Optional[MatchScoreWriteBehind] = None
+_write_behind_lock = threading.Lock()
+
+
+def get_write_behind() -> MatchScoreWriteBehind:
+    """获取进程级后台写入队列（首次调用时启动）"""
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = MatchScoreWriteBehind()
+        return _write_behind
+
+
+def queue_match_scores(rows: List[MatchScoreRow]) -> None:
+    """
+    匹配 API 使用的写入入口：
+    启用后台写入时只入队立即返回，否则同步批量写入
+    """
+    if not rows:
+        return
+    if WRITE_BEHIND_ENABLED:
+        get_write_behind().enqueue(rows)
+    else:
+        save_match_scores(rows)
+
+
 def get_match_score(
     chart_id_a: int, 
     chart_id_b: int, 
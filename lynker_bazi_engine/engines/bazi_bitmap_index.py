@@ -0,0 +1,238 @@
+"""
+灵客引擎 · 八字倒排位图索引
+Bazi Bitmap Index for Candidate Pruning
+
+四柱取自六十甲子，编码为 0-59 的小整数；天干结构、地支结构、
+格局、用神按字典编码。每个字段值对应一个位图（Python int 作为
+压缩位集），位号为命盘在索引中的行号。
+
+每种匹配模式（same_year_pillar … same_yongshen）即为若干位图求交，
+计数用 bit_count() 精确得到，只对最终一页的 chart_id 回表取完整数据。
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from lynker_bazi_engine.supabase_client import get_supabase_client
+from lynker_bazi_engine.engines.index_reloader import ReloadingIndex
+
+TIANGAN = "甲乙丙丁戊己庚辛壬癸"
+DIZHI = "子丑寅卯辰巳午未申酉戌亥"
+
+# 六十甲子 → 0-59
+JIAZI = {TIANGAN[i % 10] + DIZHI[i % 12]: i for i in range(60)}
+
+PILLAR_FIELDS = ["year_pillar", "month_pillar", "day_pillar", "hour_pillar"]
+STRUCTURE_FIELDS = ["tiangan_structure", "dizhi_structure", "pattern_type", "yongshen"]
+INDEX_FIELDS = PILLAR_FIELDS + STRUCTURE_FIELDS
+
+# 匹配模式 → 需要相同的字段（与 _fetch_candidates 的递进顺序一致）
+MODE_FIELDS = {
+    "same_year_pillar": INDEX_FIELDS[:1],
+    "same_month_pillar": INDEX_FIELDS[:2],
+    "same_day_pillar": INDEX_FIELDS[:3],
+    "same_hour_pillar": INDEX_FIELDS[:4],
+    "same_tiangan": INDEX_FIELDS[:5],
+    "same_dizhi": INDEX_FIELDS[:6],
+    "same_pattern": INDEX_FIELDS[:7],
+    "same_yongshen": INDEX_FIELDS[:8],
+}
+
+LOAD_PAGE_SIZE = 1000
+RELOAD_INTERVAL = 600
+
+
+class BaziBitmapIndex:
+    """
+    chart_bazi_layers 的倒排位图索引
+    - postings[field][code] = 位图
+    - codes[field][row] = 该行的字段编码
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.loaded_at = 0.0
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._chart_ids: List[int] = []
+        self._rows: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._alive = 0
+        self._dicts: Dict[str, Dict[Any, int]] = {field: {} for field in STRUCTURE_FIELDS}
+        self._codes: Dict[str, List[int]] = {field: [] for field in INDEX_FIELDS}
+        self._postings: Dict[str, Dict[int, int]] = {field: {} for field in INDEX_FIELDS}
+
+    # ---------------- 编码 ----------------
+
+    def _encode(self, field: str, value: Any, create: bool = True) -> Optional[int]:
+        """四柱走甲子表；其余值（含空值、非标准写法）走字段字典，编号从 60 起"""
+        if field in PILLAR_FIELDS and value in JIAZI:
+            return JIAZI[value]
+        mapping = self._dicts.setdefault(field, {})
+        code = mapping.get(value)
+        if code is None and create:
+            code = mapping[value] = 60 + len(mapping)
+        return code
+
+    # ---------------- 写入 ----------------
+
+    def upsert(self, row: Dict[str, Any]) -> None:
+        chart_id = row["chart_id"]
+        with self._lock:
+            self._remove(chart_id)
+            pos = self._free.pop() if self._free else len(self._chart_ids)
+            if pos == len(self._chart_ids):
+                self._chart_ids.append(chart_id)
+                for field in INDEX_FIELDS:
+                    self._codes[field].append(-1)
+            else:
+                self._chart_ids[pos] = chart_id
+            bit = 1 << pos
+            for field in INDEX_FIELDS:
+                code = self._encode(field, row.get(field))
+                self._codes[field][pos] = code
+                postings = self._postings[field]
+                postings[code] = postings.get(code, 0) | bit
+            self._rows[chart_id] = pos
+            self._alive |= bit
+
+    def remove(self, chart_id: int) -> None:
+        with self._lock:
+            self._remove(chart_id)
+
+    def _remove(self, chart_id: int) -> None:
+        pos = self._rows.pop(chart_id, None)
+        if pos is None:
+            return
+        mask = ~(1 << pos)
+        for field in INDEX_FIELDS:
+            code = self._codes[field][pos]
+            self._postings[field][code] &= mask
+        self._alive &= mask
+        self._free.append(pos)
+
+    def load(self) -> int:
+        """从 chart_bazi_layers 分页加载索引字段（不取全行）"""
+        client = get_supabase_client()
+        columns = ", ".join(["chart_id"] + INDEX_FIELDS)
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            res = client.table("chart_bazi_layers")\
+                .select(columns)\
+                .order("chart_id")\
+                .range(offset, offset + LOAD_PAGE_SIZE - 1)\
+                .execute()
+            page = res.data or []
+            rows.extend(page)
+            if len(page) < LOAD_PAGE_SIZE:
+                break
+            offset += LOAD_PAGE_SIZE
+
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self.upsert(row)
+            self.loaded = True
+            self.loaded_at = time.time()
+        print(f"[BaziBitmapIndex] Loaded {len(rows)} charts")
+        return len(rows)
+
+    # ---------------- 查询 ----------------
+
+    def _bitmap(self, field: str, value: Any) -> int:
+        code = self._encode(field, value, create=False)
+        return self._postings[field].get(code, 0) if code is not None else 0
+
+    def candidates(self, base: Dict[str, Any], mode: str) -> int:
+        """
+        返回 mode 的候选位图
+        与 _fetch_candidates 一致：基准命盘缺失的字段不参与过滤
+        """
+        with self._lock:
+            bits = self._alive
+            for field in MODE_FIELDS.get(mode, []):
+                if base.get(field):
+                    bits &= self._bitmap(field, base[field])
+            own = self._rows.get(base.get("chart_id"))
+            if own is not None:
+                bits &= ~(1 << own)
+            return bits
+
+    def count(self, base: Dict[str, Any], mode: str) -> int:
+        """精确候选数"""
+        return self.candidates(base, mode).bit_count()
+
+    def level_counts(self, base: Dict[str, Any]) -> Dict[str, int]:
+        """一次求交返回每种模式（same_year_pillar … same_yongshen）的精确候选数"""
+        with self._lock:
+            bits = self._alive
+            own = self._rows.get(base.get("chart_id"))
+            if own is not None:
+                bits &= ~(1 << own)
+            counts = {}
+            # MODE_FIELDS 逐层多一个字段，沿用上一层的位图继续求交
+            for mode, fields in MODE_FIELDS.items():
+                field = fields[-1]
+                if base.get(field):
+                    bits &= self._bitmap(field, base[field])
+                counts[mode] = bits.bit_count()
+            return counts
+
+    def top_page(self, base: Dict[str, Any], mode: str, limit: int) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        按四柱阶梯（年月日时 > 年月日 > 年月 > 年 > 其他）从高分层取一页 chart_id
+        每个候选同时给出与基准连续相同的柱数（0-4），由位图求交得到，不再逐条比较字符串
+
+        Returns:
+            ([(chart_id, 相同柱数), ...], 精确候选总数)
+        """
+        with self._lock:
+            bits = self.candidates(base, mode)
+            total = bits.bit_count()
+
+            # 与 bazi_match_score 一致：逐柱相等即可（包括空值相等）
+            tiers = []
+            prefix = bits
+            for field in PILLAR_FIELDS:
+                prefix &= self._bitmap(field, base.get(field))
+                tiers.append(prefix)
+
+            page: List[Tuple[int, int]] = []
+            taken = 0
+            for depth, tier in zip(range(len(tiers), -1, -1), list(reversed(tiers)) + [bits]):
+                tier &= ~taken
+                taken |= tier
+                while tier and len(page) < limit:
+                    low = tier & -tier
+                    page.append((self._chart_ids[low.bit_length() - 1], depth))
+                    tier ^= low
+                if len(page) >= limit:
+                    break
+            return page, total
+
+
+_holder = ReloadingIndex(BaziBitmapIndex, RELOAD_INTERVAL, "BaziBitmapIndex")
+
+
+def get_bazi_index() -> BaziBitmapIndex:
+    """
+    获取进程级八字位图索引
+    首次访问时同步加载；过期后继续使用当前索引，后台重建新索引后整体替换
+    """
+    return _holder.get()
+
+
+def warm_bazi_index() -> None:
+    """后台预加载索引"""
+    _holder.warm()
+
+
+def register_bazi_chart(row: Dict[str, Any]) -> None:
+    """新八字写入 chart_bazi_layers 后调用，增量更新索引"""
+    if row.get("chart_id") is None:
+        return
+    _holder.update(lambda index: index.upsert(row))
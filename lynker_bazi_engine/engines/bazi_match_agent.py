@@ -16,57 +16,16 @@ Bazi Match Agent for Soul-Level Matching (传统友好版)
 
 from typing import List, Dict, Any, Optional, Tuple
 from lynker_bazi_engine.supabase_client import get_supabase_client
+from lynker_bazi_engine.engines.bazi_bitmap_index import get_bazi_index, register_bazi_chart
+
+# 每次匹配回表取数据的最大候选数
+CANDIDATE_PAGE_SIZE = 200
 
 
 # ============================================================
 # 工具函数：计算匹配 profile & 评分
 # ============================================================
 
-def _compute_match_flags(base: Dict[str, Any],
-                         cand: Dict[str, Any]) -> Dict[str, bool]:
-    """
-    对比基准八字与候选八字，计算 8 个维度的布尔匹配情况
-    """
-    flags = {
-        "same_year_pillar": False,
-        "same_month_pillar": False,
-        "same_day_pillar": False,
-        "same_hour_pillar": False,
-        "same_tiangan": False,
-        "same_dizhi": False,
-        "same_pattern": False,
-        "same_yongshen": False,
-    }
-
-    # 四柱
-    if base.get("year_pillar") and cand.get("year_pillar"):
-        flags["same_year_pillar"] = (base["year_pillar"] == cand["year_pillar"])
-
-    if flags["same_year_pillar"] and base.get("month_pillar") and cand.get("month_pillar"):
-        flags["same_month_pillar"] = (base["month_pillar"] == cand["month_pillar"])
-
-    if flags["same_month_pillar"] and base.get("day_pillar") and cand.get("day_pillar"):
-        flags["same_day_pillar"] = (base["day_pillar"] == cand["day_pillar"])
-
-    if flags["same_day_pillar"] and base.get("hour_pillar") and cand.get("hour_pillar"):
-        flags["same_hour_pillar"] = (base["hour_pillar"] == cand["hour_pillar"])
-
-    # 结构项（仅作研究用）
-    if base.get("tiangan_structure") and cand.get("tiangan_structure"):
-        flags["same_tiangan"] = (base["tiangan_structure"] == cand["tiangan_structure"])
-
-    if base.get("dizhi_structure") and cand.get("dizhi_structure"):
-        flags["same_dizhi"] = (base["dizhi_structure"] == cand["dizhi_structure"])
-
-    if base.get("pattern_type") and cand.get("pattern_type"):
-        flags["same_pattern"] = (base["pattern_type"] == cand["pattern_type"])
-
-    if base.get("yongshen") and cand.get("yongshen"):
-        flags["same_yongshen"] = (base["yongshen"] == cand["yongshen"])
-
-    return flags
-
-
 def _compute_score_and_text(flags: Dict[str, bool]) -> Tuple[int, str]:
     """
     根据四柱匹配情况计算评分与条件文本
@@ -166,6 +125,7 @@ def get_base_bazi(chart_id: int) -> Optional[Dict[str, Any]]:
 
         insert_res = client.table("chart_bazi_layers").insert(default_bazi).execute()
         if insert_res.data:
+            register_bazi_chart(insert_res.data[0])
             return insert_res.data[0]
 
         return default_bazi
@@ -181,7 +141,46 @@ def get_base_bazi(chart_id: int) -> Optional[Dict[str, Any]]:
 # 候选集获取（按最低过滤条件：mode）
 # ============================================================
 
-def _fetch_candidates(base: Dict[str, Any], mode: str) -> List[Dict[str, Any]]:
+def _fetch_candidates(base: Dict[str, Any], mode: str) -> Tuple[List[Tuple[Dict[str, Any], Optional[int]]], Optional[int]]:
+    """
+    根据 mode 设定「最低过滤条件」取一页候选记录。
+
+    优先使用内存位图索引求交（按四柱阶梯从高分层取一页，再回表取完整数据）；
+    索引不可用时退回 Supabase 逐条件过滤。
+
+    Returns:
+        ([(候选行, 与基准连续相同的柱数；数据库过滤时为 None), ...], 满足 mode 的精确候选总数)
+    """
+    try:
+        return _fetch_candidates_indexed(base, mode)
+    except Exception as e:
+        print(f"[BaziMatchAgent] 位图索引不可用，改用数据库过滤: {e}")
+        return _fetch_candidates_remote(base, mode)
+
+
+def _fetch_candidates_indexed(base: Dict[str, Any], mode: str,
+                              limit: int = CANDIDATE_PAGE_SIZE) -> Tuple[List[Tuple[Dict[str, Any], Optional[int]]], Optional[int]]:
+    """位图求交得到候选页及各候选的相同柱数，只对该页回表"""
+    page, total = get_bazi_index().top_page(base, mode, limit)
+    if not page:
+        return [], total
+
+    client = get_supabase_client()
+    res = client.table("chart_bazi_layers").select("*").in_("chart_id", [cid for cid, _ in page]).execute()
+    by_id = {row["chart_id"]: row for row in (res.data or [])}
+    return [(by_id[cid], depth) for cid, depth in page if cid in by_id], total
+
+
+def count_bazi_matches(base: Dict[str, Any]) -> Dict[str, int]:
+    """一次求交返回 8 种模式各自的精确候选人数（不回表；索引不可用时返回空）"""
+    try:
+        return get_bazi_index().level_counts(base)
+    except Exception as e:
+        print(f"[BaziMatchAgent] 位图索引不可用，无法统计候选人数: {e}")
+        return {}
+
+
+def _fetch_candidates_remote(base: Dict[str, Any], mode: str) -> Tuple[List[Tuple[Dict[str, Any], Optional[int]]], Optional[int]]:
     """
     根据 mode 设定「最低过滤条件」，从 Supabase 拉一批候选记录。
 
@@ -196,7 +195,7 @@ def _fetch_candidates(base: Dict[str, Any], mode: str) -> List[Dict[str, Any]]:
         same_yongshen      -> 同上 + 同用神（最严格，几乎完全同命）
     """
     client = get_supabase_client()
-    q = client.table("chart_bazi_layers").select("*").neq("chart_id", base["chart_id"])
+    q = client.table("chart_bazi_layers").select("*", count="exact").neq("chart_id", base["chart_id"])
 
     # 基础：四柱递进
     if mode in ("same_year_pillar",
@@ -254,8 +253,8 @@ def _fetch_candidates(base: Dict[str, Any], mode: str) -> List[Dict[str, Any]]:
         if base.get("yongshen"):
             q = q.eq("yongshen", base["yongshen"])
 
-    res = q.limit(200).execute()
-    return res.data or []
+    res = q.limit(CANDIDATE_PAGE_SIZE).execute()
+    return [(row, None) for row in (res.data or [])], res.count
 
 
 # ============================================================
@@ -275,37 +274,56 @@ CRITERIA_TEXT_MAP = {
 }
 
 
-from engines.match_score_engine import calculate_match_score
-from db.match_scores_db import save_match_score
+from engines.match_score_engine import calculate_match_score, bazi_score_for_depth
+from lynker_bazi_engine.db.match_scores_db import queue_match_scores
 
 def run_bazi_match(chart_id: int, mode: str = "same_year_pillar") -> List[Dict[str, Any]]:
     """
     执行八字匹配（v3 版）
     集成统一评分内核 + 数据库持久化
     """
+    return run_bazi_match_report(chart_id, mode, with_counts=False)["results"]
+
+
+def run_bazi_match_report(chart_id: int, mode: str = "same_year_pillar",
+                          with_counts: bool = True) -> Dict[str, Any]:
+    """
+    执行八字匹配，同时返回统计（基准八字只读取一次）
+
+    Returns:
+        {
+            "results": 按分数排序的匹配结果（最多 CANDIDATE_PAGE_SIZE 个候选），
+            "total": 满足 mode 的精确候选总数（不受页大小限制；无法得到时为结果条数），
+            "level_counts": 8 种模式各自的精确候选人数（with_counts=False 或索引不可用时为空）
+        }
+    """
     base = get_base_bazi(chart_id)
     if not base:
         print(f"[BaziMatchAgent] 无法获取 chart_id={chart_id} 的八字数据")
-        return []
+        return {"results": [], "total": 0, "level_counts": {}}
 
     # 1. 拉候选集（根据 mode 做最小过滤）
-    candidates = _fetch_candidates(base, mode)
+    candidates, total = _fetch_candidates(base, mode)
 
     results: List[Dict[str, Any]] = []
+    pending_scores = []
 
     # 2. 对每个候选进行评分 & 标记
-    for cand in candidates:
-        # 调用统一评分引擎
-        score_res = calculate_match_score(
-            chart_id, 
-            cand['chart_id'], 
-            engine='bazi', 
-            data_a=base, 
-            data_b=cand
-        )
+    for cand, depth in candidates:
+        # 统一评分引擎：位图索引已给出相同柱数时直接按柱数评分，不再逐条比较字符串
+        if depth is not None:
+            score_res = bazi_score_for_depth(depth)
+        else:
+            score_res = calculate_match_score(
+                chart_id, 
+                cand['chart_id'], 
+                engine='bazi', 
+                data_a=base, 
+                data_b=cand
+            )
         
-        # 保存到数据库
-        save_match_score(chart_id, cand['chart_id'], 'bazi', score_res)
+        # 保存到数据库（循环结束后批量写入）
+        pending_scores.append((chart_id, cand['chart_id'], 'bazi', score_res))
         
         # 转换格式适配前端
         matched_rules = set(score_res['matched_rules'])
@@ -357,10 +375,16 @@ def run_bazi_match(chart_id: int, mode: str = "same_year_pillar") -> List[Dict[s
 
         results.append(item)
 
+    queue_match_scores(pending_scores)
+
     # 3. 默认按分数从高到低排序
     results.sort(key=lambda x: x["score"], reverse=True)
 
-    return results
+    return {
+        "results": results,
+        "total": total if total is not None else len(results),
+        "level_counts": count_bazi_matches(base) if with_counts else {}
+    }
 
 
 def build_bazi_criteria_text(mode: str) -> str:
@@ -0,0 +1,101 @@
+"""
+灵客引擎 · 内存索引的加载与后台重载
+Reload-and-Swap Holder for In-Process Indexes
+
+时间层级索引、八字位图索引、排行榜共用：
+- 首次访问时同步加载（并发的首批请求只加载一次）
+- 超过 reload_interval 后继续使用当前索引，后台线程加载一份新索引后整体替换，
+  兜底其他进程（其他 worker、种子脚本）直接写表的情况
+- 增量更新经 update() 应用到当前索引；后台重载期间同时登记，新索引换入前补上
+- reload() 同步执行一次同样的重载与替换（手动重算）
+
+被持有的索引需提供：loaded / loaded_at 属性与 load() 方法
+"""
+
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+
+class ReloadingIndex:
+    def __init__(self, factory: Callable[[], Any], reload_interval: float, name: str):
+        """
+        Args:
+            factory: 返回一个未加载的新索引
+            reload_interval: 全量重载间隔（秒）
+            name: 日志与线程名前缀
+        """
+        self._factory = factory
+        self.reload_interval = reload_interval
+        self.name = name
+        self._index = factory()
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reload_run_lock = threading.Lock()   # 同一时间只有一次重载
+        self._pending: Optional[List[Callable[[Any], None]]] = None   # 后台重载期间登记的增量更新
+
+    def get(self) -> Any:
+        """当前索引；未加载时同步加载，过期时触发后台重载"""
+        index = self._index
+        if not index.loaded:
+            with self._load_lock:
+                index = self._index
+                if not index.loaded:
+                    index.load()
+        elif time.time() - index.loaded_at > self.reload_interval:
+            self._schedule_reload()
+        return index
+
+    def update(self, apply: Callable[[Any], None]) -> None:
+        """对当前索引执行 apply(index)；未加载时跳过（首次加载会读到该变更）"""
+        with self._reload_lock:
+            if self._pending is not None:
+                self._pending.append(apply)
+            index = self._index
+        if index.loaded:
+            apply(index)
+
+    def reload(self) -> Any:
+        """同步重载并替换，失败时抛出异常（继续使用旧索引）"""
+        self._reload(raise_errors=True)
+        return self._index
+
+    def warm(self) -> None:
+        """后台预加载，避免首个请求承担加载耗时"""
+        def _load():
+            try:
+                self.get()
+            except Exception as e:
+                print(f"[{self.name}] Warm-up failed: {e}")
+        threading.Thread(target=_load, name=f"{self.name}-warmup", daemon=True).start()
+
+    def _schedule_reload(self) -> None:
+        with self._reload_lock:
+            if self._pending is not None or time.time() - self._index.loaded_at <= self.reload_interval:
+                return
+            self._pending = []
+        threading.Thread(target=self._reload, name=f"{self.name}-reload", daemon=True).start()
+
+    def _reload(self, raise_errors: bool = False) -> None:
+        with self._reload_run_lock:
+            with self._reload_lock:
+                if self._pending is None:
+                    self._pending = []
+            error = None
+            try:
+                fresh = self._factory()
+                fresh.load()
+            except Exception as e:
+                fresh, error = None, e
+                print(f"[{self.name}] Reload failed: {e}")
+            with self._reload_lock:
+                if fresh is not None:
+                    for apply in self._pending:
+                        apply(fresh)
+                    self._index = fresh
+                else:
+                    # 失败后等下一个重载周期再试，期间继续使用旧索引
+                    self._index.loaded_at = time.time()
+                self._pending = None
+        if error is not None and raise_errors:
+            raise error
@@ -4,12 +4,258 @@ Leaderboard Engine for Same-Life Matching
 适配统一评分表 match_scores
 """
 
+import threading
+import time
+from bisect import bisect_left, insort
 from typing import List, Dict, Any, Optional, Tuple
 from lynker_bazi_engine.supabase_client import get_supabase_client
+from lynker_bazi_engine.engines.index_reloader import ReloadingIndex
+
+# 全量加载 match_scores 时的分页大小
+LOAD_PAGE_SIZE = 1000
+
+# 全量重载间隔（秒）：兜底其他 worker、脚本直接写 match_scores 的情况
+RELOAD_INTERVAL = 300
+
+
+def _compute_final_score(engine: str, count: int, total: int, max_score: int) -> Tuple[float, float, float]:
+    """
+    引擎专属评分逻辑
+    
+    Returns:
+        (final_score 用于排序, display_score 用于前端显示, avg_score)
+    """
+    avg_score = total / count
+
+    # === TimeMatch 专用逻辑 ===
+    if engine == "time":
+        # 🌟 频率共振哲学：取历史最高分（峰值共振）
+        # 而非平均分（统计学系统）
+        
+        # 1. 基础分：峰值共振分数
+        final_score = max_score / 100.0
+        
+        # 🌟 修正逻辑：完美共振豁免权
+        # 如果达到100分（完美同频），直接给100%，无视样本衰减
+        if max_score >= 100:
+            final_score = 1.0
+        else:
+            # 2. 样本衰减系数：少于5次匹配自动降权
+            if count < 5:
+                final_score *= 0.85
+            
+            # 3. 防止非完美分数的100%泛滥
+            if final_score >= 0.99:
+                final_score = 0.97
+        
+        return final_score, max_score, avg_score  # avg_score 仅用于展示
+
+    # === BaziMatch 专用逻辑 ===
+    if engine == "bazi":
+        # 传统八字使用纯平均分（已在四柱评分中区分）
+        return avg_score / 100.0, max_score, avg_score
+
+    # 默认逻辑
+    return avg_score / 100.0, avg_score, avg_score
+
+
+class _ChartStats:
+    """单个命盘在某引擎下的聚合：次数、总分、最高分、验证次数"""
+
+    __slots__ = ("count", "total", "verified", "scores")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.verified = 0
+        self.scores: List[int] = []  # 有序，支持覆盖写入后重算最高分
+
+    def add(self, score: int, verified: bool) -> None:
+        self.count += 1
+        self.total += score
+        self.verified += 1 if verified else 0
+        insort(self.scores, score)
+
+    def remove(self, score: int, verified: bool) -> None:
+        self.count -= 1
+        self.total -= score
+        self.verified -= 1 if verified else 0
+        del self.scores[bisect_left(self.scores, score)]
+
+    @property
+    def max_score(self) -> int:
+        return self.scores[-1] if self.scores else 0
+
+
+class LeaderboardStore:
+    """
+    单个引擎的增量排行榜
+    - 每对 (chart_id_a, chart_id_b) 记录最新评分，覆盖写入时先撤销旧贡献
+    - 每个命盘维护 count / sum / max / verified
+    - 有序键列表 (-final_score, chart_id) 支持 O(log n) 名次查询与 top-k 读取
+    """
+
+    def __init__(self, engine: str):
+        self.engine = engine
+        self.loaded = False
+        self.loaded_at = 0.0
+        self._lock = threading.RLock()
+        self._pairs: Dict[Tuple[int, int], Tuple[int, bool]] = {}
+        self._stats: Dict[int, _ChartStats] = {}
+        self._rank_key: Dict[int, Tuple[float, int]] = {}
+        self._ranking: List[Tuple[float, int]] = []
+
+    # ---------------- 写入 ----------------
+
+    def apply(self, rows: List[Dict[str, Any]]) -> None:
+        """应用 match_scores 行（新增或覆盖），幂等"""
+        with self._lock:
+            touched = set()
+            for row in rows:
+                if row.get("engine_type", self.engine) != self.engine:
+                    continue
+                a, b = row["chart_id_a"], row["chart_id_b"]
+                score = row.get("score") or 0
+                verified = (row.get("verified_count") or 0) > 0
+
+                old = self._pairs.get((a, b))
+                if old == (score, verified):
+                    continue
+                for uid in (a, b):
+                    stats = self._stats.get(uid)
+                    if stats is None:
+                        stats = self._stats[uid] = _ChartStats()
+                    if old is not None:
+                        stats.remove(*old)
+                    stats.add(score, verified)
+                    touched.add(uid)
+                self._pairs[(a, b)] = (score, verified)
+
+            for uid in touched:
+                self._rerank(uid)
+
+    def _rerank(self, uid: int) -> None:
+        old_key = self._rank_key.pop(uid, None)
+        if old_key is not None:
+            del self._ranking[bisect_left(self._ranking, old_key)]
+        stats = self._stats[uid]
+        if stats.count == 0:
+            return
+        final_score, _, _ = _compute_final_score(self.engine, stats.count, stats.total, stats.max_score)
+        key = (-final_score, uid)
+        insort(self._ranking, key)
+        self._rank_key[uid] = key
+
+    def load(self) -> None:
+        """从 match_scores 分页全量加载（不再受 1000 行截断影响）；由 ReloadingIndex 在新对象上调用后整体替换"""
+        client = get_supabase_client()
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            res = client.table("match_scores")\
+                .select("chart_id_a, chart_id_b, engine_type, score, verified_count")\
+                .eq("engine_type", self.engine)\
+                .order("chart_id_a")\
+                .order("chart_id_b")\
+                .range(offset, offset + LOAD_PAGE_SIZE - 1)\
+                .execute()
+            page = res.data or []
+            rows.extend(page)
+            if len(page) < LOAD_PAGE_SIZE:
+                break
+            offset += LOAD_PAGE_SIZE
+
+        with self._lock:
+            self._pairs.clear()
+            self._stats.clear()
+            self._rank_key.clear()
+            self._ranking.clear()
+            self.apply(rows)
+            self.loaded = True
+            self.loaded_at = time.time()
+
+    # ---------------- 读取 ----------------
+
+    def _entry(self, uid: int, rank: int) -> Dict[str, Any]:
+        stats = self._stats[uid]
+        final_score, display_score, avg_score = _compute_final_score(
+            self.engine, stats.count, stats.total, stats.max_score
+        )
+        return {
+            "user_id": uid,
+            "chart_id": uid,
+            "match_count": stats.count,
+            "verified_count": stats.verified,
+            "final_score": final_score,  # 用于排序
+            "display_score": display_score,  # ✅ 用于前端显示（原始分数）
+            "avg_score": avg_score,
+            "rank": rank
+        }
+
+    def top(self, limit: int, exclude_user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            board = []
+            for _, uid in self._ranking:
+                # ✅ 排除当前用户
+                if uid == exclude_user_id:
+                    continue
+                if len(board) >= limit:
+                    break
+                board.append(self._entry(uid, len(board) + 1))
+            return board
+
+    def rank_of(self, uid: int, exclude_user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            key = self._rank_key.get(uid)
+            if key is None or uid == exclude_user_id:
+                return None
+            rank = bisect_left(self._ranking, key) + 1
+            excluded_key = self._rank_key.get(exclude_user_id) if exclude_user_id is not None else None
+            if excluded_key is not None and excluded_key < key:
+                rank -= 1
+            return self._entry(uid, rank)
+
+
+_stores: Dict[str, ReloadingIndex] = {}
+_stores_lock = threading.Lock()
+
+
+def _store_holder(engine: str) -> ReloadingIndex:
+    with _stores_lock:
+        holder = _stores.get(engine)
+        if holder is None:
+            holder = _stores[engine] = ReloadingIndex(
+                lambda: LeaderboardStore(engine), RELOAD_INTERVAL, f"Leaderboard-{engine}"
+            )
+        return holder
+
+
+def get_leaderboard_store(engine: str = "time") -> LeaderboardStore:
+    """
+    获取引擎对应的排行榜
+    首次访问时从数据库加载（并发的首批请求只加载一次）；过期后继续使用当前榜单，后台重载后整体替换
+    """
+    return _store_holder(engine).get()
+
+
+def record_match_scores(rows: List[Dict[str, Any]]) -> None:
+    """
+    match_scores 写入成功后的增量更新钩子
+    仅更新已加载的榜单（重载期间同时登记，换入新榜单前补上）；未加载的榜单会在首次访问时从数据库读取
+    """
+    by_engine: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        by_engine.setdefault(row.get("engine_type"), []).append(row)
+    for engine, engine_rows in by_engine.items():
+        with _stores_lock:
+            holder = _stores.get(engine)
+        if holder is not None:
+            holder.update(lambda store, engine_rows=engine_rows: store.apply(engine_rows))
+
 
 def get_dynamic_leaderboard(engine: str = "time", limit: int = 10, exclude_user_id: Optional[int] = None) -> List[Dict[str, Any]]:
     """
-    基于 match_scores 表动态计算排行榜
+    基于 match_scores 表的增量排行榜
     
     Args:
         engine: 'time' | 'bazi'
@@ -17,109 +263,7 @@ def get_dynamic_leaderboard(engine: str = "time", limit: int = 10, exclude_user_
         exclude_user_id: 排除的用户ID（通常是当前搜索用户）
     """
     try:
-        client = get_supabase_client()
-        
-        res = client.table("match_scores")\
-            .select("*")\
-            .eq("engine_type", engine)\
-            .order("score", desc=True)\
-            .limit(1000)\
-            .execute()
-            
-        matches = res.data if res.data else []
-        
-        # 内存聚合
-        stats = {}
-        
-        for m in matches:
-            u1 = m["chart_id_a"]
-            u2 = m["chart_id_b"]
-            score = m["score"]
-            verified = m.get("verified_count", 0) > 0
-            
-            for uid in [u1, u2]:
-                # ✅ 排除当前用户
-                if exclude_user_id is not None and uid == exclude_user_id:
-                    continue
-                    
-                if uid not in stats:
-                    stats[uid] = {
-                        "total_score": 0,
-                        "count": 0,
-                        "verified": 0
-                    }
-                stats[uid]["total_score"] += score
-                stats[uid]["count"] += 1
-                if verified:
-                    stats[uid]["verified"] += 1
-                    
-        # 计算最终得分并排序
-        # 使用引擎专属评分逻辑
-        leaderboard = []
-        for uid, s in stats.items():
-            match_count = s["count"]
-            
-            # === TimeMatch 专用逻辑 ===
-            if engine == "time":
-                # 🌟 频率共振哲学：取历史最高分（峰值共振）
-                # 而非平均分（统计学系统）
-                max_score = max(
-                    [m["score"] for m in matches if uid in [m["chart_id_a"], m["chart_id_b"]]],
-                    default=0
-                )
-                
-                # 1. 基础分：峰值共振分数
-                final_score = max_score / 100.0
-                
-                # 🌟 修正逻辑：完美共振豁免权
-                # 如果达到100分（完美同频），直接给100%，无视样本衰减
-                if max_score >= 100:
-                    final_score = 1.0
-                else:
-                    # 2. 样本衰减系数：少于5次匹配自动降权
-                    if match_count < 5:
-                        final_score *= 0.85
-                    
-                    # 3. 防止非完美分数的100%泛滥
-                    if final_score >= 0.99:
-                        final_score = 0.97
-                
-                avg_score = s["total_score"] / s["count"]  # 仅用于展示
-            
-            # === BaziMatch 专用逻辑 ===
-            elif engine == "bazi":
-                # 传统八字使用纯平均分（已在四柱评分中区分）
-                avg_score = s["total_score"] / s["count"]
-                max_score = max(
-                    [m["score"] for m in matches if uid in [m["chart_id_a"], m["chart_id_b"]]],
-                    default=0
-                )
-                final_score = avg_score / 100.0
-            
-            else:
-                # 默认逻辑
-                avg_score = s["total_score"] / s["count"]
-                max_score = avg_score
-                final_score = avg_score / 100.0
-            
-            leaderboard.append({
-                "user_id": uid, 
-                "chart_id": uid,
-                "match_count": s["count"],
-                "verified_count": s["verified"],
-                "final_score": final_score,  # 用于排序
-                "display_score": max_score,  # ✅ 用于前端显示（原始分数）
-                "avg_score": avg_score
-            })
-            
-        leaderboard.sort(key=lambda x: x["final_score"], reverse=True)
-        
-        # 添加排名
-        for i, item in enumerate(leaderboard):
-            item['rank'] = i + 1
-            
-        return leaderboard[:limit]
-        
+        return get_leaderboard_store(engine).top(limit, exclude_user_id)
     except Exception as e:
         print(f"[Leaderboard] Calculate failed: {e}")
         return []
@@ -148,7 +292,11 @@ def calculate_leaderboard(weight_version_id: Optional[int] = None) -> List[Dict[
     return get_dynamic_leaderboard("time")
 
 def recalculate_leaderboard(weight_version_id: Optional[int] = None) -> Dict[str, Any]:
-    """兼容接口：重新计算排行榜"""
+    """兼容接口：从数据库重新加载并计算排行榜"""
+    try:
+        _store_holder("time").reload()
+    except Exception as e:
+        print(f"[Leaderboard] Reload failed: {e}")
     lb = get_dynamic_leaderboard("time")
     return {
         "leaderboard": lb,
@@ -156,11 +304,9 @@ def recalculate_leaderboard(weight_version_id: Optional[int] = None) -> Dict[str
     }
 
 def get_user_rank(user_id: int) -> Optional[Dict[str, Any]]:
-    """获取指定用户的排名信息"""
-    # 从动态榜单中查找
-    # 注意：这里效率较低，生产环境应直接查询数据库或缓存
-    lb = get_dynamic_leaderboard("time", limit=1000)
-    for item in lb:
-        if item["user_id"] == user_id:
-            return item
-    return None
+    """获取指定用户的排名信息（有序榜单二分查找）"""
+    try:
+        return get_leaderboard_store("time").rank_of(user_id)
+    except Exception as e:
+        print(f"[Leaderboard] Get user rank failed: {e}")
+        return None
@@ -0,0 +1,163 @@
+"""
+灵客引擎 · 批量三层评分
+Vectorized Three-Layer Match Scoring
+
+match_engine 的 NumPy 批量版本：一个基准命盘对一整块候选命盘
+一次性计算时间 / 父柱 / 母柱评分及加权综合分。
+结果与 calculate_time_score / calculate_father_score /
+calculate_mother_score / calculate_composite_match 逐项一致。
+"""
+
+import math
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from .match_engine import DEFAULT_WEIGHTS
+
+FATHER_DIMS = [
+    "father_presence",
+    "father_authority",
+    "father_resource",
+    "father_conflict",
+    "father_distance"
+]
+
+MOTHER_DIMS = [
+    "mother_presence",
+    "mother_bond",
+    "mother_nurture",
+    "mother_control",
+    "mother_empty"
+]
+
+# 批量输入的结构化数组字段
+CHART_DTYPE = np.dtype(
+    [("chart_id", np.int64), ("time_diff_minutes", np.float64)]
+    + [(dim, np.float64) for dim in FATHER_DIMS + MOTHER_DIMS]
+)
+
+# 批量输出的结构化数组字段
+SCORE_DTYPE = np.dtype([
+    ("chart_id", np.int64),
+    ("time_score", np.int64),
+    ("father_score", np.int64),
+    ("mother_score", np.int64),
+    ("composite_score", np.int64),
+])
+
+_MAX_DISTANCE = math.sqrt(5 * (100 ** 2))
+
+
+def to_chart_array(
+    rows: Iterable[Tuple[Optional[int], Dict[str, Any], Dict[str, Any]]]
+) -> np.ndarray:
+    """
+    将 (chart_id, chart, family) 列表转换为 CHART_DTYPE 结构化数组
+    缺失字段使用与标量函数相同的默认值（时间差 0，父母柱 50）
+    """
+    records = []
+    for chart_id, chart, family in rows:
+        records.append(
+            (chart_id if chart_id is not None else -1, chart.get("time_diff_minutes", 0))
+            + tuple(family.get(dim, 50) for dim in FATHER_DIMS + MOTHER_DIMS)
+        )
+    return np.array(records, dtype=CHART_DTYPE)
+
+
+def weights_from_version(version: Dict[str, Any]) -> Dict[str, int]:
+    """将 weight_versions 记录（0.40 形式）转换为 DEFAULT_WEIGHTS 形式（40）"""
+    return {
+        "time": int(round(version["time_weight"] * 100)),
+        "father": int(round(version["father_weight"] * 100)),
+        "mother": int(round(version["mother_weight"] * 100)),
+    }
+
+
+def batch_time_scores(base: np.ndarray, block: np.ndarray) -> np.ndarray:
+    """批量版 calculate_time_score"""
+    diff = np.abs(base["time_diff_minutes"] - block["time_diff_minutes"])
+    score = np.select(
+        [diff == 0, diff <= 15, diff <= 60, diff <= 120],
+        [
+            np.full_like(diff, 100.0),
+            100 - diff * 4,
+            100 - diff * 1.5,
+            100 - diff * 0.8,
+        ],
+        default=100 - diff * 0.5,
+    )
+    return np.trunc(np.maximum(0, score)).astype(np.int64)
+
+
+def _batch_family_scores(base: np.ndarray, block: np.ndarray, dims) -> np.ndarray:
+    # 按维度顺序逐项累加，保证与标量实现的浮点结果逐位一致
+    squared_diffs = np.zeros(len(block), dtype=np.float64)
+    for dim in dims:
+        diff = np.abs(base[dim] - block[dim])
+        squared_diffs = squared_diffs + diff ** 2
+    similarity = 100 * (1 - np.sqrt(squared_diffs) / _MAX_DISTANCE)
+    return np.trunc(np.clip(similarity, 0, 100)).astype(np.int64)
+
+
+def batch_father_scores(base: np.ndarray, block: np.ndarray) -> np.ndarray:
+    """批量版 calculate_father_score"""
+    return _batch_family_scores(base, block, FATHER_DIMS)
+
+
+def batch_mother_scores(base: np.ndarray, block: np.ndarray) -> np.ndarray:
+    """批量版 calculate_mother_score"""
+    return _batch_family_scores(base, block, MOTHER_DIMS)
+
+
+def batch_composite_match(
+    base: np.ndarray,
+    block: np.ndarray,
+    weights: Optional[Dict[str, int]] = None
+) -> np.ndarray:
+    """
+    批量版 calculate_composite_match
+
+    Args:
+        base: 基准命盘（CHART_DTYPE 单条记录）
+        block: 候选命盘（CHART_DTYPE 数组）
+        weights: 权重配置，默认 DEFAULT_WEIGHTS；
+                 调优版本可用 weights_from_version() 转换
+
+    Returns:
+        SCORE_DTYPE 结构化数组，与 block 一一对应
+    """
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+
+    time_score = batch_time_scores(base, block)
+    father_score = batch_father_scores(base, block)
+    mother_score = batch_mother_scores(base, block)
+
+    composite = (
+        time_score * weights["time"] / 100 +
+        father_score * weights["father"] / 100 +
+        mother_score * weights["mother"] / 100
+    )
+
+    result = np.empty(len(block), dtype=SCORE_DTYPE)
+    result["chart_id"] = block["chart_id"]
+    result["time_score"] = time_score
+    result["father_score"] = father_score
+    result["mother_score"] = mother_score
+    result["composite_score"] = np.trunc(composite).astype(np.int64)
+    return result
+
+
+def score_all_pairs(
+    charts: np.ndarray,
+    weights: Optional[Dict[str, int]] = None
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    种子群体全量两两评分：依次以每个命盘为基准，对其后的命盘批量评分
+
+    Yields:
+        (base_chart_id, SCORE_DTYPE 数组)
+    """
+    for i in range(len(charts) - 1):
+        yield int(charts[i]["chart_id"]), batch_composite_match(charts[i], charts[i + 1:], weights)
@@ -142,68 +142,39 @@ def time_match_score(a: Dict, b: Dict, strict: bool = True) -> Dict[str, Any]:
 # BaziMatch 专用评分器
 # ============================================================
 
+BAZI_PILLAR_RULES = ["same_year_pillar", "same_month_pillar", "same_day_pillar", "same_hour_pillar"]
+BAZI_PILLAR_SCORES = [0, 20, 40, 70, 100]
+BAZI_STRUCTURE_RULES = ["same_tiangan", "same_dizhi", "same_pattern", "same_yongshen"]
+
+
 def bazi_match_score(a: Dict, b: Dict, strict: bool = True) -> Dict[str, Any]:
     """
     八字榜评分逻辑 - 传统稳定评分体系
     采用阶梯式评分：年(20) → 年月(40) → 年月日(70) → 年月日时(100)
     """
-    score = 0
-    matched = []
+    depth = 0
+    for field in ("year_pillar", "month_pillar", "day_pillar", "hour_pillar"):
+        if a.get(field) != b.get(field):
+            break
+        depth += 1
+    return bazi_score_for_depth(depth)
 
-    # 检查四柱
-    same_year = a.get("year_pillar") == b.get("year_pillar")
-    same_month = a.get("month_pillar") == b.get("month_pillar")
-    same_day = a.get("day_pillar") == b.get("day_pillar")
-    same_hour = a.get("hour_pillar") == b.get("hour_pillar")
-
-    # 传统稳定评分（阶梯式单调递增）
-    if same_year:
-        matched.append("same_year_pillar")
-        score = 20
-    if same_year and same_month:
-        matched.append("same_month_pillar")
-        score = 40
-    if same_year and same_month and same_day:
-        matched.append("same_day_pillar")
-        score = 70
-    if same_year and same_month and same_day and same_hour:
-        matched.append("same_hour_pillar")
-        score = 100
-    
-    # 自动勾选逻辑 (Extra)
-    extra = []
 
+def bazi_score_for_depth(depth: int) -> Dict[str, Any]:
+    """
+    按「从年柱起连续相同的柱数」给出评分结果（0-4 柱 → 0/20/40/70/100 分）
+    八字位图索引按整数编码求交已得到柱数，可直接调用，无需再比较四柱字符串
+    """
+    score = BAZI_PILLAR_SCORES[depth]
+    matched = BAZI_PILLAR_RULES[:depth]
+
+    # 自动勾选逻辑 (Extra)：四柱全同（100 分）时结构项全部视为满足，供 UI 自动打勾（auto_derived）
     if score == 100:
-        # 只有在100分(四柱全同)时才检查并自动推导这些结构
-        # 实际上如果四柱全同，这些结构大概率也是同的，或者我们强制视为同
-        
-        # 检查天干结构
-        if a.get("tiangan_structure") == b.get("tiangan_structure"):
-            extra.append("same_tiangan")
-        # 检查地支结构
-        if a.get("dizhi_structure") == b.get("dizhi_structure"):
-            extra.append("same_dizhi")
-        # 检查格局
-        if a.get("pattern_type") == b.get("pattern_type"):
-            extra.append("same_pattern")
-        # 检查用神
-        if a.get("yongshen") == b.get("yongshen"):
-            extra.append("same_yongshen")
-            
-        # 如果数据缺失但四柱全同，是否默认给True? 
-        # 根据之前的 "auto_derived" 逻辑，是的。
-        # 这里我们严格对比数据，如果数据为空则不算，或者根据业务需求调整。
-        # 您的Prompt中写的是 check_bazi(a,b,"tiangan")，隐含了对比逻辑。
-        
-        # 补充：为了符合 "auto_derived" 的 UI 表现，我们通常希望这些也是 True
-        if "same_tiangan" not in extra: extra.append("same_tiangan")
-        if "same_dizhi" not in extra: extra.append("same_dizhi")
-        if "same_pattern" not in extra: extra.append("same_pattern")
-        if "same_yongshen" not in extra: extra.append("same_yongshen")
+        matched = matched + BAZI_STRUCTURE_RULES
 
     return {
         "score": score,
-        "matched_rules": matched + extra,
+        "matched_rules": matched,
         "engine": "bazi",
         "auto_derived": (score == 100)
     }
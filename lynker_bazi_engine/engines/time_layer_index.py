@@ -0,0 +1,189 @@
+"""
+灵客引擎 · 时间层级内存索引
+Time Layer Index for 7-Level Cascading Time Matching
+
+将 chart_time_layers_v2 按
+    year → month → day → shichen → hour → quarter → minute
+构建为一棵层级树（trie），每个节点保存其下所有 chart_id。
+七种匹配模式只需沿路径走到对应深度即可得到候选集，
+一次遍历即可得到每一层的匹配人数。
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from lynker_bazi_engine.supabase_client import get_supabase_client
+from lynker_bazi_engine.engines.index_reloader import ReloadingIndex
+
+# 层级字段（与 build_time_match_filter 的递进顺序一致）
+LEVEL_FIELDS = ["year", "month", "day", "chinese_shichen", "hour", "quarter_15min", "minute"]
+
+# 匹配模式 → 层级深度
+LEVEL_MODES = [
+    "same_year",
+    "same_month",
+    "same_day",
+    "same_shichen",
+    "same_hour",
+    "same_quarter",
+    "same_minute",
+]
+
+# 启动时批量加载的分页大小
+LOAD_PAGE_SIZE = 1000
+
+# 全量重载间隔（秒）：兜底其他进程（如种子脚本）直接写表的情况
+RELOAD_INTERVAL = 600
+
+
+class _Node:
+    __slots__ = ("children", "chart_ids")
+
+    def __init__(self):
+        self.children: Dict[Any, "_Node"] = {}
+        self.chart_ids: Set[int] = set()
+
+
+class TimeLayerIndex:
+    """
+    chart_time_layers_v2 的层级内存索引
+    - load(): 启动时分页批量加载
+    - upsert(row) / remove(chart_id): 新命盘写入后增量更新
+    - lookup(path): 按路径前缀返回候选 chart_id
+    - level_counts(path): 一次遍历返回每一层的匹配人数
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.loaded_at = 0.0
+        self._lock = threading.RLock()
+        self._root = _Node()
+        self._rows: Dict[int, Dict[str, Any]] = {}
+        self._paths: Dict[int, tuple] = {}
+
+    @staticmethod
+    def path_of(row: Dict[str, Any]) -> tuple:
+        return tuple(row.get(field) for field in LEVEL_FIELDS)
+
+    # ---------------- 写入 ----------------
+
+    def upsert(self, row: Dict[str, Any]) -> None:
+        chart_id = row["chart_id"]
+        path = self.path_of(row)
+        with self._lock:
+            if self._paths.get(chart_id) != path:
+                self._detach(chart_id)
+                node = self._root
+                node.chart_ids.add(chart_id)
+                for value in path:
+                    node = node.children.setdefault(value, _Node())
+                    node.chart_ids.add(chart_id)
+                self._paths[chart_id] = path
+            self._rows[chart_id] = row
+
+    def remove(self, chart_id: int) -> None:
+        with self._lock:
+            self._detach(chart_id)
+            self._rows.pop(chart_id, None)
+
+    def _detach(self, chart_id: int) -> None:
+        path = self._paths.pop(chart_id, None)
+        if path is None:
+            return
+        node = self._root
+        node.chart_ids.discard(chart_id)
+        for value in path:
+            child = node.children[value]
+            child.chart_ids.discard(chart_id)
+            if not child.chart_ids:
+                del node.children[value]
+                break
+            node = child
+
+    def load(self) -> int:
+        """从 chart_time_layers_v2 分页全量加载，返回加载行数"""
+        client = get_supabase_client()
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            res = client.table("chart_time_layers_v2")\
+                .select("*")\
+                .order("chart_id")\
+                .range(offset, offset + LOAD_PAGE_SIZE - 1)\
+                .execute()
+            page = res.data or []
+            rows.extend(page)
+            if len(page) < LOAD_PAGE_SIZE:
+                break
+            offset += LOAD_PAGE_SIZE
+
+        with self._lock:
+            self._root = _Node()
+            self._rows.clear()
+            self._paths.clear()
+            for row in rows:
+                self.upsert(row)
+            self.loaded = True
+            self.loaded_at = time.time()
+        print(f"[TimeLayerIndex] Loaded {len(rows)} charts")
+        return len(rows)
+
+    # ---------------- 读取 ----------------
+
+    def get(self, chart_id: int) -> Optional[Dict[str, Any]]:
+        return self._rows.get(chart_id)
+
+    def _walk(self, path: List[Any]) -> List[_Node]:
+        """沿路径前缀向下，返回每一层命中的节点（遇到缺失即停止）"""
+        nodes = []
+        node = self._root
+        for value in path:
+            node = node.children.get(value)
+            if node is None:
+                break
+            nodes.append(node)
+        return nodes
+
+    def lookup(self, path: List[Any], exclude_chart_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """返回与 path 前缀完全一致的候选行（按 chart_id 排序）"""
+        with self._lock:
+            nodes = self._walk(path)
+            if len(nodes) < len(path):
+                return []
+            chart_ids = nodes[-1].chart_ids if nodes else self._root.chart_ids
+            return [self._rows[cid] for cid in sorted(chart_ids) if cid != exclude_chart_id]
+
+    def level_counts(self, path: List[Any], exclude_chart_id: Optional[int] = None) -> Dict[str, int]:
+        """一次遍历返回每一层（same_year … same_minute）的匹配人数"""
+        with self._lock:
+            nodes = self._walk(path)
+            counts = {}
+            for mode, node in zip(LEVEL_MODES, nodes):
+                counts[mode] = len(node.chart_ids) - (1 if exclude_chart_id in node.chart_ids else 0)
+            for mode in LEVEL_MODES[len(nodes):len(path)]:
+                counts[mode] = 0
+            return counts
+
+
+_holder = ReloadingIndex(TimeLayerIndex, RELOAD_INTERVAL, "TimeLayerIndex")
+
+
+def get_time_layer_index() -> TimeLayerIndex:
+    """
+    获取进程级时间层级索引
+    首次访问时同步加载；过期后继续使用当前索引，后台重建新索引后整体替换
+    """
+    return _holder.get()
+
+
+def warm_time_layer_index() -> None:
+    """后台预加载索引，避免首个请求承担加载耗时"""
+    _holder.warm()
+
+
+def register_time_layer(row: Dict[str, Any]) -> None:
+    """新命盘写入 chart_time_layers_v2 后调用，增量更新索引"""
+    if row.get("chart_id") is None:
+        return
+    _holder.update(lambda index: index.upsert(row))
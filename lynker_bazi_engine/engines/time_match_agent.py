@@ -1,10 +1,15 @@
 # engines/time_match_agent.py
 from lynker_bazi_engine.supabase_client import get_supabase_client
+from lynker_bazi_engine.engines.time_layer_index import get_time_layer_index, register_time_layer
 
 def get_base_time_layer(chart_id: int):
-    """获取当前命盘的时间层数据"""
+    """获取当前命盘的时间层数据（优先读内存索引）"""
     if chart_id is None:
         return None
+    index = get_time_layer_index()
+    cached = index.get(chart_id)
+    if cached:
+        return cached
     client = get_supabase_client()
     res = (
         client.table("chart_time_layers_v2")
@@ -13,7 +18,11 @@ def get_base_time_layer(chart_id: int):
         .limit(1)
         .execute()
     )
-    return res.data[0] if res.data else None
+    if not res.data:
+        return None
+    # 索引加载后新写入的命盘：补入索引
+    register_time_layer(res.data[0])
+    return res.data[0]
 
 def build_time_match_filter(base, mode: str):
     """
@@ -47,7 +56,7 @@ def build_time_match_filter(base, mode: str):
     return where
 
 from engines.match_score_engine import calculate_match_score
-from db.match_scores_db import save_match_score
+from lynker_bazi_engine.db.match_scores_db import queue_match_scores
 
 def find_time_matches(chart_id: int, mode: str):
     """查找匹配灵友"""
@@ -56,16 +65,12 @@ def find_time_matches(chart_id: int, mode: str):
         return []
 
     where = build_time_match_filter(base, mode)
-    client = get_supabase_client()
-    query = client.table("chart_time_layers_v2").select("*")
-    for k, v in where.items():
-        query = query.eq(k, v)
-    query = query.neq("chart_id", chart_id)
-    res = query.execute()
+    candidates = get_time_layer_index().lookup(list(where.values()), exclude_chart_id=chart_id)
     
     matches = []
-    if res.data:
-        for candidate in res.data:
+    pending_scores = []
+    if candidates:
+        for candidate in candidates:
             # 统一评分计算 (传入已获取的数据以优化性能)
             score_res = calculate_match_score(
                 chart_id, 
@@ -75,8 +80,8 @@ def find_time_matches(chart_id: int, mode: str):
                 data_b=candidate
             )
             
-            # 保存评分到统一表
-            save_match_score(chart_id, candidate['chart_id'], 'time', score_res)
+            # 保存评分到统一表（批量后台写入，不阻塞响应）
+            pending_scores.append((chart_id, candidate['chart_id'], 'time', score_res))
             
             # ✅ 隐私保护：构造返回数据时排除敏感字段
             # time_layer_code 仅用于后端算法，不向前端暴露
@@ -88,9 +93,18 @@ def find_time_matches(chart_id: int, mode: str):
                 # 'year', 'month', 'day', 'hour' 等字段也不返回，防止逆推
             }
             matches.append(match_result)
-            
+
+    queue_match_scores(pending_scores)
     return matches
 
+def count_time_matches(chart_id: int):
+    """一次遍历返回 7 个层级各自的匹配人数"""
+    base = get_base_time_layer(chart_id)
+    if not base:
+        return {}
+    where = build_time_match_filter(base, "same_minute")
+    return get_time_layer_index().level_counts(list(where.values()), exclude_chart_id=chart_id)
+
 def build_criteria_text(mode: str):
     """构建中文匹配层级说明 (7-Level Structure)"""
     steps = [
@@ -10,63 +10,116 @@ Weight Tuner Engine
 """
 import sys
 import os
-from typing import List, Dict, Tuple, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Dict, Tuple, Any, Optional
 import json
 
+import numpy as np
+
 # 添加项目根目录到 Python 路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from lynker_bazi_engine.supabase_client import get_supabase_client
 
-def get_match_samples() -> List[Dict[str, Any]]:
-    """
-    获取用于训练的样本数据
-    
-    返回包含 time_score, father_score, mother_score 和 label (is_similar) 的列表
-    """
+# 分页读取的每页行数
+SAMPLE_PAGE_SIZE = 1000
+
+# 权重搜索范围（百分比）
+TIME_RANGE = (20, 60)
+FATHER_RANGE = (20, 60)
+MOTHER_RANGE = (10, 60)
+
+
+def _iter_table(table: str, columns: str, page_size: int = SAMPLE_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """按 id 分页流式读取整张表"""
     client = get_supabase_client()
+    offset = 0
+    while True:
+        page = client.table(table)\
+            .select(columns)\
+            .order("id")\
+            .range(offset, offset + page_size - 1)\
+            .execute().data or []
+        yield from page
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+
+def _label(chart_a: Dict[str, Any], chart_b: Dict[str, Any]) -> bool:
+    # 定义标签逻辑
+    # 同组 (T1 vs T1) 或 克隆盘 视为相似 (Positive)
+    # 不同组 (T1 vs T5) 视为不同 (Negative)
+    is_similar = False
+    if chart_a['test_group'] == chart_b['test_group']:
+        is_similar = True
     
-    # 1. 获取所有匹配记录
-    matches = client.table("chart_match_scores").select("*").execute().data
+    # 特殊处理：TEST_A vs TEST_A_CLONE 是强相似
+    if 'CLONE' in chart_a['chart_code'] or 'CLONE' in chart_b['chart_code']:
+        if chart_a['test_group'] == chart_b['test_group']:
+            is_similar = True
+    return is_similar
+
+
+def iter_match_samples(page_size: int = SAMPLE_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    分页流式读取训练样本
     
-    # 2. 获取种子盘信息以确定标签
+    逐条产出包含 time_score, father_score, mother_score 和 label (is_similar) 的字典
+    """
+    # 1. 获取种子盘信息以确定标签
     # 我们需要知道 chart_id 对应的 chart_code 或 test_group
-    charts = client.table("seed_charts").select("id, chart_code, test_group").execute().data
-    chart_map = {c['id']: c for c in charts}
-    
-    samples = []
+    chart_map = {
+        c['id']: c for c in _iter_table("seed_charts", "id, chart_code, test_group", page_size)
+    }
     
+    # 2. 分页读取匹配记录
+    matches = _iter_table(
+        "chart_match_scores",
+        "id, chart_id_a, chart_id_b, time_score, father_score, mother_score",
+        page_size
+    )
     for m in matches:
-        id_a = m['chart_id_a']
-        id_b = m['chart_id_b']
-        
-        if id_a not in chart_map or id_b not in chart_map:
+        chart_a = chart_map.get(m['chart_id_a'])
+        chart_b = chart_map.get(m['chart_id_b'])
+        if chart_a is None or chart_b is None:
             continue
-            
-        chart_a = chart_map[id_a]
-        chart_b = chart_map[id_b]
         
-        # 定义标签逻辑
-        # 同组 (T1 vs T1) 或 克隆盘 视为相似 (Positive)
-        # 不同组 (T1 vs T5) 视为不同 (Negative)
-        is_similar = False
-        if chart_a['test_group'] == chart_b['test_group']:
-            is_similar = True
-        
-        # 特殊处理：TEST_A vs TEST_A_CLONE 是强相似
-        if 'CLONE' in chart_a['chart_code'] or 'CLONE' in chart_b['chart_code']:
-            if chart_a['test_group'] == chart_b['test_group']:
-                is_similar = True
-                
-        samples.append({
+        yield {
             "time_score": m['time_score'],
             "father_score": m['father_score'],
             "mother_score": m['mother_score'],
-            "is_similar": is_similar,
+            "is_similar": _label(chart_a, chart_b),
             "pair": f"{chart_a['chart_code']} vs {chart_b['chart_code']}"
-        })
-        
-    return samples
+        }
+
+
+def get_match_samples() -> List[Dict[str, Any]]:
+    """
+    获取用于训练的样本数据
+    
+    返回包含 time_score, father_score, mother_score 和 label (is_similar) 的列表
+    """
+    return list(iter_match_samples())
+
+
+def load_sample_matrix(samples: Optional[List[Dict[str, Any]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    将样本一次性载入矩阵
+    
+    Returns:
+        (X, y) - X 为 (n, 3) 的 [time, father, mother] 评分，y 为 (n,) 布尔标签
+    """
+    source = samples if samples is not None else iter_match_samples()
+    scores: List[Tuple[float, float, float]] = []
+    labels: List[bool] = []
+    for s in source:
+        scores.append((s['time_score'], s['father_score'], s['mother_score']))
+        labels.append(s['is_similar'])
+    X = np.array(scores, dtype=np.float64).reshape(-1, 3)
+    y = np.array(labels, dtype=bool)
+    return X, y
+
 
 def test_weights(t_w: float, f_w: float, m_w: float, samples: List[Dict[str, Any]]) -> float:
     """
@@ -75,80 +128,148 @@ def test_weights(t_w: float, f_w: float, m_w: float, samples: List[Dict[str, Any
     准确率定义：(正样本平均分 - 负样本平均分) * 100
     旨在最大化区分度
     """
-    pos_scores = []
-    neg_scores = []
+    X, y = load_sample_matrix(samples)
+    return float(score_weight_grid(X, y, np.array([[t_w, f_w, m_w]]))[0])
+
+
+def score_weight_grid(X: np.ndarray, y: np.ndarray, W: np.ndarray) -> np.ndarray:
+    """
+    一次矩阵乘法评估整张权重网格
     
-    for s in samples:
-        # 重新计算综合分
-        composite = (
-            s['time_score'] * t_w +
-            s['father_score'] * f_w +
-            s['mother_score'] * m_w
-        )
-        
-        if s['is_similar']:
-            pos_scores.append(composite)
-        else:
-            neg_scores.append(composite)
-            
-    if not pos_scores or not neg_scores:
-        return 0.0
-        
-    avg_pos = sum(pos_scores) / len(pos_scores)
-    avg_neg = sum(neg_scores) / len(neg_scores)
+    综合分对权重是线性的，正负样本平均分之差等于
+    (正样本平均评分向量 - 负样本平均评分向量) · w
+    
+    Args:
+        X: (n, 3) 样本评分
+        y: (n,) 标签
+        W: (k, 3) 权重组合
     
-    # 分数差异作为准确率指标
-    return avg_pos - avg_neg
+    Returns:
+        (k,) 每个权重组合的准确率；缺少正样本或负样本时全为 0
+    """
+    if not y.any() or y.all():
+        return np.zeros(len(W))
+    delta = X[y].mean(axis=0) - X[~y].mean(axis=0)
+    return W @ delta
 
-def tune_weights() -> Dict[str, Any]:
+
+def weight_grid(step: float = 5) -> np.ndarray:
+    """
+    生成权重网格（时间、父柱按 step 百分比枚举，母柱取余数）
+    
+    Returns:
+        (k, 3) 权重数组（0-1 小数），按时间、父柱升序排列
+    """
+    t = np.arange(TIME_RANGE[0], TIME_RANGE[1] + step / 2, step)
+    f = np.arange(FATHER_RANGE[0], FATHER_RANGE[1] + step / 2, step)
+    tt, ff = np.meshgrid(t, f, indexing="ij")
+    mm = 100 - tt - ff
+    
+    # 确保母柱权重也在合理范围内 (例如 10-60)
+    keep = (mm >= MOTHER_RANGE[0] - 1e-9) & (mm <= MOTHER_RANGE[1] + 1e-9)
+    grid = np.stack([tt[keep], ff[keep], mm[keep]], axis=1)
+    return np.round(grid, 6) / 100.0
+
+
+def _score_shard(args: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> np.ndarray:
+    return score_weight_grid(*args)
+
+
+def _score_grid_parallel(X: np.ndarray, y: np.ndarray, W: np.ndarray, workers: int) -> np.ndarray:
+    """将权重网格切片后交给进程池评估"""
+    shards = np.array_split(W, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.concatenate(list(pool.map(_score_shard, [(X, y, shard) for shard in shards])))
+
+
+def _in_bounds(w: np.ndarray) -> bool:
+    t, f, m = w * 100
+    eps = 1e-9
+    return (
+        TIME_RANGE[0] - eps <= t <= TIME_RANGE[1] + eps and
+        FATHER_RANGE[0] - eps <= f <= FATHER_RANGE[1] + eps and
+        MOTHER_RANGE[0] - eps <= m <= MOTHER_RANGE[1] + eps
+    )
+
+
+def coordinate_search(
+    X: np.ndarray,
+    y: np.ndarray,
+    start: np.ndarray,
+    step: float = 0.05,
+    min_step: float = 0.0001
+) -> Tuple[np.ndarray, float]:
+    """
+    连续坐标搜索：在权重和为 1 的平面上沿三个方向移动，
+    找不到更优解时步长减半，直到 min_step
+    """
+    directions = np.array([
+        [1, -1, 0], [-1, 1, 0],
+        [1, 0, -1], [-1, 0, 1],
+        [0, 1, -1], [0, -1, 1],
+    ], dtype=np.float64)
+    
+    best = start.astype(np.float64)
+    best_score = float(score_weight_grid(X, y, best[None, :])[0])
+    while step >= min_step:
+        candidates = [c for c in best + directions * step if _in_bounds(c)]
+        if candidates:
+            C = np.array(candidates)
+            scores = score_weight_grid(X, y, C)
+            i = int(np.argmax(scores))
+            if scores[i] > best_score:
+                best, best_score = C[i], float(scores[i])
+                continue
+        step /= 2
+    return best, best_score
+
+
+def tune_weights(step: float = 5, refine: bool = False, workers: Optional[int] = None) -> Dict[str, Any]:
     """
     执行权重调优
+    
+    Args:
+        step: 网格步长（百分比，默认 5%，可设为 1 或更小）
+        refine: 网格最优点之后再做连续坐标搜索
+        workers: 进程池大小（权重网格很大时分片并行评估）
     """
     print("开始权重调优...")
-    samples = get_match_samples()
-    print(f"加载了 {len(samples)} 个样本")
-    
-    best_score = -float('inf')
-    best_weights = None
-    
-    # 暴力寻优 (20% - 60%, 步长 5%)
-    # 范围可以根据需要调整，这里遵循用户建议
-    for t in range(20, 65, 5):
-        for f in range(20, 65, 5):
-            m = 100 - t - f
-            
-            # 确保母柱权重也在合理范围内 (例如 10-60)
-            if m < 10 or m > 60:
-                continue
-                
-            t_w = t / 100.0
-            f_w = f / 100.0
-            m_w = m / 100.0
-            
-            accuracy = test_weights(t_w, f_w, m_w, samples)
-            
-            if accuracy > best_score:
-                best_score = accuracy
-                best_weights = (t_w, f_w, m_w)
-                
-    if best_weights:
-        result = {
-            "time_weight": best_weights[0],
-            "father_weight": best_weights[1],
-            "mother_weight": best_weights[2],
-            "accuracy_score": round(best_score, 2)
-        }
-        
-        # 保存到数据库
-        version_record = save_weight_version(result)
-        if version_record and version_record.get("id") is not None:
-            result["weight_version_id"] = version_record.get("id")
-        
-        return result
-    else:
+    X, y = load_sample_matrix()
+    print(f"加载了 {len(y)} 个样本")
+    
+    W = weight_grid(step)
+    if len(W) == 0:
         return None
+    
+    if workers and workers > 1:
+        scores = _score_grid_parallel(X, y, W, workers)
+    else:
+        scores = score_weight_grid(X, y, W)
+    
+    # 与逐个枚举一致：取第一个最优组合
+    best_idx = int(np.argmax(scores))
+    best_weights, best_score = W[best_idx], float(scores[best_idx])
+    algorithm = f"vectorized_grid_{step:g}pct"
+    
+    if refine:
+        best_weights, best_score = coordinate_search(X, y, best_weights, step=step / 100.0)
+        algorithm += "+coordinate_search"
+                
+    result = {
+        "time_weight": round(float(best_weights[0]), 4),
+        "father_weight": round(float(best_weights[1]), 4),
+        "mother_weight": round(float(best_weights[2]), 4),
+        "accuracy_score": round(best_score, 2)
+    }
+    
+    # 保存到数据库
+    version_record = save_weight_version(result, algorithm)
+    if version_record and version_record.get("id") is not None:
+        result["weight_version_id"] = version_record.get("id")
+    
+    return result
 
-def save_weight_version(result: Dict[str, Any]):
+def save_weight_version(result: Dict[str, Any], algorithm: str = "brute_force_v1"):
     """
     ??????????
     """
@@ -160,7 +281,7 @@ def save_weight_version(result: Dict[str, Any]):
             "father_weight": result["father_weight"],
             "mother_weight": result["mother_weight"],
             "accuracy_score": result["accuracy_score"],
-            "details": json.dumps({"algorithm": "brute_force_v1"})
+            "details": json.dumps({"algorithm": algorithm})
         }
 
         res = client.table("weight_versions").insert(data).execute()
@@ -0,0 +1,136 @@
+"""
+match_scores 写入基准测试
+对比逐行 save_match_score 与批量 save_match_scores / 后台写入队列
+
+使用 SQLite 模拟 PostgREST：每次 execute() 视为一次 HTTP 往返，
+附加 --rtt 毫秒的固定延迟。
+
+用法：
+    python scripts/bench_match_scores.py --rows 2000 --rtt 30
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from lynker_bazi_engine.db import match_scores_db
+
+
+class _SQLiteUpsert:
+    def __init__(self, client, rows):
+        self.client = client
+        self.rows = rows if isinstance(rows, list) else [rows]
+
+    def execute(self):
+        time.sleep(self.client.rtt)
+        with self.client.lock:
+            self.client.conn.executemany(
+                """
+                INSERT INTO match_scores
+                    (chart_id_a, chart_id_b, engine_type, score, matched_rules, verified_count, weight_version)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chart_id_a, chart_id_b, engine_type) DO UPDATE SET
+                    score = excluded.score,
+                    matched_rules = excluded.matched_rules,
+                    verified_count = excluded.verified_count,
+                    weight_version = excluded.weight_version
+                """,
+                [
+                    (r["chart_id_a"], r["chart_id_b"], r["engine_type"], r["score"],
+                     json.dumps(r["matched_rules"]), r["verified_count"], r["weight_version"])
+                    for r in self.rows
+                ]
+            )
+            self.client.conn.commit()
+            self.client.requests += 1
+        return type("Result", (), {"data": self.rows})()
+
+
+class _SQLiteTable:
+    def __init__(self, client):
+        self.client = client
+
+    def upsert(self, rows, on_conflict=None):
+        return _SQLiteUpsert(self.client, rows)
+
+
+class SQLiteStandIn:
+    """只实现 table("match_scores").upsert(...).execute() 的最小客户端"""
+
+    def __init__(self, rtt_ms: float):
+        self.rtt = rtt_ms / 1000.0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE match_scores (
+                chart_id_a INTEGER, chart_id_b INTEGER, engine_type TEXT,
+                score INTEGER, matched_rules TEXT, verified_count INTEGER, weight_version TEXT,
+                PRIMARY KEY (chart_id_a, chart_id_b, engine_type)
+            )
+            """
+        )
+
+    def table(self, name):
+        return _SQLiteTable(self)
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM match_scores").fetchone()[0]
+
+
+def make_rows(n):
+    return [
+        (1, i + 2, "time", {"score": i % 100, "matched_rules": ["same_year"], "verified_count": 0})
+        for i in range(n)
+    ]
+
+
+def bench(rows_n, rtt_ms, chunk_size):
+    rows = make_rows(rows_n)
+
+    # 1. 逐行 upsert（现有行为）
+    client = SQLiteStandIn(rtt_ms)
+    match_scores_db.get_supabase_client = lambda: client
+    t0 = time.perf_counter()
+    for a, b, engine, score in rows:
+        match_scores_db.save_match_score(a, b, engine, score)
+    per_row = time.perf_counter() - t0
+    print(f"逐行 upsert     : {per_row:8.3f}s  请求数={client.requests:5d}  行数={client.count()}")
+
+    # 2. 批量 upsert
+    client = SQLiteStandIn(rtt_ms)
+    t0 = time.perf_counter()
+    match_scores_db.save_match_scores(rows, chunk_size=chunk_size, client=client)
+    bulk = time.perf_counter() - t0
+    print(f"批量 upsert     : {bulk:8.3f}s  请求数={client.requests:5d}  行数={client.count()}")
+
+    # 3. 后台写入：请求路径只计入队时间
+    client = SQLiteStandIn(rtt_ms)
+    writer = match_scores_db.MatchScoreWriteBehind(chunk_size=chunk_size, client=client)
+    t0 = time.perf_counter()
+    writer.enqueue(rows)
+    enqueue = time.perf_counter() - t0
+    writer.close()
+    print(f"后台写入(入队)  : {enqueue:8.3f}s  请求数={client.requests:5d}  行数={client.count()}")
+
+    print(f"\n批量加速比: {per_row / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="match_scores 写入基准测试")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--rtt", type=float, default=30.0, help="模拟的单次请求往返毫秒数")
+    parser.add_argument("--chunk", type=int, default=match_scores_db.UPSERT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"match_scores 写入基准：{args.rows} 行，RTT={args.rtt}ms，chunk={args.chunk}")
+    print("=" * 60)
+    bench(args.rows, args.rtt, args.chunk)
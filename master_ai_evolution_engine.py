@@ -5,7 +5,8 @@ from datetime import datetime
 from typing import Optional
 from pathlib import Path
 from supabase import create_client, Client
-from master_vault_engine import insert_vault, get_db_connection
+from master_vault_engine import insert_vault_many
+from db_pool import db_connection
 
 _client: Optional[Client] = None
 
@@ -54,14 +55,12 @@ def analyze_patterns(records):
     return results
 
 def check_vault_exists(title: str) -> bool:
-    """检查 Vault 中是否已存在该标题（使用 master_vault_engine 的数据库连接）"""
+    """检查 Vault 中是否已存在该标题（使用共享连接池）"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM master_vault WHERE title = %s", (title,))
-        count = cursor.fetchone()[0]
-        cursor.close()
-        conn.close()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM master_vault WHERE title = %s", (title,))
+                count = cursor.fetchone()[0]
         return count > 0
     except Exception as e:
         print(f"⚠️ 检查去重时出错: {e}")
@@ -125,6 +124,7 @@ def store_to_vault(patterns):
     """
     stored = 0
     skipped = 0
+    entries = []
     
     for p in patterns:
         title = f"命盘规律发现：{p['pattern']}"
@@ -134,13 +134,16 @@ def store_to_vault(patterns):
             skipped += 1
             continue
         
+        content = f"发现次数: {p['count']}\n推测: {p['insight']}\n时间: {datetime.utcnow()}"
+        entries.append({"title": title, "content": content, "created_by": "Master AI"})
+    
+    if entries:
         try:
-            content = f"发现次数: {p['count']}\n推测: {p['insight']}\n时间: {datetime.utcnow()}"
-            insert_vault(title=title, content=content, created_by="Master AI")
-            print(f"✅ 已存入 Vault：{title}")
-            stored += 1
+            stored = len(insert_vault_many(entries))
+            for e in entries:
+                print(f"✅ 已存入 Vault：{e['title']}")
         except Exception as e:
-            print(f"❌ 存储失败 ({title}): {e}")
+            print(f"❌ 批量存储失败 ({len(entries)} 条): {e}")
     
     print(f"📊 存储统计：新增 {stored} 条，跳过 {skipped} 条重复")
 
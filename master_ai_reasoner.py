@@ -1,9 +1,12 @@
 import os
+import json
 from datetime import datetime
-from collections import Counter, defaultdict
 from typing import Optional
+import numpy as np
+import pandas as pd
 from supabase import create_client, Client
 from master_vault_engine import insert_vault
+from batch_writer import execute_values_rows
 
 _client: Optional[Client] = None
 
@@ -25,32 +28,80 @@ def check_permission(user_id: int):
     return {"status": "ok", "user_id": user_id}
 
 # -----------------------------
-# 基础数据抓取
+# 基础数据抓取（分页流式读取为 DataFrame）
 # -----------------------------
+PAGE_SIZE = 1000
+
+BIRTHCHART_COLUMNS = ["id", "name", "ziwei_palace", "main_star", "shen_palace", "birth_time"]
+MATCH_RESULT_COLUMNS = ["user_a_id", "user_b_id", "match_score", "matching_fields"]
+FEEDBACK_COLUMNS = ["user_id", "label", "score", "created_at"]
+
+def _fetch_frame(table, columns, order_by, page_size=PAGE_SIZE):
+    """
+    按 order_by 分页读取整表，逐页转为 DataFrame 后拼接
+    order_by 必须能唯一确定行序（以主键结尾），否则分页边界上的重复键可能被跳过或读两次
+    """
+    client = get_supabase_client()
+    frames = []
+    offset = 0
+    while True:
+        query = client.table(table).select(",".join(columns))
+        for column in order_by:
+            query = query.order(column)
+        page = query.range(offset, offset + page_size - 1).execute().data or []
+        if page:
+            frames.append(pd.DataFrame.from_records(page, columns=columns))
+        if len(page) < page_size:
+            break
+        offset += page_size
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
 def fetch_birthcharts():
     try:
-        client = get_supabase_client()
-        resp = client.table("birthcharts").select("id,name,ziwei_palace,main_star,shen_palace,birth_time").execute()
-        return resp.data or []
+        return _fetch_frame("birthcharts", BIRTHCHART_COLUMNS, ["id"])
     except Exception as e:
         print(f"⚠️ 读取 birthcharts 失败: {e}")
-        return []
+        return pd.DataFrame(columns=BIRTHCHART_COLUMNS)
 
 def fetch_match_results():
     try:
-        client = get_supabase_client()
-        resp = client.table("match_results").select("user_a_id,user_b_id,match_score,matching_fields").execute()
-        return resp.data or []
+        return _fetch_frame("match_results", MATCH_RESULT_COLUMNS, ["user_a_id", "user_b_id", "id"])
     except Exception:
-        return []
+        return pd.DataFrame(columns=MATCH_RESULT_COLUMNS)
 
 def fetch_feedback():
     try:
-        client = get_supabase_client()
-        resp = client.table("feedback").select("user_id,label,score,created_at").execute()
-        return resp.data or []
+        return _fetch_frame("feedback", FEEDBACK_COLUMNS, ["user_id", "created_at", "id"])
     except Exception:
-        return []
+        return pd.DataFrame(columns=FEEDBACK_COLUMNS)
+
+def _as_frame(rows, columns):
+    """兼容 list[dict] 与 DataFrame 输入；缺失列补为空"""
+    if rows is None:
+        return pd.DataFrame(columns=columns)
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame.from_records(list(rows))
+    for column in columns:
+        if column not in df.columns:
+            df[column] = "" if column == "name" else None
+    return df
+
+def _is_truthy(series):
+    """逐元素等价于 bool(x) 的向量化判断（None / NaN / 空串 / 0 为假）"""
+    return series.notna() & ~series.isin(["", 0])
+
+def _chart_pairs(charts):
+    """有命宫与主星的命盘，附带 pair 列（保持原顺序）"""
+    valid = charts[_is_truthy(charts["ziwei_palace"]) & _is_truthy(charts["main_star"])]
+    return valid.assign(pair=valid["ziwei_palace"].astype(str) + "-" + valid["main_star"].astype(str))
+
+def _group_sums(frame, key, column):
+    """按 key 分组，组内按原行顺序用内置 sum 累加（与逐行累加的浮点结果一致）"""
+    return {
+        k: sum(frame[column].to_numpy()[idx].tolist())
+        for k, idx in frame.groupby(key, sort=False).indices.items()
+    }
 
 # -----------------------------
 # 规则归纳（示例启发式）
@@ -58,63 +109,57 @@ def fetch_feedback():
 def derive_population_rules(charts, match_results=None, feedback=None):
     """
     综合分析：主星/命宫组合 + 匹配成功率 + 用户反馈
+    输入可为 list[dict] 或 DataFrame；计数与聚合均为列式 groupby
     输出：rules = { "巳-天府": {"count": 12, "traits": ["稳重","后劲强"], "confidence": 0.62, "match_success_rate": 0.75 } }
     """
-    match_results = match_results or []
-    feedback = feedback or []
-    
-    pair_counts = Counter()
-    star_counts = Counter()
-    palace_counts = Counter()
+    charts = _as_frame(charts, BIRTHCHART_COLUMNS)
+    match_results = _as_frame(match_results, MATCH_RESULT_COLUMNS)
+    feedback = _as_frame(feedback, FEEDBACK_COLUMNS)
     
-    user_id_to_pair = {}
-    for r in charts:
-        palace = r.get("ziwei_palace")
-        star = r.get("main_star")
-        
-        if not palace or not star:
-            continue
-            
-        pair = f"{palace}-{star}"
-        pair_counts[pair] += 1
-        star_counts[star] += 1
-        palace_counts[palace] += 1
-        user_id_to_pair[r["id"]] = pair
-
-    pair_match_success = defaultdict(lambda: {"total": 0, "success": 0})
-    for m in match_results:
-        user_a_id = m.get("user_a_id")
-        user_b_id = m.get("user_b_id")
-        score = m.get("match_score", 0)
-        
-        for user_id in [user_a_id, user_b_id]:
-            if user_id and user_id in user_id_to_pair:
-                pair = user_id_to_pair[user_id]
-                pair_match_success[pair]["total"] += 1
-                if score >= 0.7:
-                    pair_match_success[pair]["success"] += 1
-
-    pair_feedback_score = defaultdict(list)
-    for f in feedback:
-        user_id = f.get("user_id")
-        score = f.get("score")
-        
-        if user_id in user_id_to_pair and score is not None:
-            normalized_score = max(0, min(5, float(score)))
-            pair = user_id_to_pair[user_id]
-            pair_feedback_score[pair].append(normalized_score)
+    valid = _chart_pairs(charts)
+    # 按首次出现顺序计数（与 Counter 的插入顺序一致）
+    pair_counts = valid.groupby("pair", sort=False).size()
+    # 同一 id 多条命盘时以最后一条为准
+    user_id_to_pair = valid.drop_duplicates("id", keep="last").set_index("id")["pair"]
+
+    # 匹配记录：user_a / user_b 展开为一列后映射到 pair
+    pair_match_success = {}
+    if len(match_results):
+        scores = match_results["match_score"].fillna(0)
+        sides = pd.DataFrame({
+            "user_id": pd.concat([match_results["user_a_id"], match_results["user_b_id"]], ignore_index=True),
+            "success": pd.concat([scores >= 0.7, scores >= 0.7], ignore_index=True),
+        })
+        sides = sides[_is_truthy(sides["user_id"])]
+        sides = sides.assign(pair=sides["user_id"].map(user_id_to_pair)).dropna(subset=["pair"])
+        grouped = sides.groupby("pair", sort=False)["success"]
+        pair_match_success = {
+            pair: {"total": int(total), "success": int(success)}
+            for pair, total, success in zip(grouped.size().index, grouped.size().to_numpy(), grouped.sum().to_numpy())
+        }
+
+    # 用户反馈：分数截断到 [0, 5]
+    pair_feedback_score = {}
+    pair_feedback_count = {}
+    if len(feedback):
+        fb = feedback.assign(
+            pair=feedback["user_id"].map(user_id_to_pair),
+            score=pd.to_numeric(feedback["score"], errors="coerce").astype(float).clip(0, 5)
+        ).dropna(subset=["pair", "score"])
+        pair_feedback_score = _group_sums(fb, "pair", "score")
+        pair_feedback_count = {k: len(idx) for k, idx in fb.groupby("pair", sort=False).indices.items()}
 
     total = max(1, len(charts))
     rules = {}
-    for pair, c in pair_counts.items():
+    for pair, c in zip(pair_counts.index, pair_counts.to_numpy().tolist()):
         palace, star = pair.split("-")
         base_conf = c / total
         
         match_stats = pair_match_success.get(pair, {"total": 0, "success": 0})
         match_success_rate = (match_stats["success"] / max(1, match_stats["total"])) if match_stats["total"] > 0 else 0
         
-        feedback_scores = pair_feedback_score.get(pair, [])
-        avg_feedback = sum(feedback_scores) / len(feedback_scores) if feedback_scores else 0
+        feedback_count = pair_feedback_count.get(pair, 0)
+        avg_feedback = pair_feedback_score[pair] / feedback_count if feedback_count else 0
         
         trait_hint = []
         if star in ("天府","武曲","廉贞","破军","紫微","贪狼"):
@@ -147,56 +192,45 @@ def derive_population_rules(charts, match_results=None, feedback=None):
             "match_success_rate": round(match_success_rate, 3),
             "avg_feedback": round(avg_feedback, 2),
             "match_count": match_stats["total"],
-            "feedback_count": len(feedback_scores)
+            "feedback_count": feedback_count
         }
     return rules
 
 # -----------------------------
 # 基于规则对单用户推理
 # -----------------------------
-def predict_for_user(user, rules):
-    """
-    输入：单个用户命盘 + 群体规则（包含匹配/反馈数据）
-    输出：可解释预测 dict
-    """
-    palace = user.get("ziwei_palace")
-    star = user.get("main_star")
-    
-    if not palace or not star:
-        return None
-        
-    pair = f"{palace}-{star}"
-    rule = rules.get(pair, {
-        "count": 0, 
-        "base_confidence": 0.1,
-        "confidence": 0.1, 
-        "traits": [],
-        "match_success_rate": 0,
-        "avg_feedback": 0,
-        "match_count": 0,
-        "feedback_count": 0
-    })
-
-    time_window = "未来 6-12 个月"
-    conf = rule["confidence"]
+_DEFAULT_RULE = {
+    "count": 0,
+    "base_confidence": 0.1,
+    "confidence": 0.1,
+    "traits": [],
+    "match_success_rate": 0,
+    "avg_feedback": 0,
+    "match_count": 0,
+    "feedback_count": 0
+}
+
+SHEN_BONUS = 0.08
+SHEN_BONUS_CAP = 0.95
+TIME_WINDOW = "未来 6-12 个月"
+
+def _build_explanation(user_id, user_name, pair, rule, shen_bonus, confidence):
+    """单个用户的可解释预测（predict_for_user / predict_all 共用）"""
     signals = ["主星/命宫组合统计"]
-    
-    if user.get("shen_palace") == user.get("ziwei_palace"):
-        conf = min(0.95, conf + 0.08)
+    if shen_bonus:
         signals.append("身宫一致加成")
-    
     if rule.get("match_count", 0) > 0:
         signals.append(f"匹配数据 ({rule['match_count']} 条)")
     if rule.get("feedback_count", 0) > 0:
         signals.append(f"用户反馈 ({rule['feedback_count']} 条)")
 
-    explanation = {
-        "user_id": user["id"],
-        "user_name": user.get("name",""),
+    return {
+        "user_id": user_id,
+        "user_name": user_name,
         "pair": pair,
         "traits": rule["traits"],
-        "time_window": time_window,
-        "confidence": round(conf, 3),
+        "time_window": TIME_WINDOW,
+        "confidence": round(confidence, 3),
         "evidence": {
             "population_count": rule["count"],
             "population_ratio": rule.get("base_confidence", 0),
@@ -211,82 +245,98 @@ def predict_for_user(user, rules):
             "signals": signals
         }
     }
-    return explanation
+
+def predict_for_user(user, rules):
+    """
+    输入：单个用户命盘 + 群体规则（包含匹配/反馈数据）
+    输出：可解释预测 dict
+    """
+    palace = user.get("ziwei_palace")
+    star = user.get("main_star")
+    
+    if not palace or not star:
+        return None
+        
+    pair = f"{palace}-{star}"
+    rule = rules.get(pair, _DEFAULT_RULE)
+
+    conf = rule["confidence"]
+    shen_bonus = user.get("shen_palace") == user.get("ziwei_palace")
+    if shen_bonus:
+        conf = min(SHEN_BONUS_CAP, conf + SHEN_BONUS)
+
+    return _build_explanation(user["id"], user.get("name",""), pair, rule, shen_bonus, conf)
+
+def predict_all(charts, rules):
+    """
+    predict_for_user 的批量版本：规则查找与身宫加成按列计算
+    返回与逐个调用 predict_for_user（跳过 None）相同的列表
+    """
+    valid = _chart_pairs(_as_frame(charts, BIRTHCHART_COLUMNS))
+    if valid.empty:
+        return []
+
+    pairs = valid["pair"]
+    base_conf = pairs.map({pair: rule["confidence"] for pair, rule in rules.items()})
+    base_conf = base_conf.fillna(_DEFAULT_RULE["confidence"]).to_numpy(dtype=float)
+    shen_bonus = (valid["shen_palace"] == valid["ziwei_palace"]).to_numpy()
+    conf = np.where(shen_bonus, np.minimum(SHEN_BONUS_CAP, base_conf + SHEN_BONUS), base_conf)
+
+    names = valid["name"].astype(object).where(valid["name"].notna(), None)
+    rows = zip(valid["id"].tolist(), names.tolist(), pairs.tolist(), shen_bonus.tolist(), conf.tolist())
+    return [
+        _build_explanation(user_id, name, pair, rules.get(pair, _DEFAULT_RULE), bonus, confidence)
+        for user_id, name, pair, bonus, confidence in rows
+    ]
 
 # -----------------------------
 # 结果入库（predictions 表）
 # -----------------------------
+SQL_UPSERT_PREDICTIONS = """
+    INSERT INTO predictions (user_id, user_name, pair, traits, time_window, confidence, evidence, created_at)
+    VALUES %s
+    ON CONFLICT (user_id, pair) DO UPDATE SET
+        confidence = EXCLUDED.confidence,
+        evidence = EXCLUDED.evidence,
+        created_at = EXCLUDED.created_at
+"""
+
+def _prediction_values(record):
+    return (
+        record["user_id"],
+        record.get("user_name", ""),
+        record["pair"],
+        json.dumps(record["traits"], ensure_ascii=False),
+        record["time_window"],
+        record["confidence"],
+        json.dumps(record["evidence"], ensure_ascii=False)
+    )
+
 def save_prediction(record):
-    """使用直接 PostgreSQL 连接保存预测（绕过 Supabase PostgREST cache 问题）"""
-    try:
-        from master_vault_engine import get_db_connection
-        import json
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO predictions (user_id, user_name, pair, traits, time_window, confidence, evidence, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
-            ON CONFLICT (user_id, pair) DO UPDATE SET
-                confidence = EXCLUDED.confidence,
-                evidence = EXCLUDED.evidence,
-                created_at = EXCLUDED.created_at
-        """, (
-            record["user_id"],
-            record.get("user_name", ""),
-            record["pair"],
-            json.dumps(record["traits"], ensure_ascii=False),
-            record["time_window"],
-            record["confidence"],
-            json.dumps(record["evidence"], ensure_ascii=False)
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return {"status": "ok"}
-    except Exception as e:
-        print(f"⚠️ 保存预测失败: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+    """使用直接 PostgreSQL 连接（连接池）保存预测（绕过 Supabase PostgREST cache 问题）"""
+    return save_predictions_batch([record])
 
 def save_predictions_batch(records):
-    """批量保存预测（使用单个数据库连接）"""
+    """批量保存预测：单个连接，execute_values 多行 upsert"""
     if not records:
         return
     
     try:
-        from master_vault_engine import get_db_connection
-        import json
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        from db_pool import db_connection
         
-        for record in records:
-            cursor.execute("""
-                INSERT INTO predictions (user_id, user_name, pair, traits, time_window, confidence, evidence, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
-                ON CONFLICT (user_id, pair) DO UPDATE SET
-                    confidence = EXCLUDED.confidence,
-                    evidence = EXCLUDED.evidence,
-                    created_at = EXCLUDED.created_at
-            """, (
-                record["user_id"],
-                record.get("user_name", ""),
-                record["pair"],
-                json.dumps(record["traits"], ensure_ascii=False),
-                record["time_window"],
-                record["confidence"],
-                json.dumps(record["evidence"], ensure_ascii=False)
-            ))
+        # 同一条 INSERT 内重复的 (user_id, pair) 会触发 ON CONFLICT 二次更新错误，保留最后一条
+        merged = {(r["user_id"], r["pair"]): r for r in records}
         
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"✅ 成功保存 {len(records)} 条预测到 PostgreSQL")
-        return {"status": "ok", "count": len(records)}
+        with db_connection() as conn:
+            stats = execute_values_rows(
+                conn,
+                SQL_UPSERT_PREDICTIONS,
+                [_prediction_values(r) for r in merged.values()],
+                template="(%s, %s, %s, %s, %s, %s, %s, NOW())",
+                label="predictions"
+            )
+        print(f"✅ 成功保存 {stats['rows']} 条预测到 PostgreSQL")
+        return {"status": "ok", "count": stats["rows"], "rows_per_sec": stats["rows_per_sec"]}
     except Exception as e:
         print(f"⚠️ 批量保存预测失败: {e}")
         import traceback
@@ -322,27 +372,27 @@ def reason_user(user_id: int):
         return gate
 
     charts = fetch_birthcharts()
-    if not charts:
+    if charts.empty:
         return {"status": "error", "msg": "没有命盘数据"}
 
     match_results = fetch_match_results()
     feedback = fetch_feedback()
     
     rules = derive_population_rules(charts, match_results, feedback)
-    u = next((x for x in charts if x["id"] == user_id), None)
-    if not u:
+    user_rows = charts[charts["id"] == user_id]
+    if user_rows.empty:
         return {"status": "error", "msg": f"未找到用户 {user_id}"}
 
-    explanation = predict_for_user(u, rules)
+    explanation = predict_for_user(user_rows.iloc[0].to_dict(), rules)
     if explanation:
         save_prediction(explanation)
         persist_insight_to_vault([explanation])
         return {"status":"ok","prediction":explanation}
     return {"status": "error", "msg": "预测生成失败"}
 
-def reason_all(limit: int = 50):
+def reason_all(limit: Optional[int] = 50):
     charts = fetch_birthcharts()
-    if not charts:
+    if charts.empty:
         return {"status": "error", "msg": "没有命盘数据"}
     
     match_results = fetch_match_results()
@@ -352,14 +402,9 @@ def reason_all(limit: int = 50):
     
     rules = derive_population_rules(charts, match_results, feedback)
 
-    results = []
-    for u in charts[:limit]:
-        gate = check_permission(u["id"])
-        if gate.get("status") != "ok":
-            continue
-        e = predict_for_user(u, rules)
-        if e:
-            results.append(e)
+    targets = charts if limit is None else charts.head(limit)
+    allowed = [check_permission(user_id).get("status") == "ok" for user_id in targets["id"].tolist()]
+    results = predict_all(targets[allowed], rules)
 
     if results:
         print(f"💾 批量保存 {len(results)} 条预测...")
@@ -10,11 +10,96 @@ LynkerAI Master Vault Engine v2.0
 import os
 import base64
 import hashlib
+import threading
+import time
 import psycopg2
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.fernet import Fernet
 from datetime import datetime
+from batch_writer import execute_values_rows
+from db_pool import db_connection
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+ENCRYPT_WORKERS = int(os.getenv("VAULT_ENCRYPT_WORKERS", "4"))
+VAULT_PAGE_SIZE = 50
+VAULT_CACHE_SIZE = int(os.getenv("VAULT_CACHE_SIZE", "128"))
+VAULT_CACHE_TTL = float(os.getenv("VAULT_CACHE_TTL", "300"))
+
+# 列表按 (created_at, id) 键集分页，标题查询取同标题最新一条
+# 索引由迁移 sql/master_vault_indexes.sql 创建，运行时只检查是否存在
+VAULT_INDEXES = ("idx_master_vault_created_at_id", "idx_master_vault_title_created_at")
+
+_indexes_checked = False
+_indexes_lock = threading.Lock()
+
+def check_vault_indexes():
+    """首次访问时检查分页 / 标题查询所需索引是否存在，缺失时提示执行迁移（每个进程只检查一次）"""
+    global _indexes_checked
+    if _indexes_checked:
+        return
+    with _indexes_lock:
+        if _indexes_checked:
+            return
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT indexname FROM pg_indexes WHERE tablename = 'master_vault' AND indexname = ANY(%s)",
+                        (list(VAULT_INDEXES),)
+                    )
+                    existing = {row[0] for row in cursor.fetchall()}
+            missing = [name for name in VAULT_INDEXES if name not in existing]
+            if missing:
+                print(f"⚠️ master_vault 缺少索引 {', '.join(missing)}，请执行 sql/master_vault_indexes.sql")
+        except Exception as e:
+            print(f"⚠️ 检查 master_vault 索引失败（将继续运行）: {e}")
+        _indexes_checked = True
+
+class DecryptedCache:
+    """
+    解密结果的 LRU 缓存（按标题）
+    - 条目超过 ttl 秒即失效，兜底其他进程写入的同名条目
+    - 本进程写入同名条目时显式失效
+    """
+
+    def __init__(self, maxsize=VAULT_CACHE_SIZE, ttl=VAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, title):
+        with self._lock:
+            item = self._items.get(title)
+            if item is None:
+                return None
+            if time.time() - item[0] > self.ttl:
+                del self._items[title]
+                return None
+            self._items.move_to_end(title)
+            return item[1]
+
+    def put(self, title, value):
+        with self._lock:
+            self._items[title] = (time.time(), value)
+            self._items.move_to_end(title)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, titles=None):
+        with self._lock:
+            if titles is None:
+                self._items.clear()
+            else:
+                for title in titles:
+                    self._items.pop(title, None)
+
+_decrypted_cache = DecryptedCache()
+
+def invalidate_vault_cache(titles=None):
+    """清除解密缓存（titles 为空时全部清除）"""
+    _decrypted_cache.invalidate(titles)
 
 def get_cipher():
     """从环境变量读取 MASTER_VAULT_KEY 并生成 AES 密钥"""
@@ -37,79 +122,147 @@ def decrypt_vault_data(encrypted: str, role: str) -> str:
     return f.decrypt(encrypted.encode()).decode()
 
 def get_db_connection():
-    """获取 PostgreSQL 连接"""
+    """获取独立的 PostgreSQL 连接（不经连接池；常规读写请使用 db_connection()）"""
     return psycopg2.connect(DATABASE_URL)
 
 def insert_vault(title: str, content: str, created_by: str = "Master AI", access_level: str = "restricted"):
     """将加密后的知识写入 master_vault 表（使用直接 SQL）"""
     encrypted_content = encrypt_vault_data(content)
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO master_vault (title, encrypted_content, access_level, created_by, created_at)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+            """, (title, encrypted_content, access_level, created_by, datetime.utcnow()))
+            vault_id = cursor.fetchone()[0]
+        conn.commit()
+    _decrypted_cache.invalidate([title])
+    print(f"✅ 已写入 Vault：{title} ({created_by}) [ID: {vault_id}]")
+    return vault_id
+
+def insert_vault_many(entries, workers: int = ENCRYPT_WORKERS):
+    """
+    批量写入 Vault：线程池并行加密，一条多行 INSERT 写入
     
-    try:
-        cursor.execute("""
+    Args:
+        entries: [{"title", "content", "created_by"?, "access_level"?}, ...]
+        workers: 加密线程数
+    
+    Returns:
+        新条目 id 列表（与 entries 顺序一致）
+    """
+    if not entries:
+        return []
+    
+    f = get_cipher()
+    contents = [e["content"] for e in entries]
+    if workers > 1 and len(contents) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            encrypted = list(pool.map(lambda c: f.encrypt(c.encode()).decode(), contents))
+    else:
+        encrypted = [f.encrypt(c.encode()).decode() for c in contents]
+    
+    now = datetime.utcnow()
+    rows = [
+        (e["title"], enc, e.get("access_level", "restricted"), e.get("created_by", "Master AI"), now)
+        for e, enc in zip(entries, encrypted)
+    ]
+    with db_connection() as conn:
+        stats = execute_values_rows(
+            conn,
+            """
             INSERT INTO master_vault (title, encrypted_content, access_level, created_by, created_at)
-            VALUES (%s, %s, %s, %s, %s)
+            VALUES %s
             RETURNING id
-        """, (title, encrypted_content, access_level, created_by, datetime.utcnow()))
-        
-        vault_id = cursor.fetchone()[0]
-        conn.commit()
-        print(f"✅ 已写入 Vault：{title} ({created_by}) [ID: {vault_id}]")
-        return vault_id
-    finally:
-        cursor.close()
-        conn.close()
+            """,
+            rows,
+            page_size=max(len(rows), 1),
+            label="master_vault",
+            fetch=True
+        )
+    vault_ids = [r[0] for r in stats["returned"]]
+    _decrypted_cache.invalidate([e["title"] for e in entries])
+    print(f"✅ 已批量写入 Vault：{len(vault_ids)} 条")
+    return vault_ids
 
 def read_vault(title: str, role: str):
-    """根据标题读取并尝试解密 Vault 内容（使用直接 SQL）"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """根据标题读取并尝试解密 Vault 内容（标题索引查询，解密结果带缓存）"""
+    if role != "Superintendent Admin":
+        print("🚫 您没有权限查看此内容。")
+        return None
     
-    try:
-        cursor.execute("""
-            SELECT id, title, encrypted_content, access_level, created_by, created_at
-            FROM master_vault
-            WHERE title = %s
-            ORDER BY created_at DESC
-            LIMIT 1
-        """, (title,))
-        
-        record = cursor.fetchone()
-        if not record:
-            print("⚠️ 未找到指定标题内容。")
-            return None
-        
-        vault_id, title, encrypted_content, access_level, created_by, created_at = record
-        
-        if role == "Superintendent Admin":
-            decrypted = decrypt_vault_data(encrypted_content, role)
-            print(f"🔓 解密成功：{title}")
-            print(f"📝 内容：\n{decrypted}")
-            print(f"📊 创建者：{created_by} | 时间：{created_at}")
-            return decrypted
-        else:
-            print("🚫 您没有权限查看此内容。")
-            return None
-    finally:
-        cursor.close()
-        conn.close()
-
-def list_vault_entries(role: str = None):
-    """列出所有 Vault 条目（仅显示标题和元数据）"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cached = _decrypted_cache.get(title)
+    if cached is not None:
+        decrypted, created_by, created_at = cached
+        print(f"🔓 解密成功（缓存）：{title}")
+        print(f"📝 内容：\n{decrypted}")
+        print(f"📊 创建者：{created_by} | 时间：{created_at}")
+        return decrypted
     
-    try:
-        cursor.execute("""
-            SELECT id, title, access_level, created_by, created_at
-            FROM master_vault
-            ORDER BY created_at DESC
-        """)
-        
-        entries = cursor.fetchall()
-        print(f"\n📚 Master Vault 知识库 ({len(entries)} 条记录)")
+    check_vault_indexes()
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, title, encrypted_content, access_level, created_by, created_at
+                FROM master_vault
+                WHERE title = %s
+                ORDER BY created_at DESC
+                LIMIT 1
+            """, (title,))
+            record = cursor.fetchone()
+    
+    if not record:
+        print("⚠️ 未找到指定标题内容。")
+        return None
+    
+    vault_id, title, encrypted_content, access_level, created_by, created_at = record
+    
+    decrypted = decrypt_vault_data(encrypted_content, role)
+    _decrypted_cache.put(title, (decrypted, created_by, created_at))
+    print(f"🔓 解密成功：{title}")
+    print(f"📝 内容：\n{decrypted}")
+    print(f"📊 创建者：{created_by} | 时间：{created_at}")
+    return decrypted
+
+def vault_cursor(entry):
+    """由列表中的一条记录生成下一页游标 (created_at, id)"""
+    return (entry[4], entry[0])
+
+def list_vault_entries(role: str = None, limit: int = VAULT_PAGE_SIZE, cursor=None, verbose: bool = True):
+    """
+    分页列出 Vault 条目（仅显示标题和元数据），按创建时间倒序
+    
+    Args:
+        limit: 每页条数
+        cursor: 上一页最后一条的 vault_cursor()，None 表示第一页
+    
+    Returns:
+        [(id, title, access_level, created_by, created_at), ...]
+    """
+    check_vault_indexes()
+    with db_connection() as conn:
+        with conn.cursor() as db_cursor:
+            if cursor is None:
+                db_cursor.execute("""
+                    SELECT id, title, access_level, created_by, created_at
+                    FROM master_vault
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (limit,))
+            else:
+                db_cursor.execute("""
+                    SELECT id, title, access_level, created_by, created_at
+                    FROM master_vault
+                    WHERE (created_at, id) < (%s, %s)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (cursor[0], cursor[1], limit))
+            entries = db_cursor.fetchall()
+    
+    if verbose:
+        print(f"\n📚 Master Vault 知识库 (本页 {len(entries)} 条记录)")
         print("=" * 70)
         
         for entry in entries:
@@ -118,11 +271,18 @@ def list_vault_entries(role: str = None):
             print(f"{lock} [{created_at}] {title}")
             print(f"   创建者: {created_by} | 权限: {access_level}")
             print("-" * 70)
-        
-        return entries
-    finally:
-        cursor.close()
-        conn.close()
+    
+    return entries
+
+def iter_vault_entries(page_size: int = VAULT_PAGE_SIZE):
+    """按页遍历全部 Vault 条目（每次只持有一页）"""
+    cursor = None
+    while True:
+        entries = list_vault_entries(limit=page_size, cursor=cursor, verbose=False)
+        yield from entries
+        if len(entries) < page_size:
+            return
+        cursor = vault_cursor(entries[-1])
 
 if __name__ == "__main__":
     print("=" * 70)
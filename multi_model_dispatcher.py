@@ -1,57 +1,167 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 from supabase import create_client
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
 
-def load_ai_rules():
-    """从 ai_rules 表中读取模型配置"""
+DEFAULT_RULES = {
+    "MODEL_FREE": "gpt-4o-mini",
+    "MODEL_PRO": "gpt-4-turbo",
+    "MODEL_MASTER": "gpt-4-turbo",
+    "TRAINING_INTERVAL_DAYS": 7
+}
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# ai_rules 缓存：TTL 到期后整表重读（表只有几行；updated_at 不保证随 rule_value 更新，也不是所有部署都有该列）
+RULES_TTL = float(os.getenv("AI_RULES_CACHE_TTL", "60"))
+# 用户角色 / provider 缓存
+USER_CACHE_SIZE = int(os.getenv("USER_ROUTING_CACHE_SIZE", "2048"))
+USER_CACHE_TTL = float(os.getenv("USER_ROUTING_CACHE_TTL", "300"))
+RESOLVE_CHUNK_SIZE = 500
+
+_rules_lock = threading.Lock()
+_rules_cache = {"rules": None, "checked_at": 0.0}
+
+def _fetch_ai_rules():
+    """整表读取 ai_rules"""
+    resp = client.table("ai_rules").select("rule_name, rule_value").execute()
+    if not resp.data:
+        return dict(DEFAULT_RULES)
+    
+    data = {}
+    for r in resp.data:
+        if isinstance(r, dict):
+            rule_name = r.get("rule_name")
+            rule_value = r.get("rule_value")
+            if rule_name and rule_value:
+                data[rule_name] = rule_value
+    
+    rules = {
+        "MODEL_FREE": data.get("MODEL_FREE", "gpt-4o-mini"),
+        "MODEL_PRO": data.get("MODEL_PRO", "gpt-4-turbo"),
+        "MODEL_MASTER": data.get("MODEL_MASTER", "gpt-4-turbo"),
+        "TRAINING_INTERVAL_DAYS": int(data.get("TRAINING_INTERVAL_DAYS", "7"))
+    }
+    return rules
+
+def load_ai_rules(force_refresh: bool = False):
+    """从 ai_rules 表中读取模型配置（带 TTL 缓存）"""
     if not client:
         print("⚠️ Supabase 客户端未初始化，使用默认配置")
-        return {
-            "MODEL_FREE": "gpt-4o-mini",
-            "MODEL_PRO": "gpt-4-turbo",
-            "MODEL_MASTER": "gpt-4-turbo",
-            "TRAINING_INTERVAL_DAYS": 7
-        }
+        return dict(DEFAULT_RULES)
     
-    try:
-        resp = client.table("ai_rules").select("*").execute()
-        if not resp.data:
-            return {
-                "MODEL_FREE": "gpt-4o-mini",
-                "MODEL_PRO": "gpt-4-turbo",
-                "MODEL_MASTER": "gpt-4-turbo",
-                "TRAINING_INTERVAL_DAYS": 7
-            }
-        
-        data = {}
-        for r in resp.data:
+    now = time.time()
+    cached = _rules_cache["rules"]
+    if cached is not None and not force_refresh and now - _rules_cache["checked_at"] < RULES_TTL:
+        return dict(cached)
+    
+    with _rules_lock:
+        cached = _rules_cache["rules"]
+        if cached is not None and not force_refresh and time.time() - _rules_cache["checked_at"] < RULES_TTL:
+            return dict(cached)
+        try:
+            rules = _fetch_ai_rules()
+            _rules_cache.update(rules=rules, checked_at=time.time())
+            return dict(rules)
+        except Exception as e:
+            print(f"⚠️ 无法加载 AI 规则: {e}")
+            if cached is None:
+                return dict(DEFAULT_RULES)
+            # 有旧缓存时继续使用到下一个 TTL，避免一次失败让所有请求退回默认模型或逐次重试
+            _rules_cache["checked_at"] = time.time()
+            return dict(cached)
+
+def invalidate_ai_rules():
+    """ai_rules 被修改后调用，下次读取时整表重读（未调用时最多 RULES_TTL 秒后生效）"""
+    with _rules_lock:
+        _rules_cache.update(rules=None, checked_at=0.0)
+
+def _user_key(user_id):
+    """缓存与查询结果统一按字符串 id 存取（请求 / JSON 传入的 "42" 与数据库的 42 视为同一用户）"""
+    return str(user_id)
+
+class _UserRoutingCache:
+    """user_id → {"role", "ai_provider"} 的 LRU 缓存（带 TTL，键见 _user_key）"""
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, user_id):
+        user_id = _user_key(user_id)
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            if time.time() - item[0] > self.ttl:
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return item[1]
+
+    def put(self, user_id, routing):
+        user_id = _user_key(user_id)
+        with self._lock:
+            self._items[user_id] = (time.time(), routing)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(_user_key(user_id), None)
+
+_user_cache = _UserRoutingCache()
+
+def invalidate_user_routing(user_id=None):
+    """
+    用户角色或套餐（ai_provider）变更后调用；user_id 为空时清空全部
+    本仓库内没有修改 users.role / ai_provider 的代码路径，未调用时由 USER_CACHE_TTL 限定过期时间
+    """
+    _user_cache.invalidate(user_id)
+
+def _fetch_user_routing(user_ids):
+    """批量读取用户的 role / ai_provider，返回 {_user_key(user_id): routing}，并写入缓存"""
+    found = {}
+    ids = list(dict.fromkeys(_user_key(uid) for uid in user_ids))
+    for start in range(0, len(ids), RESOLVE_CHUNK_SIZE):
+        chunk = ids[start:start + RESOLVE_CHUNK_SIZE]
+        query = client.table("users").select("id, role, ai_provider")
+        resp = query.eq("id", chunk[0]).execute() if len(chunk) == 1 else query.in_("id", chunk).execute()
+        for r in resp.data or []:
             if isinstance(r, dict):
-                rule_name = r.get("rule_name")
-                rule_value = r.get("rule_value")
-                if rule_name and rule_value:
-                    data[rule_name] = rule_value
-        
-        return {
-            "MODEL_FREE": data.get("MODEL_FREE", "gpt-4o-mini"),
-            "MODEL_PRO": data.get("MODEL_PRO", "gpt-4-turbo"),
-            "MODEL_MASTER": data.get("MODEL_MASTER", "gpt-4-turbo"),
-            "TRAINING_INTERVAL_DAYS": int(data.get("TRAINING_INTERVAL_DAYS", "7"))
-        }
-    except Exception as e:
-        print(f"⚠️ 无法加载 AI 规则: {e}")
-        return {
-            "MODEL_FREE": "gpt-4o-mini",
-            "MODEL_PRO": "gpt-4-turbo",
-            "MODEL_MASTER": "gpt-4-turbo",
-            "TRAINING_INTERVAL_DAYS": 7
-        }
+                routing = {"role": r.get("role", "user"), "ai_provider": r.get("ai_provider", "free")}
+                _user_cache.put(r.get("id"), routing)
+                found[_user_key(r.get("id"))] = routing
+    return found
+
+def _get_user_routing(user_id):
+    """单个用户的 role / ai_provider（先查缓存；不存在返回 None，且不缓存未命中）"""
+    routing = _user_cache.get(user_id)
+    if routing is None:
+        routing = _fetch_user_routing([user_id]).get(_user_key(user_id))
+    return routing
+
+def _select_model(routing, rules):
+    """按角色 / provider 选择模型，返回 (模型, 身份标签)"""
+    if routing.get("role") == "Superintendent Admin":
+        return rules["MODEL_MASTER"], "Superintendent Admin"
+    if routing.get("ai_provider") == "pro":
+        return rules["MODEL_PRO"], "Pro"
+    return rules["MODEL_FREE"], "Free"
 
 def get_model_for_user(user_id: int):
     """
-    根据用户身份选择 AI 模型
+    根据用户身份选择 AI 模型（用户与规则均走缓存）
     
     参数:
         user_id: 用户 ID
@@ -66,43 +176,59 @@ def get_model_for_user(user_id: int):
     """
     if not client:
         print("⚠️ Supabase 客户端未初始化，使用默认模型")
-        return "gpt-4o-mini"
+        return DEFAULT_MODEL
     
     try:
-        user = client.table("users").select("role, ai_provider").eq("id", user_id).execute()
-        if not user.data or len(user.data) == 0:
+        routing = _get_user_routing(user_id)
+        if routing is None:
             print(f"⚠️ 未找到用户 ID {user_id}，使用默认模型")
-            return "gpt-4o-mini"
-        
-        user_record = user.data[0]
-        if not isinstance(user_record, dict):
-            return "gpt-4o-mini"
+            return DEFAULT_MODEL
         
-        role = user_record.get("role", "user")
-        provider = user_record.get("ai_provider", "free")
-
-        rules = load_ai_rules()
-
-        if role == "Superintendent Admin":
-            model = rules["MODEL_MASTER"]
-            print(f"👑 用户 {user_id} (Superintendent Admin) → 使用 {model}")
-            return model
-        elif provider == "pro":
-            model = rules["MODEL_PRO"]
-            print(f"💎 用户 {user_id} (Pro) → 使用 {model}")
-            return model
-        else:
-            model = rules["MODEL_FREE"]
-            print(f"🆓 用户 {user_id} (Free) → 使用 {model}")
-            return model
+        model, label = _select_model(routing, load_ai_rules())
+        icon = {"Superintendent Admin": "👑", "Pro": "💎"}.get(label, "🆓")
+        print(f"{icon} 用户 {user_id} ({label}) → 使用 {model}")
+        return model
             
     except Exception as e:
         print(f"⚠️ 获取模型失败: {e}")
-        return "gpt-4o-mini"
+        return DEFAULT_MODEL
+
+def resolve_models(user_ids):
+    """
+    批量为一组用户选择模型（供调度任务使用）
+    缓存未命中的用户合并为 in_ 查询，规则只读取一次
+    
+    返回:
+        {user_id: 模型名称}；找不到的用户为默认模型
+    """
+    user_ids = list(user_ids)
+    if not client:
+        return {uid: DEFAULT_MODEL for uid in user_ids}
+    
+    routings = {}
+    misses = []
+    for uid in user_ids:
+        routing = _user_cache.get(uid)
+        if routing is None:
+            misses.append(uid)
+        else:
+            routings[_user_key(uid)] = routing
+    
+    if misses:
+        try:
+            routings.update(_fetch_user_routing(misses))
+        except Exception as e:
+            print(f"⚠️ 批量读取用户失败: {e}")
+    
+    rules = load_ai_rules()
+    return {
+        uid: _select_model(routings[_user_key(uid)], rules)[0] if _user_key(uid) in routings else DEFAULT_MODEL
+        for uid in user_ids
+    }
 
 def get_api_key_for_user(user_id: int):
     """
-    根据用户身份选择 API Key
+    根据用户身份选择 API Key（与模型选择共用用户缓存）
     
     参数:
         user_id: 用户 ID
@@ -118,17 +244,11 @@ def get_api_key_for_user(user_id: int):
         return os.getenv("OPENAI_API_KEY")
     
     try:
-        user = client.table("users").select("role").eq("id", user_id).execute()
-        if not user.data or len(user.data) == 0:
+        routing = _get_user_routing(user_id)
+        if routing is None:
             return os.getenv("OPENAI_API_KEY")
         
-        user_record = user.data[0]
-        if not isinstance(user_record, dict):
-            return os.getenv("OPENAI_API_KEY")
-        
-        role = user_record.get("role", "user")
-        
-        if role == "Superintendent Admin":
+        if routing.get("role") == "Superintendent Admin":
             master_key = os.getenv("LYNKER_MASTER_KEY")
             if master_key:
                 print(f"🔑 使用 Lynker Master Key (用户 {user_id})")
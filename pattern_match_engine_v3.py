@@ -1,10 +1,14 @@
 import os
 import json
-import math
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import numpy as np
 from supabase import create_client, Client
 import openai
 from ai_guard_middleware import check_permission
+from batch_writer import write_rows
 
 # ====== 从环境变量读取主密钥 ======
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -22,6 +26,13 @@ WEIGHTS = {
     "semantic_similarity": 0.1
 }
 
+# ====== 语义向量缓存 ======
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBED_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "summary_embeddings.npz")
+EMBED_BATCH_SIZE = 100      # 单次 embeddings 请求的最大条数
+TOP_N = 10
+COMMENT_WORKERS = 5         # 并发生成 AI 评论的线程数
+
 # ====== 获取用户专属 AI Key ======
 def get_user_ai_key(user_id):
     try:
@@ -58,21 +69,138 @@ def basic_match_score(a, b):
 
     return score, matched_fields
 
+# ====== 语义向量缓存 ======
+class SummaryEmbeddingCache:
+    """
+    life_summary 向量的持久化缓存
+    - 以 summary 内容哈希为键，同一段文本全局只请求一次 embeddings
+    - 向量已归一化（点积即余弦相似度）
+    - 未命中的文本合并为批量请求
+    """
+
+    def __init__(self, path=EMBED_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.hashes = []
+        self.matrix = None
+        self._index = {}
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            cached = np.load(self.path, allow_pickle=False)
+            if str(cached["model"]) != EMBEDDING_MODEL:
+                return
+            self.hashes = [str(h) for h in cached["hashes"]]
+            self.matrix = cached["matrix"].astype(np.float32, copy=False)
+            self._index = {h: i for i, h in enumerate(self.hashes)}
+        except Exception as e:
+            print(f"⚠️ 语义向量缓存读取失败，将重新请求：{e}")
+            self.hashes, self.matrix, self._index = [], None, {}
+
+    def save(self):
+        if not self.path or self.matrix is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            model=np.array(EMBEDDING_MODEL),
+            hashes=np.array(self.hashes, dtype=str),
+            matrix=self.matrix
+        )
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def content_hash(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _fetch(self, texts, openai_key, batch_size):
+        """批量请求 embeddings，返回归一化矩阵；失败的批次返回 None"""
+        openai.api_key = openai_key
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            try:
+                resp = openai.embeddings.create(model=EMBEDDING_MODEL, input=batch)
+                vectors.extend(item.embedding for item in sorted(resp.data, key=lambda d: d.index))
+            except Exception as e:
+                print(f"❌ 语义向量批量请求失败: {e}")
+                vectors.extend([None] * len(batch))
+        return vectors
+
+    def embed(self, texts, openai_key, batch_size=EMBED_BATCH_SIZE):
+        """
+        返回与 texts 一一对应的归一化向量矩阵
+        请求失败的文本为零向量（相似度记 0，与逐对计算失败时一致），且不写入缓存
+        """
+        hashes = [self.content_hash(t) for t in texts]
+        misses = list(dict.fromkeys(
+            (h, t) for h, t in zip(hashes, texts) if h not in self._index
+        ))
+        if misses:
+            print(f"🧮 批量请求 {len(misses)} 条 life_summary 的语义向量 ...")
+            fetched = self._fetch([t for _, t in misses], openai_key, batch_size)
+            new_hashes, new_rows = [], []
+            for (h, _), vec in zip(misses, fetched):
+                if vec is None:
+                    continue
+                vec = np.asarray(vec, dtype=np.float32)
+                norm = np.linalg.norm(vec)
+                new_hashes.append(h)
+                new_rows.append(vec / norm if norm else vec)
+            if new_rows:
+                with self._lock:
+                    block = np.vstack(new_rows)
+                    if self.matrix is not None and self.matrix.shape[1] != block.shape[1]:
+                        self.hashes, self.matrix, self._index = [], None, {}
+                    start = len(self.hashes)
+                    self.hashes.extend(new_hashes)
+                    self.matrix = block if self.matrix is None else np.vstack([self.matrix, block])
+                    self._index.update({h: start + i for i, h in enumerate(new_hashes)})
+                    self.save()
+
+        if self.matrix is None:
+            return np.zeros((len(texts), 1), dtype=np.float32)
+        result = np.zeros((len(texts), self.matrix.shape[1]), dtype=np.float32)
+        for i, h in enumerate(hashes):
+            j = self._index.get(h)
+            if j is not None:
+                result[i] = self.matrix[j]
+        return result
+
+
+_embedding_cache = None
+
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = SummaryEmbeddingCache()
+    return _embedding_cache
+
 # ====== 语义相似度计算 ======
 def semantic_similarity(a_summary, b_summary, openai_key):
     try:
-        openai.api_key = openai_key
-        emb_a = openai.embeddings.create(model="text-embedding-3-small", input=a_summary)["data"][0]["embedding"]
-        emb_b = openai.embeddings.create(model="text-embedding-3-small", input=b_summary)["data"][0]["embedding"]
-
-        dot = sum(x * y for x, y in zip(emb_a, emb_b))
-        norm_a = math.sqrt(sum(x ** 2 for x in emb_a))
-        norm_b = math.sqrt(sum(x ** 2 for x in emb_b))
-        return (dot / (norm_a * norm_b)) * 100
+        emb_a, emb_b = get_embedding_cache().embed([a_summary, b_summary], openai_key)
+        return float(emb_a @ emb_b) * 100
     except Exception as e:
         print(f"❌ 语义相似度计算失败: {e}")
         return 0
 
+def batch_semantic_similarity(user_summary, summaries, openai_key):
+    """
+    一个 summary 对一组 summary 的语义相似度（0-100）
+    只对缓存未命中的文本发起批量请求，余弦相似度为一次矩阵乘法
+    """
+    try:
+        matrix = get_embedding_cache().embed([user_summary] + list(summaries), openai_key)
+        return (matrix[1:] @ matrix[0]) * 100
+    except Exception as e:
+        print(f"❌ 语义相似度计算失败: {e}")
+        return np.zeros(len(summaries), dtype=np.float32)
+
 # ====== AI 命理评论 ======
 def generate_ai_comment(user_name, target_name, matched_fields, openai_key):
     openai.api_key = openai_key
@@ -117,15 +245,18 @@ def ensure_recommendations_table():
 
 # ====== 写入推荐榜 ======
 def insert_recommendations(user_id, recs):
-    for rec in recs:
-        supabase.table("recommendations").insert({
+    created_at = datetime.utcnow().isoformat()
+    return write_rows(supabase, "recommendations", [
+        {
             "user_id": user_id,
             "target_id": rec["target_id"],
             "match_score": rec["match_score"],
             "matching_fields": rec["matching_fields"],
             "ai_comment": rec["ai_comment"],
-            "created_at": datetime.utcnow().isoformat()
-        }).execute()
+            "created_at": created_at
+        }
+        for rec in recs
+    ])
 
 # ====== 主执行函数 ======
 def find_top_matches(user_id):
@@ -144,27 +275,41 @@ def find_top_matches(user_id):
     ensure_recommendations_table()
     recommendations = []
 
-    for target in charts:
-        if target["id"] == user_id:
-            continue
+    targets = [t for t in charts if t["id"] != user_id]
 
-        score, matched = basic_match_score(user, target)
+    # 语义相似度：一次批量计算全部目标
+    semantic_scores = {}
+    if user.get("life_summary"):
+        with_summary = [t for t in targets if t.get("life_summary")]
+        if with_summary:
+            sims = batch_semantic_similarity(
+                user["life_summary"], [t["life_summary"] for t in with_summary], user_ai_key
+            )
+            semantic_scores = {t["id"]: float(sim) for t, sim in zip(with_summary, sims)}
 
-        if user.get("life_summary") and target.get("life_summary"):
-            semantic_score = semantic_similarity(user["life_summary"], target["life_summary"], user_ai_key)
-            score += WEIGHTS["semantic_similarity"] * semantic_score
+    for target in targets:
+        score, matched = basic_match_score(user, target)
 
-        ai_comment = generate_ai_comment(user["name"], target["name"], matched, user_ai_key)
+        if target["id"] in semantic_scores:
+            score += WEIGHTS["semantic_similarity"] * semantic_scores[target["id"]]
 
         recommendations.append({
             "target_id": target["id"],
             "target_name": target["name"],
             "match_score": round(score, 2),
-            "matching_fields": matched,
-            "ai_comment": ai_comment
+            "matching_fields": matched
         })
 
-    recommendations = sorted(recommendations, key=lambda x: x["match_score"], reverse=True)[:10]
+    # 先排序截取前 N，再只为入榜者并发生成 AI 评论
+    recommendations = sorted(recommendations, key=lambda x: x["match_score"], reverse=True)[:TOP_N]
+    with ThreadPoolExecutor(max_workers=COMMENT_WORKERS) as pool:
+        comments = pool.map(
+            lambda rec: generate_ai_comment(user["name"], rec["target_name"], rec["matching_fields"], user_ai_key),
+            recommendations
+        )
+        for rec, comment in zip(recommendations, comments):
+            rec["ai_comment"] = comment
+
     insert_recommendations(user_id, recommendations)
 
     return {
@@ -2,12 +2,21 @@
 # LynkerAI Soulmate Matcher - 同命匹配系统
 # ==========================================================
 
+import hashlib
+import os
 from datetime import datetime
 from functools import lru_cache
+import numpy as np
 from sentence_transformers import SentenceTransformer, util
 from supabase_init import init_supabase
+from batch_writer import write_rows
 import torch
 
+# 持久化向量缓存：user_id + 内容哈希 → float32 向量
+EMBED_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "soulmate_embeddings.npz")
+EMBED_BATCH_SIZE = 64
+META_FIELDS = ["id", "user_id", "created_at", "updated_at"]
+
 # ==================================================
 # 模型缓存机制（方案 A）
 # ==================================================
@@ -42,11 +51,14 @@ def init_match_table(supabase):
 # ----------------------------------------------------------
 # 相似度计算
 # ----------------------------------------------------------
+def tags_to_text(tags):
+    """将所有标签值拼接为文本"""
+    return " ".join([str(v) for v in tags.values() if v])
+
 def compute_similarity(tags1, tags2):
     """计算两位用户的 life_tags 相似度"""
-    # 将所有标签值转换为文本
-    t1 = " ".join([str(v) for v in tags1.values() if v])
-    t2 = " ".join([str(v) for v in tags2.values() if v])
+    t1 = tags_to_text(tags1)
+    t2 = tags_to_text(tags2)
     
     if not t1 or not t2:
         return 0.0
@@ -57,16 +69,133 @@ def compute_similarity(tags1, tags2):
     sim = util.cos_sim(emb1, emb2).item()
     return round(sim, 3)
 
+def shared_tags(current, other):
+    """找出两位用户的共同标签"""
+    return {
+        k: v for k, v in current.items()
+        if k in other and k not in META_FIELDS
+        and current[k] == other[k] and v
+    }
+
+# ----------------------------------------------------------
+# 批量向量缓存
+# ----------------------------------------------------------
+class EmbeddingStore:
+    """
+    持久化的 life_tags 向量矩阵
+    - 每行一个用户，float32，已归一化（点积即余弦相似度）
+    - 以 user_id + 内容哈希判断是否需要重新编码，只编码有变化的用户
+    """
+
+    def __init__(self, path=EMBED_CACHE_PATH):
+        self.path = path
+        self.user_ids = []
+        self.hashes = []
+        self.matrix = None
+        self._index = {}
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            cached = np.load(self.path, allow_pickle=False)
+            self.user_ids = [str(u) for u in cached["user_ids"]]
+            self.hashes = [str(h) for h in cached["hashes"]]
+            self.matrix = cached["matrix"].astype(np.float32, copy=False)
+            self._index = {uid: i for i, uid in enumerate(self.user_ids)}
+        except Exception as e:
+            print(f"⚠️ 向量缓存读取失败，将重新编码：{e}")
+            self.user_ids, self.hashes, self.matrix, self._index = [], [], None, {}
+
+    def save(self):
+        if not self.path or self.matrix is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            user_ids=np.array(self.user_ids, dtype=str),
+            hashes=np.array(self.hashes, dtype=str),
+            matrix=self.matrix
+        )
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def content_hash(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def sync(self, rows, batch_size=EMBED_BATCH_SIZE):
+        """
+        使缓存与 rows 保持一致，返回 (user_ids, matrix)
+        rows 的顺序即返回矩阵的行顺序
+        """
+        texts = [tags_to_text(r) for r in rows]
+        hashes = [self.content_hash(t) for t in texts]
+        user_ids = [str(r["user_id"]) for r in rows]
+
+        stale = [
+            i for i, (uid, h) in enumerate(zip(user_ids, hashes))
+            if self._index.get(uid) is None or self.hashes[self._index[uid]] != h
+        ]
+
+        dim = model.get_sentence_embedding_dimension()
+        matrix = np.zeros((len(rows), dim), dtype=np.float32)
+        for i, uid in enumerate(user_ids):
+            j = self._index.get(uid)
+            if j is not None and self.hashes[j] == hashes[i]:
+                matrix[i] = self.matrix[j]
+
+        # 空文本保持零向量（与 compute_similarity 返回 0.0 一致）
+        to_encode = [i for i in stale if texts[i]]
+        if to_encode:
+            print(f"🧮 批量编码 {len(to_encode)} 位用户的 life_tags ...")
+            embeddings = model.encode(
+                [texts[i] for i in to_encode],
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            matrix[to_encode] = embeddings.astype(np.float32, copy=False)
+
+        self.user_ids, self.hashes, self.matrix = user_ids, hashes, matrix
+        self._index = {uid: i for i, uid in enumerate(user_ids)}
+        if stale:
+            self.save()
+        return user_ids, matrix
+
+def top_n_similar(matrix, row, top_n, exclude=None):
+    """一次矩阵-向量乘法 + argpartition 取前 N（不含自身及 exclude 中的行）"""
+    scores = matrix @ matrix[row]
+    excluded = [row] if exclude is None else sorted(set(exclude) | {row})
+    scores[excluded] = -np.inf
+    k = min(top_n, len(scores) - len(excluded))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(int(i), round(float(scores[i]), 3)) for i in top]
+
+_embedding_store = None
+
+def get_embedding_store():
+    global _embedding_store
+    if _embedding_store is None:
+        _embedding_store = EmbeddingStore()
+    return _embedding_store
+
 # ----------------------------------------------------------
 # 主匹配函数
 # ----------------------------------------------------------
-def run_soulmate_matcher(user_id="u_demo", supabase=None, top_n=3):
+def run_soulmate_matcher(user_id="u_demo", supabase=None, top_n=3, batched=True, batch_size=EMBED_BATCH_SIZE):
     """
     执行同命匹配
     参数：
         user_id: 目标用户ID
         supabase: Supabase 客户端（可选）
         top_n: 返回前 N 个最匹配的用户
+        batched: 使用批量向量缓存模式（False 时逐对计算）
+        batch_size: 批量编码的 batch 大小
     返回：
         匹配结果列表
     """
@@ -103,43 +232,52 @@ def run_soulmate_matcher(user_id="u_demo", supabase=None, top_n=3):
 
     print(f"🔍 正在为用户 {user_id} 匹配同命...")
     
-    # 计算与其他用户的相似度
-    results = []
-    for other in data:
-        if other["user_id"] == user_id:
-            continue
-        
-        sim = compute_similarity(current, other)
-        
-        # 找出共同标签
-        shared = {
-            k: v for k, v in current.items() 
-            if k in other and k not in ["id", "user_id", "created_at", "updated_at"]
-            and current[k] == other[k] and v
+    if batched:
+        # 批量模式：只编码变化的用户，一次矩阵乘法得到前 N
+        user_ids, matrix = get_embedding_store().sync(data, batch_size=batch_size)
+        # 同一用户可能有多行标签：与逐对模式一致，排除该用户的所有行
+        own_rows = [i for i, uid in enumerate(user_ids) if uid == str(user_id)]
+        results = [
+            {
+                "matched_user_id": data[i]["user_id"],
+                "similarity": sim,
+                "shared_tags": shared_tags(current, data[i])
+            }
+            for i, sim in top_n_similar(matrix, own_rows[0], top_n, exclude=own_rows)
+        ]
+    else:
+        # 计算与其他用户的相似度
+        results = []
+        for other in data:
+            if other["user_id"] == user_id:
+                continue
+
+            sim = compute_similarity(current, other)
+
+            results.append({
+                "matched_user_id": other["user_id"],
+                "similarity": sim,
+                "shared_tags": shared_tags(current, other)
+            })
+
+        # 按相似度排序，取前 N 个
+        results = sorted(results, key=lambda x: x["similarity"], reverse=True)[:top_n]
+
+    # 保存匹配结果到数据库（一次多行 upsert）
+    verified_at = datetime.now().isoformat()
+    stats = write_rows(supabase, "soulmate_matches", [
+        {
+            "user_id": user_id,
+            "matched_user_id": r["matched_user_id"],
+            "similarity": r["similarity"],
+            "shared_tags": r["shared_tags"],
+            "verified_at": verified_at
         }
-        
-        results.append({
-            "matched_user_id": other["user_id"],
-            "similarity": sim,
-            "shared_tags": shared
-        })
-
-    # 按相似度排序，取前 N 个
-    results = sorted(results, key=lambda x: x["similarity"], reverse=True)[:top_n]
-
-    # 保存匹配结果到数据库
-    for r in results:
-        try:
-            supabase.table("soulmate_matches").upsert({
-                "user_id": user_id,
-                "matched_user_id": r["matched_user_id"],
-                "similarity": r["similarity"],
-                "shared_tags": r["shared_tags"],
-                "verified_at": datetime.now().isoformat()
-            }).execute()
+        for r in results
+    ], upsert=True, on_conflict="user_id,matched_user_id")
+    if not stats["failed"]:
+        for r in results:
             print(f"💗 匹配保存：{user_id} ↔ {r['matched_user_id']} (相似度：{r['similarity']})")
-        except Exception as e:
-            print(f"⚠️ 保存匹配结果失败：{e}")
 
     print(f"✅ Soulmate 匹配完成，找到 {len(results)} 个匹配用户。")
     
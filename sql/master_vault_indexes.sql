@@ -0,0 +1,12 @@
+-- ============================================
+-- Master Vault Indexes
+-- ============================================
+-- 用途：master_vault 列表按 (created_at, id) 键集分页，标题查询取同标题最新一条
+-- 由具备 DDL 权限的角色在 Supabase SQL Editor / psql 中执行一次
+-- CONCURRENTLY 建索引期间不阻塞写入；不能放在事务块内执行（逐条执行即可）
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_master_vault_created_at_id
+    ON master_vault (created_at DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_master_vault_title_created_at
+    ON master_vault (title, created_at DESC);
@@ -0,0 +1,123 @@
+"""
+中继任务状态存储（SQLite，WAL 模式）
+
+替代整份读写的 task_state.json：
+- 每个任务一行，主键 task_id，状态更新 / 读取均为单行操作
+- 已结束（completed / failed）的任务在 TTL 到期后清理
+- 按状态索引，支持列出某一状态的任务
+- 多进程可同时读写（WAL + busy_timeout）
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+FINISHED_STATUSES = ("completed", "failed")
+DEFAULT_TTL = float(os.getenv("TASK_STATE_TTL", str(7 * 24 * 3600)))
+PURGE_INTERVAL = 300
+
+
+class TaskStateStore:
+    def __init__(self, path, ttl: float = DEFAULT_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+        if self.path.parent != Path(""):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_state (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_task_state_status ON task_state(status, updated_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_task_state_expires ON task_state(expires_at)")
+        self.conn.commit()
+
+    # ---------- 写入 ----------
+    def set_status(self, task_id: str, status: str):
+        """更新单个任务状态；已结束的任务设置过期时间"""
+        now = time.time()
+        expires_at = now + self.ttl if status in FINISHED_STATUSES else None
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO task_state (task_id, status, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                (task_id, status, now, expires_at)
+            )
+            self.conn.commit()
+        if now - self._purged_at > PURGE_INTERVAL:
+            self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """删除已过期的已结束任务，返回删除条数"""
+        now = time.time()
+        with self._lock:
+            cur = self.conn.execute(
+                "DELETE FROM task_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            )
+            self.conn.commit()
+            self._purged_at = now
+            return cur.rowcount
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM task_state")
+            self.conn.commit()
+
+    def import_json(self, state_file) -> int:
+        """从旧版 task_state.json（{task_id: status}）迁移"""
+        state = json.loads(Path(state_file).read_text(encoding="utf-8"))
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO task_state (task_id, status, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                [
+                    (task_id, status, now, now + self.ttl if status in FINISHED_STATUSES else None)
+                    for task_id, status in state.items()
+                ]
+            )
+            self.conn.commit()
+        return len(state)
+
+    # ---------- 读取 ----------
+    def get_status(self, task_id: str):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT status, expires_at FROM task_state WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    def list_by_status(self, status: str, limit: int = 100):
+        """按更新时间倒序列出某一状态的任务：[{task_id, status, updated_at}]"""
+        with self._lock:
+            rows = self.conn.execute(
+                """
+                SELECT task_id, status, updated_at FROM task_state
+                WHERE status = ? AND (expires_at IS NULL OR expires_at > ?)
+                ORDER BY updated_at DESC
+                LIMIT ?
+                """,
+                (status, time.time(), limit)
+            ).fetchall()
+        return [
+            {"task_id": r[0], "status": r[1], "updated_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r[2]))}
+            for r in rows
+        ]
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM task_state").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
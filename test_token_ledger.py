@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 Guru Token 帐本：并发预留 / 结算 / 释放、批量写回失败后重新排队、写回期间重读订阅
+
+使用方法:
+    python -m pytest -q test_token_ledger.py
+"""
+
+import sys
+import threading
+import types
+
+import pytest
+
+# 测试使用假客户端，不需要真实的 supabase 包
+if "supabase" not in sys.modules:
+    try:
+        import supabase  # noqa: F401
+    except ImportError:
+        sys.modules["supabase"] = types.SimpleNamespace(create_client=None, Client=object)
+
+from uxbot_frontend import token_ledger  # noqa: E402
+
+GURU = "guru-1"
+
+
+class FakeClient:
+    """guru_subscriptions 单行 + increment_guru_token_used RPC；可注入失败与阻塞"""
+
+    def __init__(self, quota=1000, used=0):
+        self.row = {"guru_id": GURU, "plan": "pro", "token_quota": quota, "token_used": used, "status": "active"}
+        self.lock = threading.Lock()
+        self.rpc_failures = 0
+        self.rpc_gate = None          # threading.Event：RPC 在 set 之前阻塞
+        self.rpc_entered = threading.Event()
+        self.subscription_reads = 0
+        self.usage_logs = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        client = self
+
+        class _Call:
+            def execute(self):
+                assert name == "increment_guru_token_used"
+                client.rpc_entered.set()
+                if client.rpc_gate is not None:
+                    client.rpc_gate.wait(5)
+                with client.lock:
+                    if client.rpc_failures:
+                        client.rpc_failures -= 1
+                        raise ConnectionError("temporary network error")
+                    client.row["token_used"] += params["p_delta"]
+                return types.SimpleNamespace(data=client.row["token_used"])
+        return _Call()
+
+
+class FakeQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def insert(self, rows):
+        self.client.usage_logs.extend(rows)
+        return self
+
+    def execute(self):
+        if self.name == token_ledger.SUBSCRIPTION_TABLE:
+            with self.client.lock:
+                self.client.subscription_reads += 1
+                return types.SimpleNamespace(data=[dict(self.client.row)])
+        return types.SimpleNamespace(data=[])
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    monkeypatch.setattr(token_ledger, "apply_usage_rollups", lambda client, rows: len(rows))
+    client = FakeClient()
+    ledger = token_ledger.TokenLedger(client_factory=lambda: client, flush_interval=3600)
+    ledger.fake = client
+    yield ledger
+    ledger.fake.rpc_gate = None
+    ledger.close()
+
+
+def _run_threads(n, target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_concurrent_reservations_never_exceed_quota(ledger):
+    reservations = []
+    lock = threading.Lock()
+
+    def reserve(_):
+        r = ledger.reserve(GURU, 30)
+        if r is not None:
+            with lock:
+                reservations.append(r)
+
+    _run_threads(50, reserve)
+    assert len(reservations) == 1000 // 30
+    assert ledger.get_subscription_status(GURU)["token_remaining"] == 1000 - 30 * len(reservations)
+
+    # 一半按实际消耗结算，一半释放；重复结算 / 释放无效
+    def close(i):
+        r = reservations[i]
+        if i % 2 == 0:
+            ledger.settle(r, 20)
+            ledger.settle(r, 20)
+        else:
+            ledger.release(r)
+            ledger.release(r)
+
+    _run_threads(len(reservations), close)
+    settled = 20 * ((len(reservations) + 1) // 2)
+    status = ledger.get_subscription_status(GURU)
+    assert status["token_used"] == settled
+    assert status["token_remaining"] == 1000 - settled
+
+    ledger.flush()
+    assert ledger.fake.row["token_used"] == settled
+
+
+def test_failed_flush_is_requeued(ledger):
+    r = ledger.reserve(GURU, 100)
+    ledger.settle(r, 80)
+    ledger.fake.rpc_failures = 1
+
+    result = ledger.flush()
+    assert result["guru_count"] == 0
+    assert ledger.fake.row["token_used"] == 0
+    # 失败的增量仍计入已用，下次 flush 写回
+    assert ledger.get_subscription_status(GURU)["token_used"] == 80
+
+    result = ledger.flush()
+    assert result["guru_count"] == 1
+    assert ledger.fake.row["token_used"] == 80
+    assert ledger.flush()["guru_count"] == 0
+
+
+def test_subscription_reload_does_not_wait_for_flush_or_undercount(ledger):
+    r = ledger.reserve(GURU, 100)
+    ledger.settle(r, 60)
+
+    ledger.fake.rpc_gate = threading.Event()
+    flusher = threading.Thread(target=ledger.flush)
+    flusher.start()
+    assert ledger.fake.rpc_entered.wait(5)
+
+    # 写回阻塞期间快取过期：重读不等待 flush，且计入正在写回的增量
+    ledger.invalidate(GURU)
+    reads = ledger.fake.subscription_reads
+    statuses = []
+    reader = threading.Thread(target=lambda: statuses.append(ledger.get_subscription_status(GURU)))
+    reader.start()
+    reader.join(1)
+    assert statuses, "订阅重读被批量写回阻塞"
+    assert ledger.fake.subscription_reads == reads + 1
+    assert statuses[0]["token_used"] == 60
+
+    ledger.fake.rpc_gate.set()
+    flusher.join(5)
+    assert ledger.fake.row["token_used"] == 60
+
+    ledger.invalidate(GURU)
+    assert ledger.get_subscription_status(GURU)["token_used"] == 60
+
+
+def test_usage_rows_are_written_in_batches(ledger):
+    ledger.record_usage(GURU, "deepseek_high", 42, False, True)
+    ledger.record_usage(GURU, "deepseek_high", 0, True, False)
+    assert ledger.flush()["usage_rows"] == 2
+    assert [row["tokens_used"] for row in ledger.fake.usage_logs] == [42, 0]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试向量索引的增量更新：HNSW 删除 + 新增文件后的墓碑压实、提取为空的文件下次重试
+
+使用方法:
+    python -m pytest -q test_vector_indexer.py
+"""
+
+import sys
+import types
+import hashlib
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+# 测试不加载真实嵌入模型
+if "sentence_transformers" not in sys.modules:
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        sys.modules["sentence_transformers"] = types.SimpleNamespace(SentenceTransformer=None)
+
+import vector_indexer  # noqa: E402
+from vector_meta_store import ChunkMetaStore  # noqa: E402
+
+DIM = 16
+
+
+class HashModel:
+    """按文本哈希生成确定性的单位向量"""
+
+    def encode(self, texts, batch_size=None, normalize_embeddings=True):
+        out = []
+        for t in texts:
+            seed = int(hashlib.sha1(t.encode("utf-8")).hexdigest()[:8], 16)
+            v = np.random.default_rng(seed).standard_normal(DIM).astype("float32")
+            out.append(v / np.linalg.norm(v))
+        return np.array(out, dtype="float32")
+
+
+@pytest.fixture
+def vault(tmp_path, monkeypatch):
+    vault_dir = tmp_path / "vault"
+    (vault_dir / "project_docs").mkdir(parents=True)
+    store_dir = vault_dir / "vector_store"
+    store_dir.mkdir()
+    monkeypatch.setattr(vector_indexer, "VAULT_DIR", vault_dir)
+    monkeypatch.setattr(vector_indexer, "INDEX_FILE", store_dir / "faiss.index")
+    monkeypatch.setattr(vector_indexer, "META_FILE", store_dir / "meta.json")
+    monkeypatch.setattr(vector_indexer, "META_DB", store_dir / "meta.sqlite")
+    monkeypatch.setattr(vector_indexer, "get_model", lambda: HashModel())
+    return vault_dir / "project_docs"
+
+
+def _write_doc(folder, name, n_chunks):
+    # 每 480 字符（chunk_size - overlap）产生一个 chunk
+    words = " ".join(f"{name}-{i}" for i in range(n_chunks * 60))
+    (folder / f"{name}.md").write_text(words, encoding="utf-8")
+
+
+def _run(**kwargs):
+    vector_indexer.build_or_update(index_type="hnsw", workers=1, **kwargs)
+    index = faiss.read_index(str(vector_indexer.INDEX_FILE))
+    store = ChunkMetaStore(vector_indexer.META_DB)
+    try:
+        return index, store.all_ids()
+    finally:
+        store.close()
+
+
+def test_hnsw_delete_and_add_compacts_without_missing_ids(vault):
+    for i in range(5):
+        _write_doc(vault, f"doc{i}", 4)
+    index, ids = _run(rebuild=True)
+    assert index.ntotal == len(ids)
+
+    # 删除 3 个文件、新增 1 个：墓碑比例超过 COMPACT_RATIO，触发压实
+    for i in range(3):
+        (vault / f"doc{i}.md").unlink()
+    _write_doc(vault, "doc_new", 4)
+    index, ids = _run()
+    assert index.ntotal == len(ids)
+    assert sorted(faiss.vector_to_array(index.id_map).tolist()) == ids
+
+    # 之后的增量运行不再失败
+    _write_doc(vault, "doc_more", 2)
+    index, ids = _run()
+    assert index.ntotal == len(ids)
+
+
+def test_hnsw_tombstones_counted_against_indexed_vectors(vault):
+    for i in range(5):
+        _write_doc(vault, f"doc{i}", 4)
+    _run(rebuild=True)
+
+    # 3 个文件内容变更 + 1 个新增：旧向量全部成为墓碑
+    for i in range(3):
+        _write_doc(vault, f"doc{i}", 3)
+    _write_doc(vault, "doc_new", 4)
+    index, ids = _run()
+    assert index.ntotal == len(ids)
+
+
+def test_file_with_empty_extraction_is_retried(vault, monkeypatch):
+    _write_doc(vault, "doc0", 2)
+    _write_doc(vault, "scan", 2)
+    read_text = vector_indexer.read_text
+
+    # 提取失败（如缺少 pdfminer）：不写入清单
+    monkeypatch.setattr(vector_indexer, "read_text", lambda p: "" if p.stem == "scan" else read_text(p))
+    _run(rebuild=True)
+    store = ChunkMetaStore(vector_indexer.META_DB)
+    try:
+        assert "project_docs/scan.md" not in store.get_manifest()
+    finally:
+        store.close()
+
+    # 文件未改动，提取恢复后下次运行即被索引
+    monkeypatch.setattr(vector_indexer, "read_text", read_text)
+    index, ids = _run()
+    store = ChunkMetaStore(vector_indexer.META_DB)
+    try:
+        assert "project_docs/scan.md" in store.get_manifest()
+        assert store.has_file("project_docs/scan.md")
+    finally:
+        store.close()
+    assert index.ntotal == len(ids)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
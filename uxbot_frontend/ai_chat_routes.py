@@ -3,8 +3,9 @@ AI Chat Routes - 整合 OpenRouter LLM 服務
 處理 AI 對話請求，自動管理 Token 消耗和模型切換
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import os
+import json
 from supabase import create_client, Client
 
 from .openrouter_service import (
@@ -13,6 +14,8 @@ from .openrouter_service import (
     MODEL_MAPPING,
     determine_model_for_guru
 )
+from .token_ledger import get_token_ledger
+from .usage_rollups import fetch_usage_rollups
 
 ai_chat_bp = Blueprint('ai_chat', __name__)
 
@@ -61,32 +64,9 @@ def get_token_warning(token_remaining: int) -> dict:
 
 
 def get_subscription_status(guru_id: str) -> dict:
-    """獲取訂閱狀態"""
+    """獲取訂閱狀態（Token 帳本短 TTL 快取，剩餘額度已扣除進行中的預留）"""
     try:
-        supabase = get_supabase()
-        response = supabase.table('guru_subscriptions').select('*').eq('guru_id', guru_id).eq('status', 'active').execute()
-        
-        if response.data and len(response.data) > 0:
-            sub = response.data[0]
-            token_quota = sub.get('token_quota', 0)
-            token_used = sub.get('token_used', 0)
-            return {
-                'has_subscription': True,
-                'plan': sub.get('plan', 'free'),
-                'token_quota': token_quota,
-                'token_used': token_used,
-                'token_remaining': token_quota - token_used,
-                'status': sub.get('status', 'active')
-            }
-        else:
-            return {
-                'has_subscription': False,
-                'plan': None,
-                'token_quota': 0,
-                'token_used': 0,
-                'token_remaining': 0,
-                'status': 'none'
-            }
+        return get_token_ledger().get_subscription_status(guru_id)
     except Exception as e:
         print(f"[AI Chat] Error getting subscription: {e}")
         return {
@@ -97,63 +77,26 @@ def get_subscription_status(guru_id: str) -> dict:
 
 
 def get_ai_config(guru_id: str) -> dict:
-    """獲取 AI 配置（偏好模型）"""
+    """獲取 AI 配置（偏好模型，短 TTL 快取）"""
     try:
-        supabase = get_supabase()
-        response = supabase.table('guru_ai_config').select('*').eq('guru_id', guru_id).execute()
-        
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        else:
-            return {'preferred_model': 'deepseek_high'}  # 默認模型
+        return get_token_ledger().get_ai_config(guru_id)
     except Exception as e:
         print(f"[AI Chat] Error getting AI config: {e}")
         return {'preferred_model': 'deepseek_high'}
 
 
 def deduct_tokens(guru_id: str, tokens: int) -> bool:
-    """扣除 Token"""
+    """扣除 Token（記入帳本，由後台批量寫回）"""
     try:
-        supabase = get_supabase()
-        
-        # 獲取當前使用量
-        response = supabase.table('guru_subscriptions').select('token_used').eq('guru_id', guru_id).eq('status', 'active').execute()
-        
-        if response.data and len(response.data) > 0:
-            current_used = response.data[0].get('token_used', 0)
-            new_used = current_used + tokens
-            
-            # 更新
-            supabase.table('guru_subscriptions').update({
-                'token_used': new_used
-            }).eq('guru_id', guru_id).eq('status', 'active').execute()
-            
-            return True
-        return False
+        return get_token_ledger().charge(guru_id, tokens)
     except Exception as e:
         print(f"[AI Chat] Error deducting tokens: {e}")
         return False
 
 
-# AI 使用日誌表名
-AI_USAGE_LOG_TABLE = 'guru_ai_usage_logs'
-
 def log_ai_usage(guru_id: str, model_id: str, tokens_used: int, is_fallback: bool, success: bool):
-    """記錄 AI 使用日誌"""
-    try:
-        supabase = get_supabase()
-        # 插入使用日誌
-        supabase.table(AI_USAGE_LOG_TABLE).insert({
-            'guru_id': guru_id,
-            'model_id': model_id,
-            'tokens_used': tokens_used,
-            'is_fallback': is_fallback,
-            'success': success
-        }).execute()
-        print(f"[AI Chat] Logged usage: model={model_id}, tokens={tokens_used}")
-    except Exception as e:
-        # 日誌記錄失敗不影響主流程（表可能尚未創建）
-        print(f"[AI Chat] Log error (non-critical): {e}")
+    """記錄 AI 使用日誌（批量寫入 guru_ai_usage_logs）"""
+    get_token_ledger().record_usage(guru_id, model_id, tokens_used, is_fallback, success)
 
 
 # ─────────────────────────────────────────────────────────────────
@@ -174,7 +117,8 @@ def ai_chat():
         ],
         "model": "deepseek_high",  // 可選，覆蓋默認偏好
         "max_tokens": 2000,        // 可選
-        "temperature": 0.7         // 可選
+        "temperature": 0.7,        // 可選
+        "stream": false            // 可選，true 時以 SSE 逐段返回
     }
     
     Response:
@@ -187,6 +131,13 @@ def ai_chat():
         "tokens_consumed": 1,
         "token_remaining": 992
     }
+    
+    Stream Response (text/event-stream):
+        data: {"model_used": "deepseek_high", "model_name": "DeepSeek R1", "is_fallback": false}
+        data: {"content": "片段..."}
+        ...
+        data: {"done": true, ...同上非流式 Response 欄位}
+        失敗時: data: {"error": "...", "done": true}
     """
     data = request.get_json()
     
@@ -230,8 +181,26 @@ def ai_chat():
             'hint': '請設置環境變數 OPENROUTER_API_KEY'
         }), 500
     
-    # 5. 調用 OpenRouter
+    # 5. 預留 Token（併發對話搶不到額度時改用 fallback 模型）
+    reservation = None
+    tokens_needed = MODEL_INFO.get(model_id, {}).get('tokens_per_call', 0)
+    if not use_fallback and tokens_needed > 0:
+        try:
+            reservation = get_token_ledger().reserve(guru_id, tokens_needed)
+        except Exception as e:
+            print(f"[AI Chat] Error reserving tokens: {e}")
+        if reservation is None:
+            model_id, use_fallback = 'deepseek_chat', True
+    
+    # 6. 調用 OpenRouter
     service = OpenRouterService(api_key=api_key)
+    if data.get('stream'):
+        return stream_ai_chat(
+            service, guru_id, messages, model_id, use_fallback, token_remaining, reservation,
+            max_tokens=data.get('max_tokens', 2000),
+            temperature=data.get('temperature', 0.7)
+        )
+    
     result = service.chat_completion_sync(
         messages=messages,
         model_id=model_id,
@@ -240,39 +209,12 @@ def ai_chat():
         temperature=data.get('temperature', 0.7)
     )
     
-    # 6. 處理結果
+    # 7. 處理結果
     if result.get('success'):
-        tokens_consumed = result.get('tokens_consumed', 0)
-        
-        # 扣除 Token（只有非 fallback 模型才扣）
-        if tokens_consumed > 0 and not result.get('is_fallback'):
-            deduct_tokens(guru_id, tokens_consumed)
-            new_remaining = token_remaining - tokens_consumed
-        else:
-            new_remaining = token_remaining
-        
-        # 記錄使用日誌
-        log_ai_usage(
-            guru_id=guru_id,
-            model_id=model_id,
-            tokens_used=tokens_consumed,
-            is_fallback=result.get('is_fallback', False),
-            success=True
-        )
-        
-        return jsonify({
-            'success': True,
-            'content': result.get('content', ''),
-            'model_used': result.get('model_used'),
-            'model_name': result.get('model_name'),
-            'is_fallback': result.get('is_fallback', False),
-            'tokens_consumed': tokens_consumed,
-            'token_remaining': new_remaining,
-            'usage': result.get('usage', {}),
-            'warning': get_token_warning(new_remaining)
-        })
+        return jsonify(finalize_chat_result(guru_id, model_id, result, token_remaining, reservation))
     else:
-        # API 調用失敗
+        # API 調用失敗，退回預留
+        get_token_ledger().release(reservation)
         log_ai_usage(
             guru_id=guru_id,
             model_id=model_id,
@@ -289,6 +231,119 @@ def ai_chat():
         }), 500
 
 
+def finalize_chat_result(guru_id: str, model_id: str, result: dict, token_remaining: int, reservation=None) -> dict:
+    """成功調用後結算預留的 Token、記錄日誌，返回給前端的結果"""
+    tokens_consumed = result.get('tokens_consumed', 0)
+    ledger = get_token_ledger()
+    
+    # 扣除 Token（只有非 fallback 模型才扣）
+    if tokens_consumed > 0 and not result.get('is_fallback'):
+        if reservation is not None:
+            new_remaining = ledger.settle(reservation, tokens_consumed)
+        else:
+            deduct_tokens(guru_id, tokens_consumed)
+            new_remaining = token_remaining - tokens_consumed
+    else:
+        ledger.release(reservation)
+        new_remaining = token_remaining
+    
+    # 記錄使用日誌
+    log_ai_usage(
+        guru_id=guru_id,
+        model_id=model_id,
+        tokens_used=tokens_consumed,
+        is_fallback=result.get('is_fallback', False),
+        success=True
+    )
+    
+    return {
+        'success': True,
+        'content': result.get('content', ''),
+        'model_used': result.get('model_used'),
+        'model_name': result.get('model_name'),
+        'is_fallback': result.get('is_fallback', False),
+        'tokens_consumed': tokens_consumed,
+        'token_remaining': new_remaining,
+        'usage': result.get('usage', {}),
+        'warning': get_token_warning(new_remaining)
+    }
+
+
+def stream_ai_chat(service, guru_id, messages, model_id, use_fallback, token_remaining, reservation=None, **options):
+    """
+    以 SSE 逐段轉發模型輸出；結束後結算 Token 並發送最終結果
+    已轉發過內容後中途斷開或出錯，按完整調用結算；一段都未送出才退回預留
+    """
+    model_info = MODEL_INFO.get('deepseek_chat' if use_fallback else model_id, MODEL_INFO['deepseek_chat'])
+    is_fallback = use_fallback or model_info['tier'] == 'fallback'
+    state = {'delivered': False, 'finalized': False}
+    
+    def settle_partial(success: bool):
+        """已送出部分內容但沒有收到 done 事件時結算"""
+        tokens = 0 if is_fallback else model_info['tokens_per_call']
+        ledger = get_token_ledger()
+        if tokens > 0 and reservation is not None:
+            ledger.settle(reservation, tokens)
+        elif tokens > 0:
+            deduct_tokens(guru_id, tokens)
+        log_ai_usage(
+            guru_id=guru_id,
+            model_id=model_id,
+            tokens_used=tokens,
+            is_fallback=is_fallback,
+            success=success
+        )
+    
+    def generate():
+        try:
+            yield from relay()
+        finally:
+            if state['delivered'] and not state['finalized']:
+                state['finalized'] = True
+                settle_partial(success=True)
+            get_token_ledger().release(reservation)
+    
+    def relay():
+        yield f"data: {json.dumps({'model_used': model_id, 'model_name': model_info['name'], 'is_fallback': use_fallback}, ensure_ascii=False)}\n\n"
+        
+        for event in service.chat_completion_stream(
+            messages=messages,
+            model_id=model_id,
+            use_fallback=use_fallback,
+            **options
+        ):
+            if event['type'] == 'delta':
+                state['delivered'] = True
+                yield f"data: {json.dumps({'content': event['content']}, ensure_ascii=False)}\n\n"
+            elif event['type'] == 'done':
+                state['finalized'] = True
+                final = finalize_chat_result(guru_id, model_id, event, token_remaining, reservation)
+                final.pop('content', None)
+                yield f"data: {json.dumps({'done': True, **final}, ensure_ascii=False)}\n\n"
+            else:
+                state['finalized'] = True
+                if state['delivered']:
+                    settle_partial(success=False)
+                else:
+                    log_ai_usage(
+                        guru_id=guru_id,
+                        model_id=model_id,
+                        tokens_used=0,
+                        is_fallback=use_fallback,
+                        success=False
+                    )
+                yield f"data: {json.dumps({'error': event.get('error', '未知錯誤'), 'done': True}, ensure_ascii=False)}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
 @ai_chat_bp.route('/api/ai/models', methods=['GET'])
 def get_available_models():
     """獲取可用的 AI 模型列表"""
@@ -414,6 +469,9 @@ def get_usage_stats():
     Query Params:
         guru_id: UUID (required)
         days: int (optional, default=7)
+        granularity: "hour" (optional) 額外返回 hourly_usage
+    
+    數據來自預聚合的 guru_ai_usage_rollups（見 usage_rollups.py），不讀取明細日誌
     
     Response:
     {
@@ -421,13 +479,13 @@ def get_usage_stats():
         "stats": {
             "current": { "used": 50, "quota": 1000, "remaining": 950 },
             "daily_usage": [
-                {"date": "2026-01-06", "tokens": 5, "calls": 3},
-                {"date": "2026-01-07", "tokens": 8, "calls": 4},
+                {"date": "2026-01-06", "tokens": 5, "calls": 3, "fallbacks": 0, "failures": 0},
+                {"date": "2026-01-07", "tokens": 8, "calls": 4, "fallbacks": 1, "failures": 0},
                 ...
             ],
             "model_breakdown": [
-                {"model": "DeepSeek R1", "tokens": 30, "calls": 15},
-                {"model": "ChatGPT-5", "tokens": 20, "calls": 5}
+                {"model": "DeepSeek R1", "tokens": 30, "calls": 15, "fallbacks": 0, "failures": 1},
+                {"model": "ChatGPT-5", "tokens": 20, "calls": 5, "fallbacks": 0, "failures": 0}
             ],
             "total_calls": 45,
             "avg_daily_tokens": 7.1
@@ -446,73 +504,58 @@ def get_usage_stats():
         # 1. 獲取當前訂閱狀態
         subscription = get_subscription_status(guru_id)
         
-        # 2. 嘗試從 guru_ai_usage_logs 表獲取使用日誌
+        # 2. 從使用量彙總表（guru_ai_usage_rollups）讀取，不掃描明細日誌
         # 如果表不存在，返回模擬數據
         daily_usage = []
+        hourly_usage = []
         model_breakdown = []
         total_calls = 0
         
         try:
-            from datetime import datetime, timedelta
+            from datetime import datetime, timedelta, timezone
             
-            # 計算日期範圍
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
+            # 計算日期範圍（彙總桶為 UTC）
+            start_date = datetime.now(timezone.utc) - timedelta(days=days)
+            rollups = fetch_usage_rollups(supabase, guru_id, start_date, granularity='day')
             
-            # 嘗試查詢使用日誌
-            response = supabase.table(AI_USAGE_LOG_TABLE).select('*').eq(
-                'guru_id', guru_id
-            ).gte(
-                'created_at', start_date.isoformat()
-            ).order('created_at', desc=False).execute()
-            
-            if response.data:
-                # 按日期聚合
+            if rollups:
+                # 按日期 / 模型合併各模型的彙總行
                 from collections import defaultdict
-                date_stats = defaultdict(lambda: {'tokens': 0, 'calls': 0})
-                model_stats = defaultdict(lambda: {'tokens': 0, 'calls': 0})
+                date_stats = defaultdict(lambda: {'tokens': 0, 'calls': 0, 'fallbacks': 0, 'failures': 0})
+                model_stats = defaultdict(lambda: {'tokens': 0, 'calls': 0, 'fallbacks': 0, 'failures': 0})
                 
-                for log in response.data:
-                    # 提取日期部分
-                    created_at = log.get('created_at', '')
-                    if created_at:
-                        date_key = created_at[:10]  # YYYY-MM-DD
-                    else:
-                        continue
-                    
-                    tokens = log.get('tokens_used', 0)
-                    model_id = log.get('model_id', 'unknown')
-                    
-                    # 獲取模型名稱
-                    model_info = MODEL_INFO.get(model_id, {})
-                    model_name = model_info.get('name', model_id)
-                    
-                    date_stats[date_key]['tokens'] += tokens
-                    date_stats[date_key]['calls'] += 1
-                    model_stats[model_name]['tokens'] += tokens
-                    model_stats[model_name]['calls'] += 1
-                    total_calls += 1
+                for row in rollups:
+                    model_id = row.get('model_id', 'unknown')
+                    model_name = MODEL_INFO.get(model_id, {}).get('name', model_id)
+                    for counter in ('tokens', 'calls', 'fallbacks', 'failures'):
+                        date_stats[row['bucket']][counter] += row.get(counter) or 0
+                        model_stats[model_name][counter] += row.get(counter) or 0
+                    total_calls += row.get('calls') or 0
                 
                 # 轉換為列表
                 for date, stats in sorted(date_stats.items()):
-                    daily_usage.append({
-                        'date': date,
-                        'tokens': stats['tokens'],
-                        'calls': stats['calls']
-                    })
+                    daily_usage.append({'date': date, **stats})
                 
                 for model, stats in model_stats.items():
-                    model_breakdown.append({
-                        'model': model,
-                        'tokens': stats['tokens'],
-                        'calls': stats['calls']
-                    })
+                    model_breakdown.append({'model': model, **stats})
             else:
                 # 沒有日誌，生成空數據
                 daily_usage = generate_empty_daily_data(days)
+            
+            if request.args.get('granularity') == 'hour':
+                for row in fetch_usage_rollups(supabase, guru_id, start_date, granularity='hour'):
+                    if hourly_usage and hourly_usage[-1]['hour'] == row['bucket']:
+                        hourly_usage[-1]['tokens'] += row.get('tokens') or 0
+                        hourly_usage[-1]['calls'] += row.get('calls') or 0
+                    else:
+                        hourly_usage.append({
+                            'hour': row['bucket'],
+                            'tokens': row.get('tokens') or 0,
+                            'calls': row.get('calls') or 0
+                        })
                 
         except Exception as log_error:
-            print(f"[AI Usage] Log query error (using mock data): {log_error}")
+            print(f"[AI Usage] Rollup query error (using mock data): {log_error}")
             # 表可能不存在，生成模擬數據用於展示
             daily_usage = generate_mock_daily_data(days, subscription.get('token_used', 0))
             model_breakdown = generate_mock_model_breakdown()
@@ -532,6 +575,7 @@ def get_usage_stats():
                 },
                 'daily_usage': daily_usage,
                 'model_breakdown': model_breakdown,
+                **({'hourly_usage': hourly_usage} if request.args.get('granularity') == 'hour' else {}),
                 'total_calls': total_calls,
                 'avg_daily_tokens': avg_daily
             }
@@ -8,10 +8,12 @@ import time
 from copy import deepcopy
 from datetime import datetime
 from urllib.parse import quote
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from supabase import create_client, Client
 
+from .guru_search_index import GuruSearchIndex, RESPONSE_CACHE_TTL
+
 guru_bp = Blueprint('guru_bp', __name__)
 
 # Initialize Supabase Client
@@ -702,6 +704,8 @@ def update_guru_profile(guru_id):
             # If no record found in guru_accounts, try to update guru_registrations
             result = supabase.table("guru_registrations").update(update_data).eq("id", guru_id).execute()
         
+        _refresh_search_index(guru_id)
+        
         return jsonify({
             "success": True,
             "message": "Profile updated successfully"
@@ -985,6 +989,7 @@ def save_guru_studio_state(guru_id):
             supabase.table("guru_studios").insert(studio_payload).execute()
 
         refreshed = _get_studio_record(guru_id)
+        _refresh_search_index(guru_id)
 
         return jsonify({
             "success": True,
@@ -1046,6 +1051,7 @@ def publish_guru_studio(guru_id):
             supabase.table("guru_studios").insert(insert_payload).execute()
 
         refreshed = _get_studio_record(guru_id)
+        _refresh_search_index(guru_id)
 
         return jsonify({
             "success": True,
@@ -1098,8 +1104,56 @@ def get_public_guru_profile(guru_id):
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+def _build_search_entry(studio: dict, account: dict | None):
+    """Build a prebuilt search card, its searchable text and country code for the guru search index."""
+    guru_id = studio.get('guru_id')
+    snapshot = _with_snapshot_defaults(studio.get('published_snapshot') or studio.get('profile_snapshot'))
+    hero = snapshot.get('hero', {})
+    meta = _build_account_meta(account, None)
+
+    card = {
+        "guru_id": guru_id,
+        "studio_id": studio.get('id'),
+        "studio_name": hero.get('studioName') or studio.get('name'),
+        "guru_name": hero.get('guruName') or meta.get('display_name'),
+        "tagline": hero.get('tagline'),
+        "location": hero.get('location') or studio.get('location'),
+        "country_flag": hero.get('flag') or meta.get('country_flag'),
+        "country_name": hero.get('region') or meta.get('country_name'),
+        "rating": (account or {}).get('rating', 5.0),
+        "consultations": (account or {}).get('consultations_count', 0),
+        "starting_price": hero.get('stats', {}).get('startingPrice'),
+        "services": snapshot.get('services', []),
+        "pricing": snapshot.get('pricing', []),
+        "published_at": studio.get('published_at')
+    }
+    # Studio name/location columns (what the old ilike query matched) plus the hero copy shown on the card.
+    search_text = "\n".join(
+        str(value) for value in (
+            studio.get('name'), studio.get('location'),
+            hero.get('studioName'), hero.get('location'), hero.get('tagline')
+        ) if value
+    )
+    return card, search_text, meta.get('country')
+
+
+guru_search_index = GuruSearchIndex(lambda: supabase, _build_search_entry)
+
+
+def _refresh_search_index(guru_id: str):
+    try:
+        guru_search_index.refresh_guru(guru_id)
+    except Exception as e:
+        logging.warning(f"[Guru Search] Index refresh error: {e}")
+
+
 @guru_bp.route('/api/guru/search', methods=['GET'])
 def guru_search():
+    """
+    Search published studios from the in-process index (no per-request DB queries).
+    Query: keyword, country (ISO code), min_price, max_price, page, page_size
+    Responses carry an ETag; If-None-Match returns 304.
+    """
     if not supabase:
         return jsonify({"success": False, "error": "Database not configured"}), 500
 
@@ -1109,68 +1163,20 @@ def guru_search():
         page_size = request.args.get('page_size', 12, type=int)
         page_size = min(max(page_size, 1), 40)
 
-        start = (page - 1) * page_size
-        end = start + page_size - 1
-
-        query = supabase.table("guru_studios").select("*", count='exact').eq("is_published", True)
-
-        if keyword:
-            like_keyword = f"%{keyword}%"
-            query = query.or_(f"name.ilike.{like_keyword},location.ilike.{like_keyword}")
-
-        query = query.order("published_at", desc=True).range(start, end)
-
-        result = query.execute()
-        studios = result.data or []
-        total = getattr(result, 'count', None)
-
-        guru_ids = [studio.get('guru_id') for studio in studios if studio.get('guru_id')]
-        accounts_map = {}
-
-        if guru_ids:
-            account_res = supabase.table("guru_accounts").select("*").in_("id", guru_ids).execute()
-            accounts_map = {acc['id']: acc for acc in (account_res.data or []) if acc.get('id')}
-
-        cards = []
-        for studio in studios:
-            guru_id = studio.get('guru_id')
-            account = accounts_map.get(guru_id)
-            snapshot = _with_snapshot_defaults(studio.get('published_snapshot') or studio.get('profile_snapshot'))
-            hero = snapshot.get('hero', {})
-            meta = _build_account_meta(account, None)
-
-            cards.append({
-                "guru_id": guru_id,
-                "studio_id": studio.get('id'),
-                "studio_name": hero.get('studioName') or studio.get('name'),
-                "guru_name": hero.get('guruName') or meta.get('display_name'),
-                "tagline": hero.get('tagline'),
-                "location": hero.get('location') or studio.get('location'),
-                "country_flag": hero.get('flag') or meta.get('country_flag'),
-                "country_name": hero.get('region') or meta.get('country_name'),
-                "rating": (account or {}).get('rating', 5.0),
-                "consultations": (account or {}).get('consultations_count', 0),
-                "starting_price": hero.get('stats', {}).get('startingPrice'),
-                "services": snapshot.get('services', []),
-                "pricing": snapshot.get('pricing', []),
-                "published_at": studio.get('published_at')
-            })
-
-        if total is None:
-            total = start + len(cards)
-
-        has_more = total > end + 1 if total else len(cards) == page_size
+        body, etag = guru_search_index.cached_search(
+            keyword=keyword,
+            country=request.args.get('country', '').strip() or None,
+            min_price=request.args.get('min_price', None, type=float),
+            max_price=request.args.get('max_price', None, type=float),
+            page=page,
+            page_size=page_size
+        )
 
-        return jsonify({
-            "success": True,
-            "data": cards,
-            "pagination": {
-                "page": page,
-                "page_size": page_size,
-                "total": total,
-                "has_more": has_more
-            }
-        }), 200
+        response = Response(body, status=200, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = int(RESPONSE_CACHE_TTL)
+        return response.make_conditional(request)
 
     except Exception as e:
         logging.error(f"Guru search error: {e}")
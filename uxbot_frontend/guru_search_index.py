@@ -0,0 +1,293 @@
+"""
+Guru Search Index - 已發布工作室的本地搜索索引
+替代 /api/guru/search 每次請求的 ilike OR 查詢 + COUNT(*) + guru_accounts 查詢
+
+- 索引名稱、地點、標語等文本的單字 + 二元組（中文無需分詞即可命中任意子串）；
+  候選集取交集後再做子串校驗，與原 ilike '%keyword%' 的命中結果一致
+- 國家、起步價篩選；按 published_at 倒序分頁，總數直接得出
+- 卡片數據在建索引時預先生成
+- 增量更新：發布 / 保存工作室、更新資料時調用 refresh_guru()；
+  另按 INDEX_TTL 後台整體重建，覆蓋其他進程或後台直接改表的情況。
+  重建期間的增量更新在新索引換入後重新套用，不會被較舊的快照覆蓋
+- 多 worker 部署：refresh_guru() 只更新處理該請求的進程，其他 worker 最多延遲 INDEX_TTL
+  才看到變更；需要更快生效時調小 GURU_SEARCH_INDEX_TTL
+- 響應緩存：相同查詢在 RESPONSE_CACHE_TTL 內直接返回緩存的 JSON 與 ETag，
+  索引有任何變化即失效
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Dict, Any, List
+
+INDEX_TTL = float(os.getenv("GURU_SEARCH_INDEX_TTL", "300"))
+RESPONSE_CACHE_TTL = float(os.getenv("GURU_SEARCH_CACHE_TTL", "30"))
+RESPONSE_CACHE_SIZE = 512
+PAGE_SIZE = 1000
+ACCOUNT_CHUNK_SIZE = 200
+
+
+def _grams(text: str) -> set:
+    """單字 + 相鄰二元組（已小寫）"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    grams.discard(' ')
+    return grams
+
+
+def _price(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Entry:
+    __slots__ = ("guru_id", "card", "text", "grams", "country", "price", "published_at")
+
+    def __init__(self, guru_id: str, card: Dict[str, Any], search_text: str, country: Optional[str]):
+        self.guru_id = guru_id
+        self.card = card
+        self.text = search_text.lower()
+        self.grams = _grams(self.text)
+        self.country = (country or '').upper() or None
+        self.price = _price(card.get('starting_price'))
+        self.published_at = card.get('published_at') or ''
+
+
+class GuruSearchIndex:
+    def __init__(self, client_getter: Callable, build_entry: Callable):
+        """
+        Args:
+            client_getter: 返回 Supabase 客戶端
+            build_entry: (studio, account) -> (card, search_text, country_code)
+        """
+        self._client_getter = client_getter
+        self._build_entry = build_entry
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self._postings: Dict[str, set] = {}
+        self._order: Optional[List[_Entry]] = None
+        self._built_at = 0.0
+        self._refreshed: Optional[Dict[str, Optional[_Entry]]] = None   # 重建期間的增量更新
+        self.version = 0
+        self._responses: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    # ---------- 載入 ----------
+
+    def _fetch_accounts(self, guru_ids) -> Dict[str, dict]:
+        client = self._client_getter()
+        accounts = {}
+        guru_ids = list(guru_ids)
+        for i in range(0, len(guru_ids), ACCOUNT_CHUNK_SIZE):
+            res = client.table("guru_accounts").select("*").in_("id", guru_ids[i:i + ACCOUNT_CHUNK_SIZE]).execute()
+            accounts.update({acc['id']: acc for acc in (res.data or []) if acc.get('id')})
+        return accounts
+
+    def _make_entry(self, studio: dict, account: Optional[dict]) -> _Entry:
+        card, search_text, country = self._build_entry(studio, account)
+        return _Entry(studio.get('guru_id'), card, search_text, country)
+
+    def rebuild(self, if_older_than: Optional[float] = None) -> int:
+        """
+        全量重建（分頁讀取已發布工作室），返回索引條數
+        if_older_than: 拿到重建鎖後，若索引已在該時間點之後建好（其他線程剛重建完）則直接返回
+        """
+        with self._rebuild_lock:
+            if if_older_than is not None and self._built_at > if_older_than:
+                return len(self._entries)
+            with self._lock:
+                self._refreshed = {}
+            try:
+                return self._rebuild()
+            finally:
+                with self._lock:
+                    self._refreshed = None
+
+    def _rebuild(self) -> int:
+        client = self._client_getter()
+        studios = []
+        offset = 0
+        while True:
+            res = client.table("guru_studios").select("*").eq("is_published", True).order(
+                "published_at", desc=True
+            ).range(offset, offset + PAGE_SIZE - 1).execute()
+            page = res.data or []
+            studios.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+        accounts = self._fetch_accounts({s.get('guru_id') for s in studios if s.get('guru_id')})
+        entries = {}
+        postings: Dict[str, set] = {}
+        for studio in studios:
+            guru_id = studio.get('guru_id')
+            if not guru_id or guru_id in entries:
+                continue
+            entry = self._make_entry(studio, accounts.get(guru_id))
+            entries[guru_id] = entry
+            for gram in entry.grams:
+                postings.setdefault(gram, set()).add(guru_id)
+
+        with self._lock:
+            # 讀取快照期間 refresh_guru 做過的更新比快照新，換入後重新套用
+            for guru_id, entry in self._refreshed.items():
+                self._apply(entries, postings, guru_id, entry)
+            self._entries = entries
+            self._postings = postings
+            self._order = None
+            self._built_at = time.time()
+            self._bump()
+        return len(entries)
+
+    def refresh_guru(self, guru_id: str):
+        """單個 guru 的工作室或資料變更後增量更新（未發布則移出索引）"""
+        if not self._built_at and self._refreshed is None:
+            return
+        try:
+            client = self._client_getter()
+            res = client.table("guru_studios").select("*").eq("guru_id", guru_id).eq(
+                "is_published", True
+            ).limit(1).execute()
+            studio = res.data[0] if res.data else None
+            entry = None
+            if studio:
+                entry = self._make_entry(studio, self._fetch_accounts([guru_id]).get(guru_id))
+        except Exception as e:
+            logging.warning(f"[Guru Search] Incremental refresh failed for {guru_id}: {e}")
+            with self._lock:
+                self._built_at = 1.0   # 下次搜索時觸發全量重建
+            return
+
+        with self._lock:
+            self._apply(self._entries, self._postings, guru_id, entry)
+            if self._refreshed is not None:
+                self._refreshed[guru_id] = entry
+            self._order = None
+            self._bump()
+
+    @staticmethod
+    def _apply(entries: Dict[str, _Entry], postings: Dict[str, set], guru_id: str, entry: Optional[_Entry]):
+        """以 entry 替換 guru_id 的條目（None 表示移出索引）"""
+        old = entries.pop(guru_id, None)
+        if old is not None:
+            for gram in old.grams:
+                ids = postings.get(gram)
+                if ids is not None:
+                    ids.discard(guru_id)
+                    if not ids:
+                        del postings[gram]
+        if entry is not None:
+            entries[guru_id] = entry
+            for gram in entry.grams:
+                postings.setdefault(gram, set()).add(guru_id)
+
+    def _bump(self):
+        self.version += 1
+        self._responses.clear()
+
+    def _ensure_fresh(self):
+        if not self._built_at:
+            # 冷啟動時併發的首批搜索只重建一次
+            self.rebuild(if_older_than=0.0)
+            return
+        with self._lock:
+            stale = time.time() - self._built_at > INDEX_TTL
+            if stale:
+                self._built_at = time.time()   # 只觸發一次後台重建
+        if stale:
+            # 過期：後台重建，期間繼續使用舊索引
+            threading.Thread(target=self._safe_rebuild, name="guru-search-rebuild", daemon=True).start()
+
+    def _safe_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logging.warning(f"[Guru Search] Index rebuild failed: {e}")
+
+    # ---------- 查詢 ----------
+
+    def search(
+        self,
+        keyword: str = '',
+        country: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        page: int = 1,
+        page_size: int = 12,
+    ) -> Dict[str, Any]:
+        """返回 {"data": cards, "pagination": {...}}"""
+        self._ensure_fresh()
+        terms = keyword.lower().split()
+        country = (country or '').upper() or None
+
+        with self._lock:
+            if self._order is None:
+                self._order = sorted(self._entries.values(), key=lambda e: e.published_at, reverse=True)
+            order = self._order
+
+            candidates = None
+            for term in terms:
+                for gram in _grams(term):
+                    ids = self._postings.get(gram, set())
+                    candidates = set(ids) if candidates is None else candidates & ids
+                    if not candidates:
+                        break
+                if candidates is not None and not candidates:
+                    break
+
+        matches = []
+        for entry in order:
+            if candidates is not None and entry.guru_id not in candidates:
+                continue
+            if terms and not all(term in entry.text for term in terms):
+                continue
+            if country and entry.country != country:
+                continue
+            if min_price is not None and (entry.price is None or entry.price < min_price):
+                continue
+            if max_price is not None and (entry.price is None or entry.price > max_price):
+                continue
+            matches.append(entry)
+
+        start = (page - 1) * page_size
+        return {
+            "data": [entry.card for entry in matches[start:start + page_size]],
+            "pagination": {
+                "page": page,
+                "page_size": page_size,
+                "total": len(matches),
+                "has_more": len(matches) > start + page_size
+            }
+        }
+
+    def cached_search(self, **params) -> tuple:
+        """帶響應緩存的 search，返回 (json_body, etag)"""
+        self._ensure_fresh()
+        key = tuple(sorted(params.items()))
+        now = time.time()
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None and now - cached[2] < RESPONSE_CACHE_TTL:
+                self._responses.move_to_end(key)
+                return cached[0], cached[1]
+            version = self.version
+
+        result = self.search(**params)
+        body = json.dumps({"success": True, **result}, ensure_ascii=False)
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+        with self._lock:
+            # 計算期間索引已變化則不緩存
+            if self.version == version:
+                self._responses[key] = (body, etag, now)
+                self._responses.move_to_end(key)
+                while len(self._responses) > RESPONSE_CACHE_SIZE:
+                    self._responses.popitem(last=False)
+        return body, etag
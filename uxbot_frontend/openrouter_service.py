@@ -4,14 +4,88 @@ OpenRouter API 整合服務 - 統一管理多個 LLM 提供商
 """
 
 import os
+import json
+import atexit
+import asyncio
+import threading
+import weakref
 import httpx
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterator
 from datetime import datetime
 
 # OpenRouter API Configuration
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
+# Connection pool settings
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "20"))
+OPENROUTER_MAX_KEEPALIVE = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "10"))
+OPENROUTER_KEEPALIVE_EXPIRY = float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", "30"))
+OPENROUTER_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+try:
+    import h2  # noqa: F401  HTTP/2 support for httpx is optional
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# ─────────────────────────────────────────────────────────────────
+# Pooled HTTP Clients - 進程級共用連接池（keep-alive / HTTP/2）
+# ─────────────────────────────────────────────────────────────────
+_sync_client: Optional[httpx.Client] = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "timeout": OPENROUTER_TIMEOUT,
+        "http2": HTTP2_AVAILABLE,
+        "limits": httpx.Limits(
+            max_connections=OPENROUTER_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENROUTER_MAX_KEEPALIVE,
+            keepalive_expiry=OPENROUTER_KEEPALIVE_EXPIRY
+        ),
+    }
+
+
+def get_http_client() -> httpx.Client:
+    """Get the process-wide pooled sync client (thread-safe)"""
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        with _client_lock:
+            if _sync_client is None or _sync_client.is_closed:
+                _sync_client = httpx.Client(**_client_options())
+    return _sync_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Get the pooled async client for the running event loop
+    AsyncClient 的連接綁定於事件循環，因此每個循環各一個
+    """
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(**_client_options())
+            _async_clients[loop] = client
+    return client
+
+
+def close_http_clients():
+    """Close pooled clients (called automatically at exit)"""
+    global _sync_client
+    with _client_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+        _async_clients.clear()
+
+
+atexit.register(close_http_clients)
+
 # ─────────────────────────────────────────────────────────────────
 # Model Mapping - Internal ID to OpenRouter Model ID
 # ─────────────────────────────────────────────────────────────────
@@ -83,30 +157,17 @@ class OpenRouterService:
     def __init__(self, api_key: str = None):
         self.api_key = api_key or OPENROUTER_API_KEY
         self.base_url = OPENROUTER_BASE_URL
-        
-    async def chat_completion(
+    
+    def _prepare_request(
         self,
         messages: List[Dict[str, str]],
-        model_id: str = 'deepseek_high',
-        use_fallback: bool = False,
-        max_tokens: int = 2000,
-        temperature: float = 0.7,
+        model_id: str,
+        use_fallback: bool,
+        max_tokens: int,
+        temperature: float,
         **kwargs
-    ) -> Dict[str, Any]:
-        """
-        Send chat completion request to OpenRouter
-        發送聊天完成請求
-        
-        Args:
-            messages: List of message dicts with 'role' and 'content'
-            model_id: Internal model ID (chatgpt5, gemini3, etc.)
-            use_fallback: If True, use fallback model instead
-            max_tokens: Maximum response tokens
-            temperature: Creativity setting (0-1)
-        
-        Returns:
-            Response dict with 'content', 'model_used', 'tokens_consumed'
-        """
+    ):
+        """Resolve model and build (actual_model_id, model_info, headers, payload)"""
         # Determine which model to use
         if use_fallback:
             actual_model_id = 'deepseek_chat'  # Default fallback
@@ -130,49 +191,86 @@ class OpenRouterService:
             "temperature": temperature,
             **kwargs
         }
+        return actual_model_id, model_info, headers, payload
+    
+    @staticmethod
+    def _success_result(actual_model_id, model_info, use_fallback, content, usage, raw_response=None):
+        result = {
+            "success": True,
+            "content": content,
+            "model_used": actual_model_id,
+            "model_name": model_info['name'],
+            "tokens_consumed": model_info['tokens_per_call'],
+            "is_fallback": use_fallback or model_info['tier'] == 'fallback',
+            "usage": usage
+        }
+        if raw_response is not None:
+            result["raw_response"] = raw_response
+        return result
+    
+    @staticmethod
+    def _error_result(actual_model_id, use_fallback, error):
+        if isinstance(error, httpx.HTTPStatusError):
+            message = f"API Error: {error.response.status_code}"
+        else:
+            message = str(error)
+        return {
+            "success": False,
+            "error": message,
+            "model_used": actual_model_id,
+            "tokens_consumed": 0,
+            "is_fallback": use_fallback
+        }
+    
+    @staticmethod
+    def _extract_content(data: Dict[str, Any]) -> str:
+        if data.get("choices") and len(data["choices"]) > 0:
+            return data["choices"][0].get("message", {}).get("content", "")
+        return ""
+    
+    async def chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model_id: str = 'deepseek_high',
+        use_fallback: bool = False,
+        max_tokens: int = 2000,
+        temperature: float = 0.7,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Send chat completion request to OpenRouter
+        發送聊天完成請求
+        
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            model_id: Internal model ID (chatgpt5, gemini3, etc.)
+            use_fallback: If True, use fallback model instead
+            max_tokens: Maximum response tokens
+            temperature: Creativity setting (0-1)
+        
+        Returns:
+            Response dict with 'content', 'model_used', 'tokens_consumed'
+        """
+        actual_model_id, model_info, headers, payload = self._prepare_request(
+            messages, model_id, use_fallback, max_tokens, temperature, **kwargs
+        )
         
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                # Extract response content
-                content = ""
-                if data.get("choices") and len(data["choices"]) > 0:
-                    content = data["choices"][0].get("message", {}).get("content", "")
-                
-                return {
-                    "success": True,
-                    "content": content,
-                    "model_used": actual_model_id,
-                    "model_name": model_info['name'],
-                    "tokens_consumed": model_info['tokens_per_call'],
-                    "is_fallback": use_fallback or model_info['tier'] == 'fallback',
-                    "usage": data.get("usage", {}),
-                    "raw_response": data
-                }
-                
-        except httpx.HTTPStatusError as e:
-            return {
-                "success": False,
-                "error": f"API Error: {e.response.status_code}",
-                "model_used": actual_model_id,
-                "tokens_consumed": 0,
-                "is_fallback": use_fallback
-            }
+            client = get_async_http_client()
+            response = await client.post(
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=payload
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            return self._success_result(
+                actual_model_id, model_info, use_fallback,
+                self._extract_content(data), data.get("usage", {}), data
+            )
         except Exception as e:
-            return {
-                "success": False,
-                "error": str(e),
-                "model_used": actual_model_id,
-                "tokens_consumed": 0,
-                "is_fallback": use_fallback
-            }
+            return self._error_result(actual_model_id, use_fallback, e)
     
     def chat_completion_sync(
         self,
@@ -185,73 +283,93 @@ class OpenRouterService:
     ) -> Dict[str, Any]:
         """
         Synchronous version of chat_completion
-        同步版本的聊天完成
+        同步版本的聊天完成（使用共用連接池）
         """
-        # Determine which model to use
-        if use_fallback:
-            actual_model_id = 'deepseek_chat'
-        else:
-            actual_model_id = model_id
-        
-        openrouter_model = MODEL_MAPPING.get(actual_model_id, MODEL_MAPPING['deepseek_chat'])
-        model_info = MODEL_INFO.get(actual_model_id, MODEL_INFO['deepseek_chat'])
+        actual_model_id, model_info, headers, payload = self._prepare_request(
+            messages, model_id, use_fallback, max_tokens, temperature, **kwargs
+        )
         
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://lynker.ai",
-            "X-Title": "LynkerAI"
-        }
+        try:
+            response = get_http_client().post(
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=payload
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            return self._success_result(
+                actual_model_id, model_info, use_fallback,
+                self._extract_content(data), data.get("usage", {}), data
+            )
+        except Exception as e:
+            return self._error_result(actual_model_id, use_fallback, e)
+    
+    def chat_completion_stream(
+        self,
+        messages: List[Dict[str, str]],
+        model_id: str = 'deepseek_high',
+        use_fallback: bool = False,
+        max_tokens: int = 2000,
+        temperature: float = 0.7,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming chat completion (OpenRouter SSE)
+        流式聊天完成，逐段產出：
+            {"type": "delta", "content": "...", "usage": {...}}   每個內容片段（usage 為累計用量）
+            {"type": "done", **result}                              結束，result 同 chat_completion_sync（含完整 content）
+            {"type": "error", **result}                             失敗（已輸出的片段不回收）
         
-        payload = {
-            "model": openrouter_model,
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            **kwargs
-        }
+        用量以上游最後回傳的 usage 為準；上游未回傳時 completion_tokens
+        按收到的內容片段數估算，並標記 "estimated": True
+        """
+        actual_model_id, model_info, headers, payload = self._prepare_request(
+            messages, model_id, use_fallback, max_tokens, temperature, **kwargs
+        )
+        payload["stream"] = True
+        payload.setdefault("stream_options", {"include_usage": True})
         
+        parts = []
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "estimated": True}
         try:
-            with httpx.Client(timeout=60.0) as client:
-                response = client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
+            with get_http_client().stream(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
                 response.raise_for_status()
-                data = response.json()
-                
-                content = ""
-                if data.get("choices") and len(data["choices"]) > 0:
-                    content = data["choices"][0].get("message", {}).get("content", "")
-                
-                return {
-                    "success": True,
-                    "content": content,
-                    "model_used": actual_model_id,
-                    "model_name": model_info['name'],
-                    "tokens_consumed": model_info['tokens_per_call'],
-                    "is_fallback": use_fallback or model_info['tier'] == 'fallback',
-                    "usage": data.get("usage", {}),
-                    "raw_response": data
-                }
-                
-        except httpx.HTTPStatusError as e:
-            return {
-                "success": False,
-                "error": f"API Error: {e.response.status_code}",
-                "model_used": actual_model_id,
-                "tokens_consumed": 0,
-                "is_fallback": use_fallback
-            }
+                for line in response.iter_lines():
+                    # SSE: 空行分隔事件，":" 開頭為註釋（OpenRouter 的 keep-alive）
+                    if not line or line.startswith(":") or not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"].get("message", str(chunk["error"])))
+                    
+                    if chunk.get("usage"):
+                        usage = {**chunk["usage"], "estimated": False}
+                    
+                    choices = chunk.get("choices") or []
+                    content = (choices[0].get("delta") or {}).get("content") if choices else None
+                    if content:
+                        parts.append(content)
+                        if usage["estimated"]:
+                            usage["completion_tokens"] += 1
+                            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                        yield {"type": "delta", "content": content, "usage": dict(usage)}
         except Exception as e:
-            return {
-                "success": False,
-                "error": str(e),
-                "model_used": actual_model_id,
-                "tokens_consumed": 0,
-                "is_fallback": use_fallback
-            }
+            yield {"type": "error", **self._error_result(actual_model_id, use_fallback, e)}
+            return
+        
+        yield {
+            "type": "done",
+            **self._success_result(actual_model_id, model_info, use_fallback, "".join(parts), usage)
+        }
     
     @staticmethod
     def get_model_info(model_id: str) -> Dict[str, Any]:
@@ -12,6 +12,8 @@ import json
 import stripe
 from supabase import create_client, Client
 
+from .token_ledger import get_token_ledger
+
 stripe_bp = Blueprint('stripe', __name__)
 
 # ─────────────────────────────────────────────────────────────────
@@ -315,6 +317,8 @@ def verify_session():
             print(f"[Stripe] Warning: Could not update {quota_table}: {quota_error}")
         
         print(f"[Stripe] Subscription activated successfully for {id_field}={entity_id}")
+        if not is_user_payment:
+            get_token_ledger().invalidate(entity_id)
         
         return jsonify({
             'success': True,
@@ -9,6 +9,8 @@ import uuid
 import os
 from supabase import create_client, Client
 
+from .token_ledger import get_token_ledger
+
 subscription_bp = Blueprint('subscription', __name__)
 
 # Initialize Supabase client
@@ -126,6 +128,8 @@ def create_subscription():
         except Exception as e:
             print(f"Warning: Could not initialize guru_ai_config: {e}")
         
+        get_token_ledger().invalidate(guru_id)
+        
         return jsonify({
             'success': True,
             'data': {
@@ -329,6 +333,7 @@ def use_token():
             'used_quota': new_used
         }).eq('guru_id', guru_id).execute()
         
+        get_token_ledger().invalidate(guru_id)
         new_remaining = quota - new_used
         
         return jsonify({
@@ -426,6 +431,8 @@ def update_ai_config():
                 'preferred_model': preferred_model
             }).execute()
         
+        get_token_ledger().invalidate(guru_id)
+        
         return jsonify({
             'success': True,
             'data': {
@@ -499,6 +506,8 @@ def reset_token():
         except:
             pass
         
+        get_token_ledger().invalidate(guru_id)
+        
         return jsonify({
             'success': True,
             'message': 'Token usage reset to 0'
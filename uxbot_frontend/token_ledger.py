@@ -0,0 +1,372 @@
+"""
+Guru Token Ledger - 進程內 Token 帳本
+替代每次對話的「讀訂閱 → 讀配置 → 讀後寫 token_used → 插入日誌」四次往返
+
+- 訂閱狀態 / AI 配置讀取走短 TTL 快取
+- 調用模型前原子預留 Token（reserve），成功後結算（settle），失敗則釋放（release）
+  預留額度計入已用，併發對話不會超出配額
+- 已結算的增量與使用日誌由後台線程批量寫回數據庫，同批日誌累加到使用量彙總（usage_rollups）
+- 訂閱快取過期時按 guru 各自加鎖重讀，不等待批量寫回；已取出寫回中、以及讀取期間剛寫回的增量
+  計入已用（可能短暫多計，下次重讀即校正，不會少計導致超額）
+  token_used 增量優先走 increment_guru_token_used RPC（原子遞增，見 SQL_INCREMENT_TOKEN_USED），
+  RPC 不存在時退回讀後寫（同一進程內已由帳本串行化），其他錯誤在下次 flush 重試
+- 進程退出時寫完剩餘增量與日誌
+"""
+
+import os
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+
+from supabase import create_client, Client
+from batch_writer import write_rows, is_missing_function
+from .usage_rollups import apply_usage_rollups, AI_USAGE_LOG_TABLE
+
+SUBSCRIPTION_CACHE_TTL = float(os.getenv("TOKEN_LEDGER_SUBSCRIPTION_TTL", "15"))
+AI_CONFIG_CACHE_TTL = float(os.getenv("TOKEN_LEDGER_CONFIG_TTL", "60"))
+FLUSH_INTERVAL = float(os.getenv("TOKEN_LEDGER_FLUSH_INTERVAL", "2"))
+FLUSH_BATCH_SIZE = 200
+MAX_ROLLUP_BACKLOG = 10 * FLUSH_BATCH_SIZE   # 彙總暫時寫不進去時最多保留的日誌行
+
+SUBSCRIPTION_TABLE = 'guru_subscriptions'
+AI_CONFIG_TABLE = 'guru_ai_config'
+DEFAULT_AI_CONFIG = {'preferred_model': 'deepseek_high'}
+
+# 在 Supabase SQL Editor 執行一次，啟用原子遞增
+SQL_INCREMENT_TOKEN_USED = """
+CREATE OR REPLACE FUNCTION increment_guru_token_used(p_guru_id UUID, p_delta INTEGER)
+RETURNS INTEGER AS $$
+    UPDATE guru_subscriptions
+    SET token_used = COALESCE(token_used, 0) + p_delta
+    WHERE guru_id = p_guru_id AND status = 'active'
+    RETURNING token_used;
+$$ LANGUAGE sql;
+"""
+
+
+class Reservation:
+    """一次對話預留的 Token；settle / release 只生效一次"""
+
+    def __init__(self, guru_id: str, tokens: int):
+        self.guru_id = guru_id
+        self.tokens = tokens
+        self.closed = False
+
+
+class _Account:
+    def __init__(self, subscription: Dict[str, Any]):
+        self.subscription = subscription   # 數據庫中讀到的訂閱行摘要
+        self.used = subscription.get('token_used', 0)  # 含本進程未寫回的增量
+        self.reserved = 0
+        self.pending = 0                   # 已結算、未寫回的增量
+        self.inflight = 0                  # 已取出、正在寫回的增量
+        self.written = 0                   # 累計已寫回的增量（跨重讀保留，用於判斷讀取期間的寫回）
+        self.loaded_at = time.time()
+
+
+class TokenLedger:
+    def __init__(self, client_factory=None, flush_interval: float = FLUSH_INTERVAL):
+        self._client_factory = client_factory or _default_client
+        self._client = None
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._accounts: Dict[str, _Account] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._configs: Dict[str, tuple] = {}
+        self._usage_rows: List[Dict[str, Any]] = []
+        self._rollup_backlog: List[Dict[str, Any]] = []
+        self._rpc_available = True
+        self._thread = None
+        self._closed = False
+        atexit.register(self.close)
+
+    @property
+    def client(self) -> Client:
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    # ---------- 讀取（快取） ----------
+
+    def _load_subscription(self, guru_id: str) -> Dict[str, Any]:
+        response = self.client.table(SUBSCRIPTION_TABLE).select('*').eq(
+            'guru_id', guru_id
+        ).eq('status', 'active').execute()
+        if response.data and len(response.data) > 0:
+            sub = response.data[0]
+            return {
+                'has_subscription': True,
+                'plan': sub.get('plan', 'free'),
+                'token_quota': sub.get('token_quota', 0),
+                'token_used': sub.get('token_used', 0),
+                'status': sub.get('status', 'active')
+            }
+        return {
+            'has_subscription': False,
+            'plan': None,
+            'token_quota': 0,
+            'token_used': 0,
+            'status': 'none'
+        }
+
+    def _is_fresh(self, guru_id: str) -> bool:
+        with self._lock:
+            account = self._accounts.get(guru_id)
+            return account is not None and time.time() - account.loaded_at < SUBSCRIPTION_CACHE_TTL
+
+    def _ensure_account(self, guru_id: str):
+        """快取過期時重新讀取訂閱（保留本進程未寫回的增量與預留）；之後在 _lock 內用 _accounts[guru_id]"""
+        if self._is_fresh(guru_id):
+            return
+        with self._lock:
+            load_lock = self._load_locks.setdefault(guru_id, threading.Lock())
+        # 每個 guru 各自加鎖，拿到鎖後再檢查一次，併發的未命中只讀一次
+        with load_lock:
+            if self._is_fresh(guru_id):
+                return
+            with self._lock:
+                previous = self._accounts.get(guru_id)
+                written_before = previous.written if previous is not None else 0
+            subscription = self._load_subscription(guru_id)
+            with self._lock:
+                self._replace_account(guru_id, subscription, written_before)
+
+    def _replace_account(self, guru_id: str, subscription: Dict[str, Any], written_before: int = 0) -> _Account:
+        """
+        讀到的 token_used 不一定包含正在寫回（inflight）或讀取期間剛寫回的增量，一律加上：
+        寧可短暫多計，也不少計
+        """
+        fresh = _Account(subscription)
+        previous = self._accounts.get(guru_id)
+        if previous is not None:
+            fresh.reserved = previous.reserved
+            fresh.pending = previous.pending
+            fresh.inflight = previous.inflight
+            fresh.written = previous.written
+            fresh.used += previous.pending + previous.inflight + (previous.written - written_before)
+        self._accounts[guru_id] = fresh
+        return fresh
+
+    def get_subscription_status(self, guru_id: str) -> Dict[str, Any]:
+        """與 ai_chat_routes.get_subscription_status 相同的結構；token_remaining 已扣除進行中的預留"""
+        self._ensure_account(guru_id)
+        with self._lock:
+            account = self._accounts[guru_id]
+            quota = account.subscription['token_quota']
+            return {
+                **account.subscription,
+                'token_used': account.used,
+                'token_remaining': quota - account.used - account.reserved
+            }
+
+    def get_ai_config(self, guru_id: str) -> Dict[str, Any]:
+        with self._lock:
+            cached = self._configs.get(guru_id)
+            if cached is not None and time.time() - cached[1] < AI_CONFIG_CACHE_TTL:
+                return cached[0]
+        response = self.client.table(AI_CONFIG_TABLE).select('*').eq('guru_id', guru_id).execute()
+        config = response.data[0] if response.data else dict(DEFAULT_AI_CONFIG)
+        with self._lock:
+            self._configs[guru_id] = (config, time.time())
+        return config
+
+    def invalidate(self, guru_id: Optional[str] = None):
+        """訂閱或配置在別處被修改後調用；不影響尚未寫回的增量"""
+        with self._lock:
+            targets = list(self._accounts) if guru_id is None else [guru_id]
+            for key in targets:
+                account = self._accounts.get(key)
+                if account is not None:
+                    account.loaded_at = 0
+                self._configs.pop(key, None)
+
+    # ---------- 預留 / 結算 ----------
+
+    def reserve(self, guru_id: str, tokens: int) -> Optional[Reservation]:
+        """原子預留 tokens，餘額不足時返回 None"""
+        self._ensure_account(guru_id)
+        with self._lock:
+            account = self._accounts[guru_id]
+            available = account.subscription['token_quota'] - account.used - account.reserved
+            if tokens <= 0 or available < tokens:
+                return None
+            account.reserved += tokens
+            return Reservation(guru_id, tokens)
+
+    def release(self, reservation: Optional[Reservation]):
+        """調用失敗，退回預留"""
+        if reservation is None:
+            return
+        with self._lock:
+            if reservation.closed:
+                return
+            reservation.closed = True
+            account = self._accounts.get(reservation.guru_id)
+            if account is not None:
+                account.reserved -= reservation.tokens
+
+    def settle(self, reservation: Optional[Reservation], tokens: int) -> int:
+        """按實際消耗結算預留，返回結算後的剩餘額度"""
+        if reservation is None:
+            return 0
+        with self._lock:
+            account = self._accounts.get(reservation.guru_id)
+            if not reservation.closed:
+                reservation.closed = True
+                if account is not None:
+                    account.reserved -= reservation.tokens
+                    account.used += tokens
+                    account.pending += tokens
+            remaining = account.subscription['token_quota'] - account.used - account.reserved if account else 0
+        self._ensure_thread()
+        return remaining
+
+    def charge(self, guru_id: str, tokens: int) -> bool:
+        """不經預留直接記賬（兼容舊 deduct_tokens），無有效訂閱時返回 False"""
+        self._ensure_account(guru_id)
+        with self._lock:
+            account = self._accounts[guru_id]
+            if not account.subscription['has_subscription']:
+                return False
+            account.used += tokens
+            account.pending += tokens
+        self._ensure_thread()
+        return True
+
+    def record_usage(self, guru_id: str, model_id: str, tokens_used: int, is_fallback: bool, success: bool):
+        with self._lock:
+            self._usage_rows.append({
+                'guru_id': guru_id,
+                'model_id': model_id,
+                'tokens_used': tokens_used,
+                'is_fallback': is_fallback,
+                'success': success,
+                'created_at': datetime.now(timezone.utc).isoformat()
+            })
+            full = len(self._usage_rows) >= FLUSH_BATCH_SIZE
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    # ---------- 批量寫回 ----------
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._closed:
+                    return
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="token-ledger-flush", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[Token Ledger] Flush error: {e}")
+
+    def _increment_token_used(self, guru_id: str, delta: int):
+        if self._rpc_available:
+            try:
+                self.client.rpc('increment_guru_token_used', {'p_guru_id': guru_id, 'p_delta': delta}).execute()
+                return
+            except Exception as e:
+                # 只有函數未創建時才退回讀後寫；網絡錯誤等交給 flush 重新排隊
+                if not is_missing_function(e):
+                    raise
+                print(f"[Token Ledger] RPC increment unavailable, falling back to read-update: {e}")
+                self._rpc_available = False
+        response = self.client.table(SUBSCRIPTION_TABLE).select('token_used').eq(
+            'guru_id', guru_id
+        ).eq('status', 'active').execute()
+        if response.data:
+            current_used = response.data[0].get('token_used', 0) or 0
+            self.client.table(SUBSCRIPTION_TABLE).update({
+                'token_used': current_used + delta
+            }).eq('guru_id', guru_id).eq('status', 'active').execute()
+
+    def flush(self) -> Dict[str, int]:
+        """寫回所有未寫回的 token_used 增量與使用日誌"""
+        with self._flush_lock:
+            with self._lock:
+                deltas = {}
+                for guru_id, account in self._accounts.items():
+                    if account.pending:
+                        deltas[guru_id] = account.pending
+                        account.inflight += account.pending
+                        account.pending = 0
+                rows, self._usage_rows = self._usage_rows, []
+
+            failed = {}
+            for guru_id, delta in deltas.items():
+                try:
+                    self._increment_token_used(guru_id, delta)
+                    ok = True
+                except Exception as e:
+                    print(f"[Token Ledger] Error flushing {delta} tokens for {guru_id}: {e}")
+                    failed[guru_id] = delta
+                    ok = False
+                # 帳戶可能在寫回期間被重讀替換，按 guru_id 取當前對象
+                with self._lock:
+                    account = self._accounts[guru_id]
+                    account.inflight -= delta
+                    if ok:
+                        account.written += delta
+                    else:
+                        account.pending += delta
+
+            if rows:
+                # 日誌寫入失敗不影響主流程（表可能尚未創建）
+                write_rows(self.client, AI_USAGE_LOG_TABLE, rows, verbose=False)
+            rollup_rows = self._rollup_backlog + rows
+            self._rollup_backlog = []
+            if rollup_rows:
+                try:
+                    apply_usage_rollups(self.client, rollup_rows)
+                except Exception as e:
+                    # 下次 flush 重試；積壓過多時丟棄最舊的，可用 usage_rollups --days 重算
+                    print(f"[Token Ledger] Usage rollup error, will retry: {e}")
+                    self._rollup_backlog = rollup_rows[-MAX_ROLLUP_BACKLOG:]
+
+        return {'guru_count': len(deltas) - len(failed), 'usage_rows': len(rows)}
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[Token Ledger] Final flush error: {e}")
+
+
+def _default_client() -> Client:
+    return create_client(
+        os.getenv("SUPABASE_URL", ""),
+        os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_KEY", ""))
+    )
+
+
+_ledger: Optional[TokenLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_token_ledger() -> TokenLedger:
+    """Get the process-wide token ledger"""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = TokenLedger()
+    return _ledger
@@ -0,0 +1,191 @@
+"""
+Guru AI Usage Rollups - AI 使用量預聚合
+按 guru / 模型 / 天、小時 累計 calls、tokens、fallbacks、failures，
+/api/ai/usage-stats 只讀取彙總行，不再掃描 guru_ai_usage_logs 明細
+
+- 寫入時更新：TokenLedger 批量寫日誌時調用 apply_usage_rollups()，
+  增量走 increment_guru_usage_rollups RPC（原子累加，見 SQL_USAGE_ROLLUPS），
+  RPC 不存在時退回讀後 upsert，其他錯誤拋出由調用方處理
+- 壓實 / 回填：rebuild_usage_rollups() 從明細日誌重算最近 N 天的彙總（冪等）
+
+    python -m uxbot_frontend.usage_rollups --days 90
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Iterable
+
+from batch_writer import write_rows, is_missing_function
+
+ROLLUP_TABLE = 'guru_ai_usage_rollups'
+AI_USAGE_LOG_TABLE = 'guru_ai_usage_logs'
+ROLLUP_KEY = 'guru_id,granularity,bucket,model_id'
+COUNTERS = ('calls', 'tokens', 'fallbacks', 'failures')
+GRANULARITIES = {
+    'day': 10,    # 'YYYY-MM-DD'
+    'hour': 13,   # 'YYYY-MM-DDTHH'
+}
+PAGE_SIZE = 1000
+
+# 在 Supabase SQL Editor 執行一次
+SQL_USAGE_ROLLUPS = """
+CREATE TABLE IF NOT EXISTS guru_ai_usage_rollups (
+    guru_id UUID NOT NULL,
+    granularity TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    fallbacks INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (guru_id, granularity, bucket, model_id)
+);
+
+CREATE OR REPLACE FUNCTION increment_guru_usage_rollups(p_rows JSONB)
+RETURNS VOID AS $$
+    INSERT INTO guru_ai_usage_rollups AS r
+        (guru_id, granularity, bucket, model_id, calls, tokens, fallbacks, failures)
+    SELECT (x->>'guru_id')::UUID, x->>'granularity', x->>'bucket', x->>'model_id',
+           (x->>'calls')::INTEGER, (x->>'tokens')::INTEGER,
+           (x->>'fallbacks')::INTEGER, (x->>'failures')::INTEGER
+    FROM jsonb_array_elements(p_rows) AS x
+    ON CONFLICT (guru_id, granularity, bucket, model_id) DO UPDATE SET
+        calls = r.calls + EXCLUDED.calls,
+        tokens = r.tokens + EXCLUDED.tokens,
+        fallbacks = r.fallbacks + EXCLUDED.fallbacks,
+        failures = r.failures + EXCLUDED.failures,
+        updated_at = NOW();
+$$ LANGUAGE sql;
+"""
+
+_rpc_available = True
+
+
+def bucket_key(created_at: str, granularity: str) -> str:
+    """ISO 時間字串截取為 天 / 小時 桶（與舊版 created_at[:10] 的日期口徑一致）"""
+    return created_at[:GRANULARITIES[granularity]]
+
+
+def rollup_rows(logs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """明細日誌 → 天 / 小時 兩種粒度的彙總行"""
+    totals = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for log in logs:
+        created_at = log.get('created_at')
+        if not created_at or not log.get('guru_id'):
+            continue
+        for granularity in GRANULARITIES:
+            counters = totals[(
+                log['guru_id'], granularity, bucket_key(created_at, granularity), log.get('model_id') or 'unknown'
+            )]
+            counters['calls'] += 1
+            counters['tokens'] += log.get('tokens_used') or 0
+            counters['fallbacks'] += 1 if log.get('is_fallback') else 0
+            counters['failures'] += 0 if log.get('success', True) else 1
+    return [
+        {'guru_id': guru_id, 'granularity': granularity, 'bucket': bucket, 'model_id': model_id, **counters}
+        for (guru_id, granularity, bucket, model_id), counters in totals.items()
+    ]
+
+
+def _merge_with_existing(client, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """RPC 不可用時：讀出已有彙總行，加上增量後整行 upsert"""
+    by_guru = defaultdict(list)
+    for row in rows:
+        by_guru[row['guru_id']].append(row)
+
+    merged = []
+    for guru_id, guru_rows in by_guru.items():
+        buckets = sorted({row['bucket'] for row in guru_rows})
+        response = client.table(ROLLUP_TABLE).select('*').eq('guru_id', guru_id).in_('bucket', buckets).execute()
+        existing = {
+            (r['granularity'], r['bucket'], r['model_id']): r
+            for r in (response.data or [])
+        }
+        for row in guru_rows:
+            current = existing.get((row['granularity'], row['bucket'], row['model_id']), {})
+            merged.append({**row, **{c: (current.get(c) or 0) + row[c] for c in COUNTERS}})
+    return merged
+
+
+def apply_usage_rollups(client, logs: List[Dict[str, Any]]) -> int:
+    """把一批新寫入的明細日誌累加到彙總表，返回更新的彙總行數"""
+    global _rpc_available
+    rows = rollup_rows(logs)
+    if not rows:
+        return 0
+    if _rpc_available:
+        try:
+            client.rpc('increment_guru_usage_rollups', {'p_rows': rows}).execute()
+            return len(rows)
+        except Exception as e:
+            if not is_missing_function(e):
+                raise
+            print(f"[AI Usage] Rollup RPC unavailable, falling back to read-upsert: {e}")
+            _rpc_available = False
+    write_rows(client, ROLLUP_TABLE, _merge_with_existing(client, rows), upsert=True, on_conflict=ROLLUP_KEY, verbose=False)
+    return len(rows)
+
+
+def fetch_usage_rollups(client, guru_id: str, since: datetime, granularity: str = 'day') -> List[Dict[str, Any]]:
+    """讀取 guru 自 since 起的彙總行（按桶排序，分頁讀取，不受 PostgREST max-rows 截斷）"""
+    rows = []
+    offset = 0
+    while True:
+        page = client.table(ROLLUP_TABLE).select(
+            'bucket,model_id,' + ','.join(COUNTERS)
+        ).eq('guru_id', guru_id).eq('granularity', granularity).gte(
+            'bucket', bucket_key(since.isoformat(), granularity)
+        ).order('bucket', desc=False).order('model_id', desc=False).range(
+            offset, offset + PAGE_SIZE - 1
+        ).execute().data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+    return rows
+
+
+def rebuild_usage_rollups(client, days: int = 90, guru_id: Optional[str] = None) -> Dict[str, int]:
+    """
+    從明細日誌重算最近 days 天的彙總（整行覆蓋，可重複執行）
+    用於首次回填，或 RPC 不可用期間的多進程寫入校正
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    # 起始日整天重算，避免覆蓋成只含部分明細的值
+    since = since.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    logs = []
+    offset = 0
+    while True:
+        query = client.table(AI_USAGE_LOG_TABLE).select(
+            'guru_id,model_id,tokens_used,is_fallback,success,created_at'
+        ).gte('created_at', since.isoformat())
+        if guru_id:
+            query = query.eq('guru_id', guru_id)
+        page = query.order('created_at', desc=False).range(offset, offset + PAGE_SIZE - 1).execute().data or []
+        logs.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+
+    rows = rollup_rows(logs)
+    stats = write_rows(client, ROLLUP_TABLE, rows, upsert=True, on_conflict=ROLLUP_KEY)
+    return {'logs': len(logs), 'rollups': stats['rows'], 'failed': stats['failed']}
+
+
+if __name__ == '__main__':
+    import argparse
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description='從 guru_ai_usage_logs 重算使用量彙總')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--guru-id', default=None)
+    args = parser.parse_args()
+
+    supabase = create_client(
+        os.getenv("SUPABASE_URL", ""),
+        os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_KEY", ""))
+    )
+    print(rebuild_usage_rollups(supabase, days=args.days, guru_id=args.guru_id))
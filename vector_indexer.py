@@ -1,8 +1,10 @@
-import os, json, re, time, argparse
+import os, re, time, argparse, hashlib, queue, threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import faiss
+from vector_meta_store import ChunkMetaStore
 
 try:
     from pdfminer.high_level import extract_text as pdf_extract
@@ -18,7 +20,23 @@ VAULT_DIR = Path("lynker_master_vault")
 VSTORE_DIR = VAULT_DIR / "vector_store"
 VSTORE_DIR.mkdir(parents=True, exist_ok=True)
 INDEX_FILE = VSTORE_DIR / "faiss.index"
-META_FILE  = VSTORE_DIR / "meta.json"
+META_FILE  = VSTORE_DIR / "meta.json"      # 旧版元数据，仅用于迁移
+META_DB    = VSTORE_DIR / "meta.sqlite"
+
+# 索引类型：flat（精确）| ivf（IVF-Flat）| hnsw
+INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")
+IVF_NLIST  = int(os.getenv("VECTOR_IVF_NLIST", "0"))   # 0 = 按向量数自动选择
+IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+HNSW_M     = int(os.getenv("VECTOR_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = 200
+RECALL_K = 10
+RECALL_QUERIES = 200
+COMPACT_RATIO = 0.2   # HNSW 墓碑向量超过该比例时重建
+
+# 流水线参数：抽取进程数 / 跨文件嵌入批大小 / 阶段间队列长度
+EXTRACT_WORKERS  = int(os.getenv("VECTOR_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+EMBED_BATCH_SIZE = int(os.getenv("VECTOR_EMBED_BATCH_SIZE", "64"))
+PIPELINE_QUEUE_SIZE = 32
 
 _model = None
 
@@ -69,57 +87,318 @@ def scan_docs():
             if f.is_file() and f.suffix.lower() in exts:
                 yield cat, f
 
-def build_or_update(rebuild=False):
-    meta = {"items": []}
-    xb = None
+def create_index(index_type, xb):
+    """
+    按类型创建并训练索引（向量均已归一化，内积即余弦）
+    返回的索引均支持 add_with_ids：flat / hnsw 包一层 IndexIDMap2，IVF 原生支持
+    向量太少无法训练 IVF 时退回 flat
+    """
+    dim = xb.shape[1]
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(hnsw)
+    if index_type == "ivf":
+        # faiss 建议每个聚类中心至少 39 个训练点
+        nlist = IVF_NLIST or int(4 * np.sqrt(len(xb)))
+        nlist = min(nlist, len(xb) // 39)
+        if nlist >= 2:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            print(f"🏋️ Training IVF index (nlist={nlist}, {len(xb)} vectors)...")
+            index.train(xb)
+            index.nprobe = min(IVF_NPROBE, nlist)
+            return index
+        print(f"⚠️ 向量数 {len(xb)} 不足以训练 IVF，改用 flat 索引。")
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+def index_kind(index):
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+def ensure_id_map(index):
+    """旧版按位置编号的 flat / hnsw 索引转换为 IndexIDMap2（id = 原位置）"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF)):
+        return index
+    print("🔧 Converting legacy index to IndexIDMap2...")
+    xb = index.reconstruct_n(0, index.ntotal)
+    converted = create_index(index_kind(index), xb)
+    converted.add_with_ids(xb, np.arange(index.ntotal, dtype="int64"))
+    return converted
+
+def remove_vectors(index, ids):
+    """
+    删除向量；HNSW 不支持删除，此时只删元数据（检索时跳过缺失 id），
+    返回是否真正从索引中删除
+    """
+    try:
+        index.remove_ids(np.array(ids, dtype="int64"))
+        return True
+    except RuntimeError:
+        return False
+
+def compact_index(index, live_ids):
+    """用仍存活的向量重建索引，清理 HNSW 中的墓碑向量"""
+    print(f"🧹 Compacting index ({index.ntotal} → {len(live_ids)} vectors)...")
+    ids = np.array(live_ids, dtype="int64")
+    xb = np.vstack([index.reconstruct(int(i)) for i in ids]) if len(ids) else np.zeros((0, index.d), "float32")
+    compacted = create_index(index_kind(index), xb)
+    if len(ids):
+        compacted.add_with_ids(xb, ids)
+    return compacted
+
+def evaluate_recall(index, xb, ids, k=RECALL_K, n_queries=RECALL_QUERIES):
+    """以 flat 精确检索为基准，计算 ANN 索引的 recall@k（用库内向量作为查询）"""
+    if index_kind(index) == "flat" or len(xb) == 0:
+        return 1.0
+    k = min(k, len(xb))
+    rng = np.random.default_rng(0)
+    queries = xb[rng.choice(len(xb), size=min(n_queries, len(xb)), replace=False)]
+    flat = faiss.IndexFlatIP(xb.shape[1])
+    flat.add(xb)
+    _, truth = flat.search(queries, k)
+    truth = ids[truth]
+    _, found = index.search(queries, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / float(truth.size)
+
+def content_hash(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class StageStats:
+    """流水线单阶段的吞吐统计"""
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.seconds = 0.0
+
+    def add(self, items, seconds):
+        self.items += items
+        self.seconds += seconds
+
+    def report(self):
+        rate = self.items / self.seconds if self.seconds > 0 else 0.0
+        return f"{self.name}: {self.items} {self.unit} / {self.seconds:.2f}s ({rate:.1f} {self.unit}/s)"
+
+def _extract(path_str):
+    """进程池任务：抽取单个文件的文本，返回 (文本, 耗时)"""
+    t0 = time.perf_counter()
+    text = read_text(Path(path_str))
+    return text, time.perf_counter() - t0
+
+def run_pipeline(jobs, model, batch_size=EMBED_BATCH_SIZE, workers=EXTRACT_WORKERS):
+    """
+    流式索引流水线：抽取（进程池）→ 切块 → 跨文件批量嵌入，阶段之间为有界队列
+
+    jobs: [(job, path)]，job 原样回传
+    产出: (job, chunks, embeddings)，顺序与 jobs 一致
+    """
+    stats = [StageStats("extract", "files"), StageStats("chunk", "chunks"), StageStats("embed", "chunks")]
+    extract_stats, chunk_stats, embed_stats = stats
+    futures_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    chunks_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    done = object()
+    errors = []
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+
+    def feed():
+        try:
+            for job, path in jobs:
+                futures_q.put((job, pool.submit(_extract, str(path))))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            futures_q.put(done)
+
+    def chunker():
+        try:
+            while True:
+                item = futures_q.get()
+                if item is done:
+                    break
+                job, fut = item
+                text, elapsed = fut.result()
+                extract_stats.add(1, elapsed)
+                t0 = time.perf_counter()
+                chunks = split_chunks(text)
+                chunk_stats.add(len(chunks), time.perf_counter() - t0)
+                chunks_q.put((job, chunks))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            chunks_q.put(done)
+
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=chunker, daemon=True)]
+    for t in threads:
+        t.start()
+
+    def flush(pending):
+        texts = [c for _, chunks in pending for c in chunks]
+        t0 = time.perf_counter()
+        embs = np.array(model.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype="float32")
+        embed_stats.add(len(texts), time.perf_counter() - t0)
+        offset = 0
+        for job, chunks in pending:
+            yield job, chunks, embs[offset:offset + len(chunks)]
+            offset += len(chunks)
+
+    t_start = time.perf_counter()
+    try:
+        # 跨文件攒批：小文件合并成一个嵌入批次
+        pending, pending_n = [], 0
+        while True:
+            item = chunks_q.get()
+            if item is done:
+                break
+            job, chunks = item
+            if not chunks:
+                yield job, chunks, None
+                continue
+            pending.append((job, chunks))
+            pending_n += len(chunks)
+            if pending_n >= batch_size:
+                yield from flush(pending)
+                pending, pending_n = [], 0
+        if pending:
+            yield from flush(pending)
+    finally:
+        for t in threads:
+            t.join(timeout=1)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if errors:
+        raise errors[0]
+    total = time.perf_counter() - t_start
+    print(f"📈 Pipeline ({workers} extract workers, batch={batch_size}, wall {total:.2f}s)")
+    for st in stats:
+        print(f"   - {st.report()}")
+
+def build_or_update(rebuild=False, index_type=None, workers=None, batch_size=None):
+    index_type = index_type or INDEX_TYPE
+    store = ChunkMetaStore(META_DB)
     index = None
 
-    if INDEX_FILE.exists() and META_FILE.exists() and not rebuild:
+    if rebuild:
+        store.clear()
+    elif INDEX_FILE.exists():
         print("🔁 Loading existing index for incremental update...")
-        index = faiss.read_index(str(INDEX_FILE))
-        meta = json.loads(META_FILE.read_text(encoding="utf-8"))
+        index = ensure_id_map(faiss.read_index(str(INDEX_FILE)))
+        if store.count() == 0 and META_FILE.exists():
+            n = store.import_json(META_FILE)
+            print(f"📦 已从 meta.json 迁移 {n} 条 chunk 元数据")
+    else:
+        store.clear()
 
-    model = get_model()
-    added = 0
+    manifest = store.get_manifest()
+    seen = set()
+    stale_ids = []
+    jobs = []
+    stamps = {}
+    new_embs, new_ids = [], []
+    added = changed = 0
     for cat, f in scan_docs():
         file_id = f"{cat}/{f.name}"
-        if not rebuild and any(it["file_id"] == file_id for it in meta["items"]):
+        seen.add(file_id)
+        st = f.stat()
+
+        # 1. mtime + 大小未变：直接跳过，不读文件
+        old = manifest.get(file_id)
+        if old and old[1] == st.st_mtime and old[2] == st.st_size:
             continue
 
-        txt = read_text(f)
-        chunks = split_chunks(txt)
-        if not chunks:
+        # 2. 内容哈希未变（仅 touch）：只更新清单
+        digest = content_hash(f)
+        if old and old[0] == digest:
+            store.set_file(file_id, digest, st.st_mtime, st.st_size)
             continue
-        
-        embs = model.encode(chunks, normalize_embeddings=True)
-        embs = np.array(embs, dtype="float32")
 
-        if index is None:
-            index = faiss.IndexFlatIP(embs.shape[1])
-        index.add(embs)
-
-        for i, c in enumerate(chunks):
-            meta["items"].append({
-                "file_id": file_id,
-                "category": cat,
-                "chunk_id": i,
-                "text": c
-            })
-        added += len(chunks)
-        print(f"📚 Indexed: {file_id} ({len(chunks)} chunks)")
-
-    if index is None:
+        if old is None and store.has_file(file_id):
+            # 升级前已索引、尚无清单记录的文件：直接纳入清单
+            store.set_file(file_id, digest, st.st_mtime, st.st_size)
+            continue
+
+        # 3. 新文件或内容变更：删除旧向量，交给流水线只嵌入新 chunk
+        #    清单在产出 chunk 后才写入；提取为空（缺少 pdfminer、提取出错）的文件下次运行重试
+        if old:
+            stale_ids += store.remove_file(file_id)
+            changed += 1
+        stamps[file_id] = (digest, st.st_mtime, st.st_size)
+        jobs.append(((cat, file_id), f))
+
+    if jobs:
+        model = get_model()
+        results = run_pipeline(
+            jobs, model,
+            batch_size=batch_size or EMBED_BATCH_SIZE,
+            workers=min(workers or EXTRACT_WORKERS, len(jobs))
+        )
+        for (cat, file_id), chunks, embs in results:
+            if not chunks:
+                continue
+            store.set_file(file_id, *stamps[file_id])
+            ids = store.allocate_ids(len(chunks))
+            new_embs.append(embs)
+            new_ids.extend(ids)
+
+            store.add_many(ids, [
+                {"file_id": file_id, "category": cat, "chunk_id": i, "text": c}
+                for i, c in enumerate(chunks)
+            ])
+            added += len(chunks)
+            print(f"📚 Indexed: {file_id} ({len(chunks)} chunks)")
+
+    # 4. 已删除的文件
+    for file_id in set(manifest) - seen:
+        stale_ids += store.remove_file(file_id)
+        print(f"🗑️ Removed: {file_id}")
+
+    if index is None and not new_embs:
         print("⚠️ 没有文档可索引。")
+        store.commit()
         return
 
+    if stale_ids and index is not None and not remove_vectors(index, stale_ids):
+        # HNSW：墓碑过多时重建（只统计已在索引中的向量，本轮新 chunk 尚未写入）
+        pending = set(new_ids)
+        live_ids = [i for i in store.all_ids() if i not in pending]
+        if index.ntotal - len(live_ids) > COMPACT_RATIO * index.ntotal:
+            index = compact_index(index, live_ids)
+
+    if new_embs:
+        xb = np.concatenate(new_embs)
+        ids = np.array(new_ids, dtype="int64")
+        if index is None:
+            # 首次构建 / 重建：先训练再写入，并报告相对 flat 的召回率
+            index = create_index(index_type, xb)
+            index.add_with_ids(xb, ids)
+            recall = evaluate_recall(index, xb, ids)
+            print(f"🎯 {index_kind(index)} recall@{RECALL_K} vs flat: {recall:.3f}")
+        else:
+            index.add_with_ids(xb, ids)
+
     faiss.write_index(index, str(INDEX_FILE))
-    META_FILE.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
-    print(f"✅ 索引完成：{len(meta['items'])} chunks | 新增 {added} chunks")
+    store.commit()
+    print(f"✅ 索引完成：{store.count()} chunks | 新增 {added} chunks | 更新 {changed} 个文件 | 移除 {len(stale_ids)} chunks")
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--rebuild", action="store_true", help="重建索引（忽略历史）")
+    ap.add_argument("--index-type", choices=["flat", "ivf", "hnsw"], default=None,
+                    help="索引类型（默认读取 VECTOR_INDEX_TYPE，切换类型需配合 --rebuild）")
+    ap.add_argument("--workers", type=int, default=None, help="文本抽取进程数")
+    ap.add_argument("--batch-size", type=int, default=None, help="跨文件嵌入批大小")
     args = ap.parse_args()
     t0 = time.time()
-    build_or_update(rebuild=args.rebuild)
+    build_or_update(rebuild=args.rebuild, index_type=args.index_type,
+                    workers=args.workers, batch_size=args.batch_size)
     print(f"⏱️ 用时：{time.time()-t0:.2f}s")
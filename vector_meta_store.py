@@ -0,0 +1,155 @@
+"""
+向量库 chunk 元数据存储（SQLite）
+
+替代整份载入内存的 meta.json：
+- 每个 chunk 一行，主键即 faiss 向量 id
+- 检索时只按命中的 id 读取，不再把所有 chunk 正文常驻内存
+- 写入为增量 INSERT，不再整文件重写
+- files 表记录每个源文件的内容哈希 / mtime / 大小（增量索引的清单）
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class ChunkMetaStore:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                category TEXT,
+                chunk_id INTEGER,
+                text TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON chunks(file_id)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    # ---------- 写入 ----------
+    def add_many(self, ids, items):
+        """写入一批 chunk（不提交，由调用方在索引落盘后 commit）"""
+        with self._lock:
+            self.conn.executemany(
+                "INSERT INTO chunks (id, file_id, category, chunk_id, text) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (int(i), it["file_id"], it.get("category"), it.get("chunk_id"), it.get("text"))
+                    for i, it in zip(ids, items)
+                ]
+            )
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM state")
+
+    def allocate_ids(self, n):
+        """分配 n 个新的向量 id（单调递增，已删除的 id 不会复用）"""
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM state WHERE key = 'next_id'").fetchone()
+            if row is None:
+                row = self.conn.execute("SELECT MAX(id) FROM chunks").fetchone()
+                start = 0 if row[0] is None else row[0] + 1
+            else:
+                start = int(row[0])
+            self.conn.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES ('next_id', ?)", (str(start + n),)
+            )
+        return list(range(start, start + n))
+
+    def remove_file(self, file_id):
+        """删除文件的所有 chunk 与清单记录，返回被删除的向量 id"""
+        with self._lock:
+            ids = [r[0] for r in self.conn.execute(
+                "SELECT id FROM chunks WHERE file_id = ?", (file_id,)
+            ).fetchall()]
+            self.conn.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+            self.conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+        return ids
+
+    # ---------- 文件清单 ----------
+    def get_manifest(self):
+        """返回 {file_id: (content_hash, mtime, size)}"""
+        with self._lock:
+            rows = self.conn.execute("SELECT file_id, content_hash, mtime, size FROM files").fetchall()
+        return {r[0]: (r[1], r[2], r[3]) for r in rows}
+
+    def set_file(self, file_id, content_hash, mtime, size):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (file_id, content_hash, mtime, size) VALUES (?, ?, ?, ?)",
+                (file_id, content_hash, mtime, size)
+            )
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self.conn.rollback()
+
+    def import_json(self, meta_file: Path):
+        """从旧版 meta.json 迁移（向量 id = 列表下标）"""
+        meta = json.loads(Path(meta_file).read_text(encoding="utf-8"))
+        items = meta.get("items", [])
+        self.clear()
+        self.add_many(range(len(items)), items)
+        self.commit()
+        return len(items)
+
+    # ---------- 读取 ----------
+    def count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def next_id(self):
+        with self._lock:
+            row = self.conn.execute("SELECT MAX(id) FROM chunks").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def all_ids(self):
+        with self._lock:
+            return [r[0] for r in self.conn.execute("SELECT id FROM chunks ORDER BY id").fetchall()]
+
+    def has_file(self, file_id):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT 1 FROM chunks WHERE file_id = ? LIMIT 1", (file_id,)
+            ).fetchone() is not None
+
+    def get_many(self, ids):
+        """按向量 id 批量读取，返回 {id: item}"""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT id, file_id, category, chunk_id, text FROM chunks WHERE id IN ({placeholders})",
+                ids
+            ).fetchall()
+        return {
+            r[0]: {"file_id": r[1], "category": r[2], "chunk_id": r[3], "text": r[4]}
+            for r in rows
+        }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -1,16 +1,23 @@
-import json
+import os
 import numpy as np
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 import faiss
+from vector_meta_store import ChunkMetaStore
 
 VAULT_DIR = Path("lynker_master_vault")
 VSTORE_DIR = VAULT_DIR / "vector_store"
 INDEX_FILE = VSTORE_DIR / "faiss.index"
-META_FILE  = VSTORE_DIR / "meta.json"
+META_FILE  = VSTORE_DIR / "meta.json"      # 旧版元数据，仅用于迁移
+META_DB    = VSTORE_DIR / "meta.sqlite"
+
+# ANN 检索参数（flat 索引忽略）
+IVF_NPROBE     = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "64"))
 
 _model = None
 _index = None
+_index_mtime = None
 _meta  = None
 
 def get_model():
@@ -20,32 +27,45 @@ def get_model():
     return _model
 
 def load_store():
-    global _index, _meta
-    if _index is None:
-        if not INDEX_FILE.exists():
-            raise FileNotFoundError(f"索引文件不存在: {INDEX_FILE}")
+    global _index, _index_mtime, _meta
+    if not INDEX_FILE.exists():
+        raise FileNotFoundError(f"索引文件不存在: {INDEX_FILE}")
+    # 索引文件被增量更新后自动重新加载
+    mtime = INDEX_FILE.stat().st_mtime
+    if _index is None or mtime != _index_mtime:
         _index = faiss.read_index(str(INDEX_FILE))
+        _index_mtime = mtime
+        base = faiss.downcast_index(_index.index) if isinstance(_index, faiss.IndexIDMap) else _index
+        if hasattr(base, "nprobe"):
+            base.nprobe = IVF_NPROBE
+        if hasattr(base, "hnsw"):
+            base.hnsw.efSearch = HNSW_EF_SEARCH
     if _meta is None:
-        if not META_FILE.exists():
-            raise FileNotFoundError(f"元数据文件不存在: {META_FILE}")
-        _meta = json.loads(META_FILE.read_text(encoding="utf-8"))
+        if not META_DB.exists() and not META_FILE.exists():
+            raise FileNotFoundError(f"元数据文件不存在: {META_DB}")
+        _meta = ChunkMetaStore(META_DB)
+        if _meta.count() == 0 and META_FILE.exists():
+            _meta.import_json(META_FILE)
     return _index, _meta
 
 def search(query: str, topk=5):
     model = get_model()
     index, meta = load_store()
     q = model.encode([query], normalize_embeddings=True).astype("float32")
-    D, I = index.search(q, topk)
+    # 多取一些候选：HNSW 中已删除文件的向量仍在索引内，需跳过
+    D, I = index.search(q, min(index.ntotal, topk * 2) or topk)
+    # 只按命中的 id 读取 chunk 元数据
+    items = meta.get_many([idx for idx in I[0] if idx >= 0])
     hits = []
     for score, idx in zip(D[0], I[0]):
-        if idx < 0 or idx >= len(meta["items"]):
+        item = items.get(int(idx))
+        if item is None:
             continue
-        item = meta["items"][idx]
         hits.append({
             "score": float(score),
             **item
         })
-    return hits
+    return hits[:topk]
 
 if __name__ == "__main__":
     from pprint import pprint